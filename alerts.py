@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+# Matches for one user within this window arrive as a single message.
+ALERT_BATCH_DELAY = 2.0
+# listings named in one alert message; the rest are dropped from that batch
+MAX_PARTS_PER_ALERT = 10
+# alert messages in flight at once (the rate limiter paces them further)
+SEND_CONCURRENCY = 8
+
+
+class IntervalIndex:
+    """Closed intervals [lo, hi] queried by the point they contain.
+
+    A centered interval tree answers a query in O(log n + k). Intervals added
+    since the last build wait in a short list that queries scan directly, and
+    removed ones are skipped; the tree is rebuilt once either backlog grows
+    past a fraction of its size, so rebuilds cost O(log n) per change overall.
+    """
+
+    def __init__(self):
+        self._intervals: Dict[int, Tuple[float, float]] = {}
+        self._root = None
+        self._pending: Dict[int, Tuple[float, float]] = {}
+        self._removed: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._intervals)
+
+    def add(self, item_id: int, lo: float, hi: float):
+        self.remove(item_id)
+        self._intervals[item_id] = self._pending[item_id] = (lo, hi)
+        self._maybe_rebuild()
+
+    def remove(self, item_id: int):
+        if self._intervals.pop(item_id, None) is None:
+            return
+        if self._pending.pop(item_id, None) is None:
+            self._removed.add(item_id)
+        self._maybe_rebuild()
+
+    def _maybe_rebuild(self):
+        if len(self._pending) + len(self._removed) > max(512, len(self._intervals) // 16):
+            self._root = self._build([(lo, hi, i) for i, (lo, hi) in self._intervals.items()])
+            self._pending.clear()
+            self._removed.clear()
+
+    @classmethod
+    def _build(cls, items):
+        # node: (center, [(lo, id)] ascending, [(hi, id)] descending, left, right)
+        if not items:
+            return None
+        points = sorted(p for lo, hi, _ in items for p in (lo, hi))
+        center = points[len(points) // 2]
+        left = [it for it in items if it[1] < center]
+        right = [it for it in items if it[0] > center]
+        here = [it for it in items if it[0] <= center <= it[1]]
+        return (center, sorted((lo, i) for lo, _, i in here), sorted(((hi, i) for _, hi, i in here), reverse=True),
+                cls._build(left), cls._build(right))
+
+    def stab(self, x: float) -> Iterator[int]:
+        node = self._root
+        while node is not None:
+            center, by_lo, by_hi, left, right = node
+            if x < center:
+                for lo, i in by_lo:
+                    if lo > x:
+                        break
+                    if i not in self._removed:
+                        yield i
+                node = left
+            elif x > center:
+                for hi, i in by_hi:
+                    if hi < x:
+                        break
+                    if i not in self._removed:
+                        yield i
+                node = right
+            else:
+                yield from (i for _, i in by_lo if i not in self._removed)
+                break
+        yield from (i for i, (lo, hi) in self._pending.items() if lo <= x <= hi)
+
+
+class AlertIndex:
+    """Saved searches indexed so that a new listing is only checked against
+    the searches it could match.
+
+    Keyword searches are filed under their rarest term at the time they are
+    saved (so a common word doesn't pull in thousands of candidates) and
+    VIN/OEM searches under their code prefix; a listing looks up every prefix
+    of its words and codes, so the cost follows the listing's length and the
+    number of hits, not the number of saved searches. Price ranges live in an
+    IntervalIndex. Keys come from database.py, already folded and normalized.
+    """
+
+    def __init__(self):
+        self._terms: Dict[str, Set[int]] = {}
+        self._all_terms: Dict[int, Tuple[str, ...]] = {}
+        self._anchor: Dict[int, str] = {}
+        self._codes: Dict[str, Dict[str, Set[int]]] = {"vin": {}, "oem": {}}
+        self._prices = IntervalIndex()
+        self._entries: Dict[int, Tuple[int, str, object]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, search_id: int, user_id: int, mode: str, key):
+        # ``key`` is the tuple of terms for "name", the code prefix for "vin" /
+        # "oem" and (min, max) for "price"
+        with self._lock:
+            self._remove(search_id)
+            self._entries[search_id] = (user_id, mode, key)
+            if mode == "name":
+                self._all_terms[search_id] = key
+                anchor = min(key, key=lambda t: (len(self._terms.get(t, ())), -len(t)))
+                self._anchor[search_id] = anchor
+                self._terms.setdefault(anchor, set()).add(search_id)
+            elif mode == "price":
+                self._prices.add(search_id, *key)
+            else:
+                self._codes[mode].setdefault(key, set()).add(search_id)
+
+    def remove(self, search_id: int):
+        with self._lock:
+            self._remove(search_id)
+
+    def _remove(self, search_id: int):
+        entry = self._entries.pop(search_id, None)
+        if entry is None:
+            return
+        _, mode, key = entry
+        if mode == "name":
+            del self._all_terms[search_id]
+            table, key = self._terms, self._anchor.pop(search_id)
+        elif mode == "price":
+            self._prices.remove(search_id)
+            return
+        else:
+            table = self._codes[mode]
+        bucket = table[key]
+        bucket.discard(search_id)
+        if not bucket:
+            del table[key]
+
+    def match(self, tokens, vin_norm: str, oem_norm: str, price: Optional[float]) -> Dict[int, int]:
+        """{user_id: search_id} of the saved searches a listing satisfies."""
+        hits: Dict[int, int] = {}
+        with self._lock:
+            if self._terms:
+                prefixes = {tok[:i] for tok in tokens for i in range(1, len(tok) + 1)}
+                for p in prefixes:
+                    for sid in self._terms.get(p, ()):
+                        if all(t in prefixes for t in self._all_terms[sid]):
+                            hits.setdefault(self._entries[sid][0], sid)
+            for mode, code in (("vin", vin_norm), ("oem", oem_norm)):
+                table = self._codes[mode]
+                for i in range(1, len(code) + 1) if table else ():
+                    for sid in table.get(code[:i], ()):
+                        hits.setdefault(self._entries[sid][0], sid)
+            if price is not None:
+                for sid in self._prices.stab(price):
+                    hits.setdefault(self._entries[sid][0], sid)
+        return hits
+
+
+class AlertDispatcher:
+    """Collects (user, listing) matches and sends each user one message per
+    ALERT_BATCH_DELAY window, however many uploads matched in it."""
+
+    def __init__(self, send: Callable[[int, List[int]], Awaitable[None]], delay: float = ALERT_BATCH_DELAY):
+        self._send = send
+        self.delay = delay
+        self._pending: Dict[int, List[int]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.matches = 0
+        self.messages = 0
+
+    def notify(self, user_ids, part_id: int):
+        for user_id in user_ids:
+            self.matches += 1
+            parts = self._pending.setdefault(user_id, [])
+            if len(parts) < MAX_PARTS_PER_ALERT:
+                parts.append(part_id)
+        if self._pending and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        batch, self._pending = self._pending, {}
+        slots = asyncio.Semaphore(SEND_CONCURRENCY)
+
+        async def deliver(user_id: int, part_ids: List[int]):
+            async with slots:
+                try:
+                    await self._send(user_id, part_ids)
+                    self.messages += 1
+                except Exception:
+                    log.exception("alert to %s failed", user_id)
+        await asyncio.gather(*(deliver(u, p) for u, p in batch.items()))
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {"matches": self.matches, "messages": self.messages, "pending": len(self._pending)}
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware
+
+import database as db
+
+log = logging.getLogger(__name__)
+
+# Events collected within this window reach the database as one transaction.
+FLUSH_DELAY = 2.0
+# held while the database is unavailable; the oldest are dropped beyond this
+MAX_PENDING = 50_000
+# users known to be in the users table; forgotten past this many (re-checking
+# one is a cheap INSERT OR IGNORE)
+MAX_KNOWN_USERS = 200_000
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+class EventLog:
+    """Buffers search/view/contact events and first sightings of users, and
+    writes them with the rollups they feed (``db.record_events``) once per
+    FLUSH_DELAY. Used from the event loop only."""
+
+    def __init__(self, flush_delay: float = FLUSH_DELAY):
+        self.flush_delay = flush_delay
+        self._events: List[Tuple] = []
+        self._users: Dict[int, Tuple[str, Optional[str]]] = {}
+        self._known: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self.recorded = 0
+        self.new_users = 0
+        self.flushes = 0
+        self.dropped = 0
+
+    def _add(self, kind: str, user_id: int, part_id: Optional[int] = None, mode: Optional[str] = None,
+             query: Optional[str] = None, results: Optional[int] = None):
+        self._events.append((_now(), kind, user_id, part_id, mode, query, results))
+        self._schedule()
+
+    def search(self, user_id: int, mode: str, query: str, results: int):
+        # ``results``: rows on the first page, so 0 means nothing was found
+        self._add("search", user_id, mode=mode, query=query, results=results)
+
+    def view(self, user_id: int, part_id: int):
+        self._add("view", user_id, part_id)
+
+    def contact(self, user_id: int, part_id: int):
+        self._add("contact", user_id, part_id)
+
+    def seen(self, user_id: int, username: Optional[str] = None):
+        if user_id not in self._known and user_id not in self._users:
+            self._users[user_id] = (_now(), username)
+            self._schedule()
+
+    def _schedule(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._events and not self._users:
+            return
+        events, self._events = self._events, []
+        users, self._users = self._users, {}
+        try:
+            self.new_users += await db.record_events(events, [(u, ts, name) for u, (ts, name) in users.items()])
+        except Exception:
+            log.exception("writing %d analytics events failed", len(events))
+            # put them back for the next flush
+            self._events = events + self._events
+            if len(self._events) > MAX_PENDING:
+                self.dropped += len(self._events) - MAX_PENDING
+                self._events = self._events[-MAX_PENDING:]
+            self._users = {**users, **self._users}
+            self._schedule()
+            return
+        self.recorded += len(events)
+        self.flushes += 1
+        if len(self._known) + len(users) > MAX_KNOWN_USERS:
+            self._known.clear()
+        self._known.update(users)
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        if self._flush_task is not None:
+            # the last flush failed; there is no later one to retry in
+            self._flush_task.cancel()
+            self._flush_task = None
+
+    def stats(self) -> dict:
+        return {"recorded": self.recorded, "new_users": self.new_users, "flushes": self.flushes,
+                "pending": len(self._events), "dropped": self.dropped}
+
+
+class SeenUsersMiddleware(BaseMiddleware):
+    """Outer update middleware adding everyone who talks to the bot to the
+    users table (through the EventLog's batches)."""
+
+    def __init__(self, events: EventLog):
+        self.events = events
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is not None:
+            self.events.seen(user.id, user.username)
+        return await handler(event, data)
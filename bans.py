@@ -0,0 +1,55 @@
+from typing import Optional, Set
+
+from aiogram import BaseMiddleware
+
+import database as db
+import metrics
+
+DROPPED = metrics.Counter("bot_banned_updates_total", "Updates from banned users, dropped unhandled")
+
+
+class BanList:
+    """Banned user ids, held in memory so checking an update costs a set
+    lookup. Loaded at startup; ``ban``/``unban`` change the database and the
+    set together. Worker processes ``refresh`` it to pick up bans made by the
+    others. Used from the event loop only."""
+
+    def __init__(self):
+        self._ids: Set[int] = set()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def load(self):
+        # blocking; call at startup
+        self._ids = set(db.banned_user_ids.sync())
+
+    async def refresh(self):
+        self._ids = set(await db.banned_user_ids())
+
+    async def ban(self, user_id: int, reason: Optional[str] = None, banned_by: Optional[int] = None):
+        await db.ban_user(user_id, reason, banned_by)
+        self._ids.add(user_id)
+
+    async def unban(self, user_id: int) -> bool:
+        removed = await db.unban_user(user_id)
+        self._ids.discard(user_id)
+        return removed
+
+
+class BanMiddleware(BaseMiddleware):
+    """Outer update middleware that drops updates from banned users. It has
+    to sit before the FSM middleware, which reads the user's state."""
+
+    def __init__(self, bans: BanList):
+        self.bans = bans
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is not None and user.id in self.bans:
+            DROPPED.inc()
+            return None
+        return await handler(event, data)
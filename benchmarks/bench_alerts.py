@@ -0,0 +1,136 @@
+# Matching new uploads against saved searches: the indexed AlertIndex
+# (inverted index of terms and code prefixes, interval tree of price ranges)
+# against checking every saved search in turn. Also counts how many alert
+# messages the dispatcher's batching saves during a burst of uploads.
+#
+#   python benchmarks/bench_alerts.py [--searches 100000] [--uploads 5000]
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import alerts  # noqa: E402
+import database as db  # noqa: E402
+
+PARTS = ["brake", "pad", "filter", "oil", "rotor", "bumper", "mirror", "sensor", "pump", "belt",
+         "headlight", "radiator", "clutch", "spark", "plug", "shock", "absorber", "gasket", "hose", "alternator"]
+MAKES = ["bosch", "valeo", "denso", "brembo", "mann", "mahle", "febi", "lemforder", "sachs", "ngk",
+         "trw", "ate", "hella", "gates", "contitech"]
+MODELS = [f"m{i}" for i in range(2000)]
+VIN_MODELS = [f"WVWZZZ{random.Random(i).randrange(10**5):05d}" for i in range(3000)]
+OEMS = [f"{i:03d}-{i * 7 % 1000:03d}-{i % 97:03d}" for i in range(5000)]
+
+
+def saved_search(rnd: random.Random):
+    r = rnd.random()
+    if r < 0.55:
+        words = [rnd.choice(PARTS)] + rnd.sample(MAKES + MODELS, rnd.randrange(1, 3))
+        return {"mode": "name", "q": " ".join(words)}
+    if r < 0.7:
+        vin = rnd.choice(VIN_MODELS)
+        return {"mode": "vin", "q": vin + (f"{rnd.randrange(10**6):06d}" if rnd.random() < 0.5 else "")}
+    if r < 0.9:
+        return {"mode": "oem", "q": rnd.choice(OEMS)}
+    lo = round(rnd.uniform(0, 800), 2)
+    return {"mode": "price", "min": lo, "max": round(lo + rnd.expovariate(1 / 10), 2)}
+
+
+def upload(rnd: random.Random):
+    name = f"{rnd.choice(PARTS)} {rnd.choice(MAKES)} {rnd.choice(MODELS)}"
+    return (rnd.choice(VIN_MODELS) + f"{rnd.randrange(10**6):06d}", rnd.choice(OEMS), name,
+            round(rnd.uniform(5, 900), 2), " ".join(rnd.sample(PARTS, 5)))
+
+
+def linear_matcher(searches):
+    # the same rules, checked against every saved search
+    checks = []
+    for user_id, s in searches:
+        key = db._alert_key(s["mode"], s.get("q"), s.get("min"), s.get("max"))
+        checks.append((user_id, s["mode"], key))
+
+    def match(vin, oem, name, price, description):
+        probe = db._probe(0, vin, oem, name, price, description)
+        hits = {}
+        for user_id, mode, key in checks:
+            if mode == "name":
+                ok = all(any(tok.startswith(t) for tok in probe["tokens"]) for t in key)
+            elif mode == "price":
+                ok = key[0] <= probe["price"] <= key[1]
+            else:
+                ok = probe[f"{mode}_norm"].startswith(key)
+            if ok:
+                hits.setdefault(user_id, 0)
+        return hits
+    return match
+
+
+def timed(fn, items):
+    samples, found = [], 0
+    for item in items:
+        t0 = time.perf_counter()
+        found += len(fn(*item))
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99)], found / len(items)
+
+
+async def burst(uploads, matches, window: float):
+    sent = []
+
+    async def send(user_id, part_ids):
+        sent.append(len(part_ids))
+    dispatcher = alerts.AlertDispatcher(send, delay=window)
+    for part_id, hits in enumerate(matches):
+        dispatcher.notify(hits, part_id)
+        await asyncio.sleep(0)
+    await dispatcher.close()
+    return dispatcher.stats()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--searches", type=int, default=100_000)
+    ap.add_argument("--uploads", type=int, default=5000)
+    ap.add_argument("--linear-sample", type=int, default=50)
+    args = ap.parse_args()
+    rnd = random.Random(21)
+    # users keep up to MAX_SAVED_SEARCHES each
+    searches = [(i // 4, saved_search(rnd)) for i in range(args.searches)]
+    uploads = [upload(rnd) for _ in range(args.uploads)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.configure(os.path.join(tmp, "bench.db"))
+        db.init_db()
+        t0 = time.perf_counter()
+        for user_id, search in searches:
+            db.save_search.sync(user_id, search)
+        print(f"saved {args.searches} searches in {time.perf_counter() - t0:.1f}s")
+        db.configure()  # drop the in-memory index, as after a restart
+        t0 = time.perf_counter()
+        db.match_saved_searches.sync(*uploads[0])
+        print(f"index loaded from SQLite in {time.perf_counter() - t0:.2f}s")
+
+        p50, p99, avg = timed(lambda *u: db.match_saved_searches.sync(*u), uploads)
+        print(f"indexed:      p50 {p50 * 1000:7.3f} ms | p99 {p99 * 1000:7.3f} ms | {avg:.1f} users alerted per upload")
+        match = linear_matcher(searches)
+        p50, p99, lin_avg = timed(match, uploads[:args.linear_sample])
+        print(f"linear scan:  p50 {p50 * 1000:7.1f} ms | p99 {p99 * 1000:7.1f} ms | {lin_avg:.1f} users alerted per upload")
+        sample = uploads[:args.linear_sample]
+        assert all(db.match_saved_searches.sync(*u).keys() == match(*u).keys() for u in sample), "results differ"
+
+        matches = [db.match_saved_searches.sync(*u) for u in uploads]
+        db.close()
+    for window in (0.0, 2.0):
+        # all uploads land inside the window when it is non-zero
+        stats = asyncio.run(burst(uploads, matches, window))
+        print(f"burst of {len(uploads)} uploads, window {window:.0f}s: {stats['matches']} matches "
+              f"-> {stats['messages']} messages")
+
+
+if __name__ == "__main__":
+    main()
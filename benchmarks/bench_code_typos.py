@@ -0,0 +1,89 @@
+# VIN/OEM lookups one typo away, through the code_variants table, on a fresh
+# process (nothing built in memory beforehand): the first lookup, then a run
+# of distinct ones. Each query is a stored code with one character changed,
+# dropped or added early enough that no stored code starts like it (a VIN's
+# first 11 characters are its prefix tier).
+#
+#   python benchmarks/bench_code_typos.py [--codes 100000] [--queries 500]
+import argparse
+import os
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database as db  # noqa: E402
+
+CHUNK = 10_000
+ALPHABET = string.ascii_uppercase + string.digits
+
+
+def seed(n: int, rnd: random.Random):
+    vins, oems = [], []
+    for start in range(0, n, CHUNK):
+        rows = []
+        for _ in range(start, min(n, start + CHUNK)):
+            vin = "".join(rnd.choices(ALPHABET, k=17))
+            oem = f"{rnd.randrange(10 ** 5):05d}-{rnd.randrange(10 ** 5):05d}"
+            vins.append(vin)
+            oems.append(db.normalize_code(oem))
+            rows.append((vin, oem, "bench part", 100.0, "", None, 1, "seller"))
+        db.add_parts_bulk.sync(rows)
+    return vins, oems
+
+
+def typo(code: str, rnd: random.Random) -> str:
+    i = rnd.randrange(1, min(len(code), db.VIN_MODEL_PREFIX))
+    kind = rnd.choice("sdi")
+    if kind == "d":
+        return code[:i] + code[i + 1:]
+    c = rnd.choice([x for x in ALPHABET if x != code[i]])
+    return code[:i] + c + (code[i + 1:] if kind == "s" else code[i:])
+
+
+def timed(fn, queries):
+    samples, hits = [], 0
+    for q in queries:
+        t0 = time.perf_counter()
+        hits += bool(fn(q))
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1], hits
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--codes", type=int, default=100_000)
+    ap.add_argument("--queries", type=int, default=500)
+    args = ap.parse_args()
+    rnd = random.Random(3)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        path = os.path.join(tmp, "bench.db")
+        db.configure(path)
+        db.init_db()
+        t0 = time.perf_counter()
+        vins, oems = seed(args.codes, rnd)
+        print(f"{args.codes} listings ({len(set(vins))} VINs, {len(set(oems))} OEM codes) "
+              f"seeded in {time.perf_counter() - t0:.1f}s")
+        # a new process: empty query cache, nothing in memory
+        db.configure(path)
+        db.query_cache.max_entries = 0
+        vin_queries = [typo(v, rnd) for v in rnd.sample(vins, args.queries)]
+        oem_queries = [typo(o, rnd) for o in rnd.sample(oems, args.queries)]
+        t0 = time.perf_counter()
+        db.search_parts_by_vin.sync(vin_queries[0])
+        print(f"first typo lookup: {(time.perf_counter() - t0) * 1000:.2f} ms")
+        for label, fn, queries in (("vin", db.search_parts_by_vin.sync, vin_queries[1:]),
+                                   ("oem", db.search_parts_by_oem.sync, oem_queries)):
+            p50, p99, hits = timed(fn, queries)
+            print(f"{label}  p50 {p50 * 1000:6.2f} ms | p99 {p99 * 1000:6.2f} ms  ({hits}/{len(queries)} found)")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
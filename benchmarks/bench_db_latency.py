@@ -0,0 +1,112 @@
+# Handler latency with 200 concurrent simulated users: the old connect-per-call
+# sqlite access running on the event loop vs. the pooled executor layer.
+#
+#   python benchmarks/bench_db_latency.py [--users 200] [--rounds 5] [--parts 20000] [--think 1.0]
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database as db  # noqa: E402
+
+
+def seed(path: str, n: int):
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE IF NOT EXISTS parts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, vin TEXT, oem TEXT, name TEXT, price REAL,
+        description TEXT, photo_path TEXT, uploader_id INTEGER, uploader_username TEXT, upload_date TEXT)""")
+    rnd = random.Random(1)
+    words = ["brake", "pad", "filter", "oil", "rotor", "bumper", "mirror", "sensor", "pump", "belt"]
+    conn.executemany(
+        "INSERT INTO parts (vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date) "
+        "VALUES (?, ?, ?, ?, ?, '', ?, NULL, '2024-01-01')",
+        [(f"VIN{i:014d}", f"OEM-{i % 5000}", " ".join(rnd.sample(words, 2)), rnd.uniform(5, 900),
+          " ".join(rnd.sample(words, 4)), rnd.randrange(1000)) for i in range(n)])
+    conn.commit()
+    conn.close()
+
+
+# --- the pre-pool access pattern, kept verbatim in spirit
+def legacy_query(path: str, sql: str, params: tuple):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute(sql, params)
+    rows = c.fetchall()
+    conn.close()
+    return rows
+
+
+THINK_TIME = 1.0
+
+ACTIONS = [
+    ("browse", "SELECT * FROM parts ORDER BY id DESC LIMIT ?", lambda r: (10,)),
+    ("view", "SELECT * FROM parts WHERE id = ?", lambda r: (r.randrange(1, 1000),)),
+    ("search", "SELECT * FROM parts WHERE LOWER(name) LIKE ? OR LOWER(description) LIKE ?",
+     lambda r: ("%pump%", "%pump%")),
+    ("price", "SELECT * FROM parts WHERE price BETWEEN ? AND ? ORDER BY price LIMIT 10", lambda r: (100, 110)),
+]
+
+
+async def run_user(mode: str, path: str, rounds: int, think: float, seed_: int, samples: list):
+    # open loop: each user clicks on its own schedule, and latency is measured
+    # from the moment the click *should* have been handled, so time spent
+    # waiting behind a blocked event loop is counted too
+    rnd = random.Random(seed_)
+    loop = asyncio.get_running_loop()
+    due = loop.time()
+    for _ in range(rounds):
+        due += rnd.expovariate(1 / think)
+        await asyncio.sleep(max(0.0, due - loop.time()))
+        name, sql, params = rnd.choice(ACTIONS)
+        t0 = due
+        if mode == "legacy":
+            legacy_query(path, sql, params(rnd))
+        else:
+            await _pooled_query(sql, params(rnd))
+        await asyncio.sleep(0)  # stands in for the Bot API send that follows
+        samples.append(loop.time() - t0)
+
+
+@db._pooled
+def _pooled_query(conn, sql, params):
+    return conn.execute(sql, params).fetchall()
+
+
+async def scenario(mode: str, path: str, users: int, rounds: int, think: float):
+    samples: list = []
+    t0 = time.perf_counter()
+    await asyncio.gather(*(run_user(mode, path, rounds, think, i, samples) for i in range(users)))
+    wall = time.perf_counter() - t0
+    samples.sort()
+    p50 = statistics.median(samples)
+    p99 = samples[int(len(samples) * 0.99) - 1]
+    print(f"{mode:>7}: {len(samples)} handler calls in {wall:.2f}s | "
+          f"p50 {p50 * 1000:.1f} ms | p99 {p99 * 1000:.1f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--parts", type=int, default=20000)
+    ap.add_argument("--think", type=float, default=THINK_TIME, help="mean seconds between a user's clicks")
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        seed(path, args.parts)
+        asyncio.run(scenario("legacy", path, args.users, args.rounds, args.think))
+        db.configure(path)
+        try:
+            asyncio.run(scenario("pooled", path, args.users, args.rounds, args.think))
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
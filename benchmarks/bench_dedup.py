@@ -0,0 +1,72 @@
+# Near-duplicate photo lookup: multi-index hashing vs. a BK-tree vs. a linear
+# scan over N random 64-bit perceptual hashes, with planted near-duplicates.
+#
+#   python benchmarks/bench_dedup.py [--hashes 1000000] [--queries 2000] [--radius 6]
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bktree import BKTree  # noqa: E402
+from hamming import MultiIndexHash, hamming  # noqa: E402
+
+
+def flip(h: int, bits: int, rnd: random.Random) -> int:
+    for b in rnd.sample(range(64), bits):
+        h ^= 1 << b
+    return h
+
+
+def timed(search, queries):
+    samples = []
+    for q in queries:
+        t0 = time.perf_counter()
+        search(q)
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99)]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--hashes", type=int, default=1_000_000)
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--radius", type=int, default=6)
+    ap.add_argument("--bktree", type=int, default=100_000, help="BK-tree size (it is slow to build); 0 skips it")
+    args = ap.parse_args()
+    rnd = random.Random(9)
+    hashes = [rnd.getrandbits(64) for _ in range(args.hashes)]
+
+    t0 = time.perf_counter()
+    index = MultiIndexHash()
+    for item_id, h in enumerate(hashes):
+        index.add(item_id, h)
+    print(f"multi-index: {len(index)} hashes indexed in {time.perf_counter() - t0:.1f}s")
+
+    # half the queries re-post a stored photo (a few bits off), half are new
+    queries = [flip(rnd.choice(hashes), rnd.randrange(args.radius + 1), rnd) if i % 2 else rnd.getrandbits(64)
+               for i in range(args.queries)]
+    hits = sum(bool(index.search(q, args.radius)) for q in queries)
+    p50, p99 = timed(lambda q: index.search(q, args.radius), queries)
+    print(f"multi-index  radius {args.radius}: p50 {p50 * 1000:7.3f} ms | p99 {p99 * 1000:7.3f} ms "
+          f"| {hits}/{len(queries)} queries matched")
+
+    sample = hashes[:max(1, len(hashes) // 10)]
+    p50, _ = timed(lambda q: [h for h in sample if hamming(q, h) <= args.radius], queries[:20])
+    print(f"linear scan  radius {args.radius}: p50 {p50 * 1000 * len(hashes) / len(sample):7.1f} ms "
+          f"(extrapolated from {len(sample)} hashes)")
+
+    if args.bktree:
+        tree = BKTree(hamming)
+        for h in hashes[:args.bktree]:
+            tree.add(h)
+        p50, p99 = timed(lambda q: tree.search(q, args.radius), queries[:200])
+        print(f"bk-tree      radius {args.radius}: p50 {p50 * 1000:7.3f} ms | p99 {p99 * 1000:7.3f} ms "
+              f"(only {len(tree)} hashes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+# Drives the real dispatcher with a population of scripted users going through
+# upload, browse, search, view and contact, with the Bot API answered by the
+# in-process fake session. Users act concurrently and click the buttons the
+# bot actually sent them. Reports throughput, p50/p95/p99 per handler and per
+# action, the share of handler time spent in the database, and Bot API calls
+# per action.
+#
+# As a regression gate: save a run with --save, then compare later runs with
+# --baseline; the exit status is 1 if throughput, an action's p95, a handler's
+# p50 or the API calls per action got worse than --tolerance allows. (A
+# handler's p95 under full load is mostly time queued behind other users'
+# handlers, too noisy to gate on.) --repeat runs the simulation that
+# many times in fresh processes and keeps the median of each figure, which is
+# what makes p95s steady enough to gate on.
+#
+#   python benchmarks/bench_flows.py [--users 50] [--actions 40] [--parts 5000] [--warmup 3]
+#       [--mix upload=1,browse=4,search=4,view=3,contact=1] [--api-latency 0.0] [--repeat 3]
+#       [--fsm sqlite] [--save base.json | --baseline base.json --tolerance 0.25]
+import argparse
+import asyncio
+import contextvars
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aiogram import BaseMiddleware  # noqa: E402
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware  # noqa: E402
+from aiogram.types import InlineKeyboardMarkup  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import fakeapi  # noqa: E402
+
+ACTIONS = ("upload", "browse", "search", "view", "contact")
+DEFAULT_MIX = "upload=1,browse=4,search=4,view=3,contact=1"
+WORDS = ["brake", "pad", "filter", "oil", "rotor", "bumper", "mirror", "sensor", "pump", "belt", "clutch", "radiator"]
+# latencies below this are compared as this, so noise on sub-millisecond
+# handlers does not fail the gate
+LATENCY_FLOOR = 0.002
+# handlers with fewer samples are reported but not gated
+MIN_SAMPLES = 50
+# more Bot API calls per action than the baseline by this much is a regression;
+# button choices vary a little with how concurrent users interleave
+API_CALLS_SLACK = 0.1
+
+# the action the current user task is performing; Bot API calls are counted against it
+_action: contextvars.ContextVar = contextvars.ContextVar("action", default="other")
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def make_photo(seed: int) -> bytes:
+    # distinct noise per seed, so uploads don't look like duplicates of each other
+    rnd = random.Random(seed)
+    img = Image.new("RGB", (16, 12))
+    img.putdata([(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)) for _ in range(16 * 12)])
+    buf = io.BytesIO()
+    img.resize((640, 480)).save(buf, "JPEG", quality=80)
+    return buf.getvalue()
+
+
+class SimSession(fakeapi.FakeSession):
+    """FakeSession that serves a different photo per file id and remembers
+    the callback buttons last sent to each chat, for users to click."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.buttons: Dict[int, List[str]] = {}
+
+    async def make_request(self, bot, method, timeout: Optional[int] = None):
+        markup = getattr(method, "reply_markup", None)
+        if isinstance(markup, InlineKeyboardMarkup):
+            self.buttons[int(method.chat_id)] = [b.callback_data for row in markup.inline_keyboard for b in row
+                                                 if b.callback_data]
+        return await super().make_request(bot, method, timeout)
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield make_photo(hash(url))
+
+
+class CallsPerAction(BaseRequestMiddleware):
+    def __init__(self):
+        self.calls: Counter = Counter()
+
+    async def __call__(self, make_request, bot, method):
+        self.calls[_action.get()] += 1
+        return await make_request(bot, method)
+
+
+class HandlerTimes(BaseMiddleware):
+    """Inner middleware keeping every handler duration, for exact percentiles."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    async def __call__(self, handler, event, data):
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.samples[data["handler"].callback.__name__].append(time.perf_counter() - t0)
+
+
+class SimUser:
+    def __init__(self, user_id: int, sim: "Simulation"):
+        self.id = user_id
+        self.sim = sim
+        self.rnd = random.Random(user_id)
+        self.uploads = 0
+
+    async def send(self, text: Optional[str] = None, photo: Optional[str] = None):
+        await self.sim.feed(fakeapi.message_update(self.id, text, photo))
+
+    async def click(self, data: str):
+        await self.sim.feed(fakeapi.callback_update(self.id, data))
+
+    def buttons(self, prefix: str) -> List[str]:
+        return [b for b in self.sim.session.buttons.get(self.id, ()) if b.startswith(prefix)]
+
+    async def upload(self):
+        self.uploads += 1
+        rnd = self.rnd
+        await self.click("upload")
+        for text in (f"WVWZZZ1JZXW{rnd.randrange(10 ** 6):06d}", f"{rnd.randrange(10 ** 5):05d}-{self.id}",
+                     " ".join(rnd.sample(WORDS, 2)), f"{rnd.uniform(5, 900):.2f}", "used, good condition"):
+            await self.send(text)
+        await self.send(photo=f"AgACsim{self.id:06d}{self.uploads:04d}")
+        await self.click("confirm_upload")
+
+    async def browse(self):
+        await self.click("browse")
+        if self.rnd.random() < 0.5:
+            await self.next_page()
+
+    async def next_page(self):
+        pages = [b for b in self.buttons("pg:") if ":n:" in b]
+        if pages:
+            await self.click(pages[0])
+
+    async def search(self):
+        rnd = self.rnd
+        await self.click("search")
+        mode = rnd.choice(("name", "name", "oem", "vin", "price"))
+        await self.click(f"search_{mode}")
+        if mode == "price":
+            low = rnd.randrange(5, 800)
+            await self.send(str(low))
+            await self.send(str(low + rnd.randrange(5, 100)))
+        elif mode == "name":
+            await self.send(rnd.choice(WORDS))
+        elif mode == "oem":
+            await self.send(f"OEM-{rnd.randrange(1, 3000)}")
+        else:
+            await self.send(f"WVWZZZ1JZXW{rnd.randrange(10 ** 3):03d}")
+        if rnd.random() < 0.3:
+            await self.next_page()
+
+    async def view(self) -> int:
+        shown = self.buttons("view_")
+        part_id = int(self.rnd.choice(shown)[5:]) if shown else self.rnd.randrange(1, self.sim.parts + 1)
+        await self.click(f"view_{part_id}")
+        return part_id
+
+    async def contact(self):
+        part_id = await self.view()
+        await self.click(f"contact_{part_id}")
+
+    async def cold_start(self):
+        # codes nothing starts with, so the lookups fall through to the typo
+        # tolerant tier
+        for mode, code in (("vin", "ZZZZZZZZZZZZZZZZZ"), ("oem", "ZZZZ-ZZZZ")):
+            await self.click("search")
+            await self.click(f"search_{mode}")
+            await self.send(code)
+
+
+class Simulation:
+    def __init__(self, bot_module, session: SimSession, parts: int):
+        self.bot_module = bot_module
+        self.session = session
+        self.parts = parts
+        self.updates = 0
+        self.action_times: Dict[str, List[float]] = defaultdict(list)
+
+    async def feed(self, update):
+        self.updates += 1
+        await self.bot_module.dp.feed_update(self.bot_module.bot, update)
+
+    async def run_user(self, user: SimUser, actions: int, mix: Dict[str, float], think: float):
+        names, weights = zip(*mix.items())
+        for _ in range(actions):
+            name = user.rnd.choices(names, weights)[0]
+            token = _action.set(name)
+            t0 = time.perf_counter()
+            try:
+                await getattr(user, name)()
+            finally:
+                self.action_times[name].append(time.perf_counter() - t0)
+                _action.reset(token)
+            if think:
+                await asyncio.sleep(user.rnd.expovariate(1 / think))
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ACTIONS:
+            raise SystemExit(f"unknown action {name!r}; expected one of {', '.join(ACTIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# arguments that must match for two runs to be comparable
+CONFIG = ("users", "actions", "parts", "warmup", "mix", "api_latency", "think", "fsm", "rate_limit")
+
+
+def db_seconds(metrics) -> float:
+    return sum(counts[-1] for counts in metrics.DB_LATENCY.values().values())
+
+
+def seed(db, parts: int):
+    rnd = random.Random(7)
+    for start in range(0, parts, 5000):
+        db.add_parts_bulk.sync([
+            (f"WVWZZZ1JZXW{rnd.randrange(10 ** 6):06d}", f"OEM-{rnd.randrange(1, 3000)}", " ".join(rnd.sample(WORDS, 2)),
+             round(rnd.uniform(5, 900), 2), "bench listing", None, 10 ** 6 + rnd.randrange(200), f"seller{i}")
+            for i in range(start, min(parts, start + 5000))])
+
+
+async def simulate(args) -> dict:
+    import bot as bot_module
+    import images
+    import metrics
+
+    session = SimSession(latency=args.api_latency)
+    calls = CallsPerAction()
+    if args.rate_limit:
+        session.middleware(bot_module.send_limiter)
+    session.middleware(metrics.ApiMetricsMiddleware())
+    session.middleware(calls)
+    bot_module.bot.session = session
+    times = HandlerTimes()
+    for name, observer in bot_module.dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(times)
+    seed(bot_module.db, args.parts)
+
+    images.start()
+    sim = Simulation(bot_module, session, args.parts)
+    users = [SimUser(1000 + i, sim) for i in range(args.users)]
+    mix = parse_mix(args.mix)
+    # first uses build the lazy in-memory indexes and fill caches; timed apart
+    t0 = time.perf_counter()
+    await users[0].cold_start()
+    cold_start = time.perf_counter() - t0
+    await asyncio.gather(*(sim.run_user(u, args.warmup, mix, 0) for u in users))
+    times.samples.clear()
+    sim.action_times.clear()
+    calls.calls.clear()
+    sim.updates = 0
+    db_before = db_seconds(metrics)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(sim.run_user(u, args.actions, mix, args.think) for u in users))
+    elapsed = time.perf_counter() - t0
+    db_time = db_seconds(metrics) - db_before
+
+    await bot_module.alert_dispatcher.close()
+    await bot_module.event_log.close()
+    await bot_module.dp.storage.close()
+    images.close()
+    bot_module.db.close()
+
+    handler_time = sum(sum(s) for s in times.samples.values())
+    actions = sum(len(s) for s in sim.action_times.values())
+
+    def summary(samples: List[float]) -> dict:
+        return {"n": len(samples), "p50": percentile(samples, 0.50), "p95": percentile(samples, 0.95),
+                "p99": percentile(samples, 0.99), "mean": statistics.fmean(samples)}
+
+    return {
+        "config": {k: getattr(args, k) for k in CONFIG},
+        "cold_start": cold_start,
+        "elapsed": elapsed,
+        "actions_per_s": actions / elapsed,
+        "updates_per_s": sim.updates / elapsed,
+        "db_share": db_time / handler_time if handler_time else 0.0,
+        "handlers": {name: summary(s) for name, s in sorted(times.samples.items())},
+        "actions": {name: dict(summary(s), api_calls=calls.calls[name] / len(s))
+                    for name, s in sorted(sim.action_times.items())},
+    }
+
+
+def median_of(results: List[dict]):
+    # figure by figure; series missing from some runs use the runs that have them
+    first = results[0]
+    if isinstance(first, dict):
+        keys = {k for r in results for k in r}
+        return {k: median_of([r[k] for r in results if k in r]) for k in sorted(keys)}
+    if isinstance(first, (int, float)) and not isinstance(first, bool):
+        return statistics.median(results)
+    return first
+
+
+def run_repeated(args) -> dict:
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(args.repeat):
+            out = os.path.join(tmp, f"run{i}.json")
+            command = [sys.executable, os.path.abspath(__file__), "--save", out]
+            for name in CONFIG:
+                value = getattr(args, name)
+                if value is True:
+                    command.append(f"--{name.replace('_', '-')}")
+                elif value is not False:
+                    command += [f"--{name.replace('_', '-')}", str(value)]
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+            with open(out) as f:
+                results.append(json.load(f))
+    return median_of(results)
+
+
+def report(result: dict):
+    ms = 1000
+    print(f"{result['actions_per_s']:,.0f} actions/s, {result['updates_per_s']:,.0f} updates/s "
+          f"over {result['elapsed']:.1f}s; {100 * result['db_share']:.0f}% of handler time in the database; "
+          f"cold start {result['cold_start'] * ms:.0f} ms")
+    print(f"\n{'action':<10} {'n':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'API calls':>10}")
+    for name, s in result["actions"].items():
+        print(f"{name:<10} {s['n']:>6} {s['p50'] * ms:>8.2f} {s['p95'] * ms:>8.2f} {s['p99'] * ms:>8.2f} "
+              f"{s['api_calls']:>10.2f}")
+    print(f"\n{'handler':<28} {'n':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, s in result["handlers"].items():
+        print(f"{name:<28} {s['n']:>6} {s['p50'] * ms:>8.2f} {s['p95'] * ms:>8.2f} {s['p99'] * ms:>8.2f}")
+
+
+def regressions(result: dict, baseline: dict, tolerance: float) -> List[str]:
+    found = []
+    if baseline["config"] != result["config"]:
+        found.append(f"configuration differs from the baseline: {baseline['config']}")
+        return found
+    if result["actions_per_s"] < baseline["actions_per_s"] * (1 - tolerance):
+        found.append(f"throughput {result['actions_per_s']:,.0f} actions/s, was {baseline['actions_per_s']:,.0f}")
+    for kind, stat in (("actions", "p95"), ("handlers", "p50")):
+        for name, before in baseline[kind].items():
+            now = result[kind].get(name)
+            if now is None or min(now["n"], before["n"]) < MIN_SAMPLES:
+                continue
+            if max(now[stat], LATENCY_FLOOR) > max(before[stat], LATENCY_FLOOR) * (1 + tolerance):
+                found.append(f"{name} {stat} {now[stat] * 1000:.2f} ms, was {before[stat] * 1000:.2f} ms")
+    for name, before in baseline["actions"].items():
+        now = result["actions"].get(name)
+        if now is not None and now["api_calls"] > before["api_calls"] + API_CALLS_SLACK:
+            found.append(f"{name} makes {now['api_calls']:.2f} API calls per action, was {before['api_calls']:.2f}")
+    return found
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=50, help="concurrent simulated users")
+    ap.add_argument("--actions", type=int, default=40, help="actions per user")
+    ap.add_argument("--parts", type=int, default=5000, help="listings seeded before the run")
+    ap.add_argument("--warmup", type=int, default=3, help="unmeasured actions per user before the run")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="relative weights of the actions")
+    ap.add_argument("--api-latency", type=float, default=0.0, help="seconds per fake Bot API call")
+    ap.add_argument("--think", type=float, default=0.0, help="mean pause between a user's actions, seconds")
+    ap.add_argument("--fsm", default="sqlite", choices=("sqlite", "memory"))
+    ap.add_argument("--rate-limit", action="store_true", help="pace calls through the bot's send limiter")
+    ap.add_argument("--repeat", type=int, default=1, help="runs, each in a fresh process; medians are reported")
+    ap.add_argument("--save", help="write the results as JSON, to use as a baseline")
+    ap.add_argument("--baseline", help="JSON from an earlier --save run to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown against the baseline")
+    args = ap.parse_args()
+
+    if args.repeat > 1:
+        result = run_repeated(args)
+    else:
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            os.environ.update(BOT_TOKEN="123456:TEST", ADMIN_IDS="1", DB_PATH=os.path.join(tmp, "bench.db"),
+                              FSM_STORAGE=args.fsm, METRICS_PORT="0")
+            try:
+                result = asyncio.run(simulate(args))
+            finally:
+                os.chdir(cwd)
+    report(result)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(result, json.load(f), args.tolerance)
+        for line in found:
+            print("REGRESSION:", line)
+        if found:
+            sys.exit(1)
+        print(f"\nno regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
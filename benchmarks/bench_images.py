@@ -0,0 +1,130 @@
+# Disk footprint and encode throughput of the image pipeline on synthetic
+# phone-like photos, against the old behaviour of storing every upload as is.
+# Also records how long the event loop stalls while photos are processed.
+#
+#   python benchmarks/bench_images.py [--photos 10000] [--distinct 200] [--dup-rate 0.1] [--size 1600x1200]
+import argparse
+import asyncio
+import io
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import images  # noqa: E402
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+
+def synthetic_photo(rnd: random.Random, size) -> bytes:
+    # gradient backdrop, a few shapes and sensor noise, saved like a phone camera would
+    w, h = size
+    img = Image.linear_gradient("L").resize(size).convert("RGB")
+    img = Image.blend(img, Image.new("RGB", size, tuple(rnd.randrange(256) for _ in range(3))), 0.6)
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rnd.randrange(w), rnd.randrange(h)
+        r = rnd.randrange(20, w // 4)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rnd.randrange(256) for _ in range(3)))
+    img = img.filter(ImageFilter.GaussianBlur(2))
+    noise = Image.effect_noise(size, 24).convert("RGB")
+    img = Image.blend(img, noise, 0.12)
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=92)
+    return out.getvalue()
+
+
+def unique_copy(jpeg: bytes, n: int) -> bytes:
+    # a JPEG comment segment right after SOI: same pixels, different file
+    payload = f"upload {n}".encode()
+    return jpeg[:2] + b"\xff\xfe" + struct.pack(">H", len(payload) + 2) + payload + jpeg[2:]
+
+
+def du(root: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+
+
+async def loop_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(0.005)
+        lags.append(time.perf_counter() - t0 - 0.005)
+
+
+async def run(uploads, root: str, inline: bool, concurrency: int):
+    lags, stop = [], asyncio.Event()
+    ticker = asyncio.create_task(loop_lag(stop, lags))
+    uploads = iter(uploads)
+    created = 0
+
+    async def worker():
+        nonlocal created
+        for data in uploads:
+            if inline:
+                stored = images.process_image(data, root)
+                await asyncio.sleep(0)  # let the ticker see each photo's stall
+            else:
+                stored = await images.store_image(data, root)
+            created += stored.created
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await ticker
+    return elapsed, created, max(lags, default=0.0)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--photos", type=int, default=10_000)
+    ap.add_argument("--distinct", type=int, default=200, help="distinct pictures the uploads are drawn from")
+    ap.add_argument("--dup-rate", type=float, default=0.1, help="share of uploads that re-post an earlier file")
+    ap.add_argument("--size", default="1600x1200")
+    ap.add_argument("--inline-sample", type=int, default=50)
+    args = ap.parse_args()
+    size = tuple(int(v) for v in args.size.split("x"))
+    rnd = random.Random(5)
+
+    t0 = time.perf_counter()
+    bases = [synthetic_photo(rnd, size) for _ in range(args.distinct)]
+    print(f"generated {args.distinct} distinct {args.size} photos in {time.perf_counter() - t0:.1f}s, "
+          f"avg {sum(map(len, bases)) / len(bases) / 1024:.0f} KB")
+
+    # (base, n) per upload; the bytes are built as they are consumed
+    specs = []
+    for n in range(args.photos):
+        if specs and rnd.random() < args.dup_rate:
+            specs.append(rnd.choice(specs))
+        else:
+            specs.append((n % len(bases), n))
+
+    def uploads(limit=None):
+        return (unique_copy(bases[b], n) for b, n in specs[:limit])
+
+    raw = sum(len(data) for data in uploads())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, "inline")
+        elapsed, _, lag = asyncio.run(run(uploads(args.inline_sample), root, True, 1))
+        print(f"on the event loop: {args.inline_sample / elapsed:6.1f} photos/s, worst loop stall {lag * 1000:7.1f} ms")
+
+        root = os.path.join(tmp, "images")
+        images.start()
+        elapsed, created, lag = asyncio.run(run(uploads(), root, False, 2 * images.IMAGE_WORKERS))
+        images.close()
+        full = sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(root) for f in fs
+                   if not f.endswith(images.THUMB_SUFFIX))
+        thumbs = du(root) - full
+        print(f"process pool ({images.IMAGE_WORKERS} workers): {args.photos / elapsed:6.1f} photos/s, "
+              f"worst loop stall {lag * 1000:7.1f} ms")
+        print(f"{args.photos} uploads, {created} stored (duplicates stored once)")
+        print(f"old layout (every upload as sent): {raw / 2**20:9.1f} MB")
+        print(f"new layout: full {full / 2**20:9.1f} MB + thumbnails {thumbs / 2**20:6.1f} MB "
+              f"= {(full + thumbs) / raw:.0%} of old; avg thumbnail {thumbs / max(1, created) / 1024:.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
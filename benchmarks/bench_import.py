@@ -0,0 +1,90 @@
+# Bulk import of a dealer catalogue (bulk.import_parts: executemany in chunked
+# transactions) against the old path of one add_part call, and one commit, per
+# row. Also times the streaming export and reports peak memory.
+#
+#   python benchmarks/bench_import.py [--rows 100000] [--per-row-sample 2000] [--chunk 5000]
+import argparse
+import csv
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bulk  # noqa: E402
+import database as db  # noqa: E402
+
+WORDS = ["brake", "pad", "filter", "oil", "rotor", "bumper", "mirror", "sensor", "pump", "belt",
+         "headlight", "radiator", "clutch", "spark", "plug", "shock", "absorber", "gasket", "hose", "alternator"]
+
+
+def write_catalogue(path: str, rows: int, bad_every: int):
+    # streamed to disk, so the generator itself stays small
+    rnd = random.Random(13)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("vin", "oem", "name", "price", "description"))
+        for i in range(rows):
+            price = "n/a" if bad_every and i % bad_every == bad_every - 1 else f"{rnd.uniform(5, 900):.2f}"
+            writer.writerow((f"WVWZZZ1JZ{i:08d}", f"OEM-{i % 5000}", " ".join(rnd.sample(WORDS, 2)), price,
+                             " ".join(rnd.sample(WORDS, 5))))
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--per-row-sample", type=int, default=2000, help="rows inserted one add_part call at a time")
+    ap.add_argument("--chunk", type=int, default=bulk.IMPORT_CHUNK)
+    ap.add_argument("--bad-every", type=int, default=1000, help="every Nth row has an invalid price")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "catalogue.csv")
+        write_catalogue(src, args.rows, args.bad_every)
+        print(f"catalogue: {args.rows} rows, {os.path.getsize(src) / 2**20:.1f} MB")
+
+        db.configure(os.path.join(tmp, "bulk.db"))
+        db.init_db()
+        rss0 = peak_rss_mb()
+        t0 = time.perf_counter()
+        with open(src, newline="") as f:
+            report = bulk.import_parts(f, "csv", 1, None, args.chunk)
+        elapsed = time.perf_counter() - t0
+        print(f"bulk import:      {report.imported / elapsed:8.0f} rows/s -> {elapsed:6.1f} s for {args.rows} "
+              f"({report.imported} imported, {report.failed} rejected, chunk {args.chunk})")
+        assert db.search_parts_by_keyword.sync("alternator"), "imported rows missing from the FTS index"
+
+        # the old path, on the same (now full) table
+        with open(src, newline="") as f:
+            records = [r for _, r in zip(range(args.per_row_sample), csv.DictReader(f))]
+        t0 = time.perf_counter()
+        for r in records:
+            try:
+                row = bulk.validate(r, 1, None)
+            except ValueError:
+                continue
+            vin, oem, name, price, description, file_id, owner, username = row
+            db.add_part.sync(vin, oem, name, price, description, "", owner, username, file_id)
+        per_row = (time.perf_counter() - t0) / len(records)
+        print(f"add_part per row: {1 / per_row:8.0f} rows/s -> {per_row * args.rows:6.1f} s for {args.rows} "
+              f"(extrapolated from {len(records)}); "
+              f"bulk is {per_row * args.rows / elapsed:.0f}x faster")
+
+        for fmt in ("csv", "jsonl"):
+            t0 = time.perf_counter()
+            with open(os.path.join(tmp, f"export.{fmt}"), "w", newline="") as out:
+                count = bulk.export_parts(out, fmt)
+            print(f"export {fmt:<5}      {count / (time.perf_counter() - t0):8.0f} rows/s "
+                  f"({os.path.getsize(out.name) / 2**20:.1f} MB)")
+        print(f"peak RSS {peak_rss_mb():.0f} MB (was {rss0:.0f} MB before the import)")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
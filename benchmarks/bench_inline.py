@@ -0,0 +1,126 @@
+# Inline-mode lookup latency on a large catalogue, end to end through the
+# dispatcher and the fake Bot API: every keystroke of a typed query is an
+# inline query, plus "load more" continuation pages. Compared with the dialog
+# search's full BM25 ranking of every match.
+#
+#   python benchmarks/bench_inline.py [--listings 1000000] [--sessions 300] [--db keep.db]
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakeapi  # noqa: E402
+from bench_search import CONDITIONS, WORDS  # noqa: E402
+
+
+def seed(db, n: int):
+    rnd = random.Random(42)
+    chunk = []
+    for i in range(n):
+        name = " ".join(rnd.sample(WORDS, 3)).title()
+        desc = f"{rnd.choice(CONDITIONS)} {' '.join(rnd.sample(WORDS, 5))}"
+        chunk.append((f"WVW{rnd.randrange(10**13):014d}", f"{rnd.randrange(10**5):05d}-{rnd.randrange(10**5):05d}",
+                      name, round(rnd.uniform(5, 2000), 2), desc, f"AgAC{i:012d}" if i % 2 else None,
+                      rnd.randrange(10**6), None))
+        if len(chunk) == 20000:
+            db.add_parts_bulk.sync(chunk)
+            chunk = []
+    if chunk:
+        db.add_parts_bulk.sync(chunk)
+
+
+def typed_queries(rnd: random.Random, codes):
+    # what a user types, one string per keystroke
+    if rnd.random() < 0.2:
+        target = rnd.choice(codes)
+    else:
+        target = " ".join(rnd.sample(WORDS, rnd.choice((1, 2, 2, 3))))
+    return [target[:i] for i in range(1, len(target) + 1)]
+
+
+def report(label: str, samples):
+    samples = sorted(samples)
+    q = lambda p: samples[min(len(samples) - 1, int(len(samples) * p))] * 1000  # noqa: E731
+    print(f"{label:<22} n={len(samples):5d} | p50 {q(0.5):6.1f} ms | p95 {q(0.95):6.1f} ms | "
+          f"p99 {q(0.99):6.1f} ms | max {samples[-1] * 1000:6.1f} ms")
+
+
+async def run(bot_module, sessions, pages: int):
+    keystrokes, more = [], []
+    answers = []
+    original = bot_module.bot.session.make_request
+
+    async def capture(bot, method, timeout=None):
+        if type(method).__name__ == "AnswerInlineQuery":
+            answers.append(method)
+        return await original(bot, method, timeout)
+    bot_module.bot.session.make_request = capture
+    for user_id, typed in enumerate(sessions, 1000):
+        for text in typed:
+            t0 = time.perf_counter()
+            await bot_module.dp.feed_update(bot_module.bot, fakeapi.inline_query_update(user_id, text))
+            keystrokes.append(time.perf_counter() - t0)
+        offset = answers[-1].next_offset
+        for _ in range(pages):
+            if not offset:
+                break
+            t0 = time.perf_counter()
+            await bot_module.dp.feed_update(bot_module.bot, fakeapi.inline_query_update(user_id, typed[-1], offset))
+            more.append(time.perf_counter() - t0)
+            offset = answers[-1].next_offset
+    bot_module.bot.session.make_request = original
+    return keystrokes, more
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--listings", type=int, default=1_000_000)
+    ap.add_argument("--sessions", type=int, default=300, help="users typing a query, keystroke by keystroke")
+    ap.add_argument("--pages", type=int, default=3, help="continuation pages each user scrolls")
+    ap.add_argument("--db", help="keep the seeded catalogue here and reuse it on later runs")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    path = args.db or os.path.join(tmp, "bench.db")
+    os.environ.update(BOT_TOKEN="123456:TEST", ADMIN_IDS="1", DB_PATH=path, FSM_STORAGE="memory")
+    os.chdir(tmp)
+    import bot as bot_module
+    db = bot_module.db
+    db.configure(path)
+    db.init_db()
+    bot_module.bot.session = fakeapi.FakeSession()
+    if db.count_parts.sync() < args.listings:
+        t0 = time.perf_counter()
+        seed(db, args.listings - db.count_parts.sync())
+        print(f"seeded {args.listings} listings in {time.perf_counter() - t0:.0f}s")
+    with db.get_pool().connection() as conn:
+        codes = [vin for (vin,) in conn.execute("SELECT vin FROM parts ORDER BY random() LIMIT 200")]
+
+    rnd = random.Random(7)
+    sessions = [typed_queries(rnd, codes) for _ in range(args.sessions)]
+    finals = [typed[-1] for typed in sessions if " " in typed[-1]][:50]
+    samples = []
+    db.query_cache.max_entries = 0
+    for text in finals:
+        t0 = time.perf_counter()
+        db.search_parts_by_keyword.sync(text, limit=db.INLINE_PAGE)
+        samples.append(time.perf_counter() - t0)
+    report("dialog search (BM25)", samples)
+
+    for label, entries in (("uncached", 0), ("query cache", db.QUERY_CACHE_ENTRIES)):
+        db.query_cache.clear()
+        db.query_cache.max_entries = entries
+        keystrokes, more = asyncio.run(run(bot_module, sessions, args.pages))
+        report(f"inline, {label}", keystrokes)
+        report(f"  next page, {label}", more)
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Cost of recording metrics: a single Counter.inc / Histogram.observe next to a
+# lock-guarded equivalent, the same from several threads at once (checking no
+# increment is lost), and the per-update overhead the middlewares add to a
+# dispatcher whose handler does nothing, plus the cost of one scrape.
+#
+#   python benchmarks/bench_metrics.py [--ops 1000000] [--threads 4] [--updates 20000]
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aiogram import Bot, Dispatcher  # noqa: E402
+
+import fakeapi  # noqa: E402
+import metrics  # noqa: E402
+
+
+class LockedCounter:
+    # what a straightforward thread-safe counter would look like
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + 1
+
+
+def per_op_ns(fn, ops: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(ops):
+        fn()
+    return (time.perf_counter() - t0) / ops * 1e9
+
+
+def threaded(fn, ops: int, threads: int) -> float:
+    workers = [threading.Thread(target=lambda: [fn() for _ in range(ops)]) for _ in range(threads)]
+    t0 = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return (time.perf_counter() - t0) / (ops * threads) * 1e9
+
+
+async def dispatch_us(updates: int, instrumented: bool) -> float:
+    dp = Dispatcher()
+    if instrumented:
+        metrics.instrument(dp)
+
+    @dp.message()
+    async def noop(message):
+        pass
+
+    bot = Bot("1:A", session=fakeapi.FakeSession())
+    batch = [fakeapi.message_update(1 + i % 500, "hi") for i in range(updates)]
+    t0 = time.perf_counter()
+    for update in batch:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - t0) / updates * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ops", type=int, default=1_000_000)
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--updates", type=int, default=20_000)
+    args = ap.parse_args()
+
+    counter = metrics.Counter("bench_ops_total", "benchmark", ("op",))
+    locked = LockedCounter()
+    hist = metrics.Histogram("bench_seconds", "benchmark", ("op",))
+    print(f"Counter.inc          {per_op_ns(lambda: counter.inc('x'), args.ops):7.0f} ns")
+    print(f"locked dict counter  {per_op_ns(lambda: locked.inc('x'), args.ops):7.0f} ns")
+    print(f"Histogram.observe    {per_op_ns(lambda: hist.observe(0.0123, 'x'), args.ops):7.0f} ns")
+
+    ops = args.ops // args.threads
+    before = counter.value("y")
+    ns = threaded(lambda: counter.inc("y"), ops, args.threads)
+    lost = ops * args.threads - (counter.value("y") - before)
+    print(f"Counter.inc, {args.threads} threads {ns:7.0f} ns/op, {lost:.0f} increments lost")
+
+    # warm up imports and model caches before timing either side
+    asyncio.run(dispatch_us(1000, True))
+    plain = min(asyncio.run(dispatch_us(args.updates, False)) for _ in range(3))
+    timed = min(asyncio.run(dispatch_us(args.updates, True)) for _ in range(3))
+    print(f"update, no metrics   {plain:7.1f} µs")
+    print(f"update, with metrics {timed:7.1f} µs  (+{timed - plain:.1f} µs, {100 * (timed - plain) / plain:.1f}%)")
+
+    # a realistic registry: ~40 handlers, ~30 DB functions, ~10 API methods
+    for i in range(40):
+        metrics.HANDLER_LATENCY.observe(0.01, f"handler_{i}")
+    for i in range(30):
+        metrics.DB_LATENCY.observe(0.001, f"query_{i}")
+    for i in range(10):
+        metrics.API_LATENCY.observe(0.05, f"method_{i}")
+    t0 = time.perf_counter()
+    text = metrics.render()
+    print(f"scrape               {(time.perf_counter() - t0) * 1000:7.2f} ms ({len(text) // 1024} KiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Bytes uploaded to the Bot API per Browse click, with and without the
+# photo_file_id cache, measured against the fake session.
+#
+#   python benchmarks/bench_photo_upload.py [--parts 50] [--browses 100] [--photo-kb 180]
+import argparse
+import asyncio
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakeapi  # noqa: E402
+
+
+def forget_file_ids(bot_module):
+    with sqlite3.connect(bot_module.db.DB_PATH) as conn:
+        conn.execute("UPDATE parts SET photo_file_id = NULL")
+    # rows cached in-process still carry the old ids
+    bot_module.db.query_cache.clear()
+
+
+async def run(bot_module, session, browses: int, cached: bool) -> int:
+    session.reset()
+    forget_file_ids(bot_module)
+    for i in range(browses):
+        if not cached:
+            # what every render did before file_ids were kept
+            forget_file_ids(bot_module)
+        await bot_module.dp.feed_update(bot_module.bot, fakeapi.callback_update(1000 + i % 20, "browse"))
+    return session.uploaded_bytes
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--parts", type=int, default=50)
+    ap.add_argument("--browses", type=int, default=100)
+    ap.add_argument("--photo-kb", type=int, default=180)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(tmp)
+    os.environ.update(BOT_TOKEN="123456:TEST", ADMIN_IDS="1", DB_PATH=os.path.join(tmp, "bench.db"))
+    import bot as bot_module
+
+    session = fakeapi.FakeSession()
+    bot_module.bot.session = session
+    os.makedirs("images", exist_ok=True)
+    for i in range(args.parts):
+        path = f"images/part{i}.jpg"
+        with open(path, "wb") as f:
+            f.write(os.urandom(args.photo_kb * 1024))
+        bot_module.db.add_part.sync(f"VIN{i:014d}", f"OEM{i}", f"Part {i}", 10.0 + i, "bench", path, 1, None)
+
+    async def go():
+        before = await run(bot_module, session, args.browses, cached=False)
+        after = await run(bot_module, session, args.browses, cached=True)
+        return before, after
+
+    before, after = asyncio.run(go())
+    bot_module.db.close()
+    os.chdir(cwd)
+    shutil.rmtree(tmp)
+    per_before, per_after = before / args.browses, after / args.browses
+    print(f"{args.browses} browses of a {bot_module.db.PAGE_SIZE}-card page, {args.photo_kb} KB photos")
+    print(f"  re-upload every view : {per_before / 1024:10.1f} KB uploaded per browse")
+    print(f"  file_id cache        : {per_after / 1024:10.1f} KB uploaded per browse")
+    if per_before:
+        print(f"  reduction            : {100 * (1 - per_after / per_before):.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# Read latency with and without the in-process query cache, on a click mix
+# skewed towards popular parts and searches, with an upload every --write-every
+# reads invalidating what it touches.
+#
+#   python benchmarks/bench_query_cache.py [--parts 50000] [--ops 20000] [--write-every 200]
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database as db  # noqa: E402
+
+WORDS = ["brake", "pad", "filter", "oil", "rotor", "bumper", "mirror", "sensor", "pump", "belt",
+         "headlight", "radiator", "clutch", "spark", "plug", "shock", "absorber", "gasket", "hose", "alternator"]
+
+
+def seed(n: int):
+    rnd = random.Random(3)
+    with db.get_pool().connection() as conn, conn:
+        conn.executemany(
+            "INSERT INTO parts (vin, oem, name, price, description, photo_path, uploader_id, upload_date, "
+            "vin_norm, oem_norm) VALUES (?, ?, ?, ?, ?, '', 1, '2024-01-01', ?, ?)",
+            [(f"WVWZZZ1JZ{i:08d}", f"OEM-{i % 5000}", " ".join(rnd.sample(WORDS, 2)), round(rnd.uniform(5, 900), 2),
+              " ".join(rnd.sample(WORDS, 5)), f"WVWZZZ1JZ{i:08d}", f"OEM{i % 5000}") for i in range(n)])
+
+
+def workload(n_parts: int, ops: int, rnd: random.Random):
+    # Zipf-ish popularity: a few parts and queries get most of the clicks
+    hot_ids = [1 + int(n_parts * rnd.random() ** 3) for _ in range(ops)]
+    for i in range(ops):
+        r = rnd.random()
+        if r < 0.35:
+            yield "view", db.get_part_by_id, (min(hot_ids[i], n_parts),)
+        elif r < 0.55:
+            yield "browse", db.get_latest_page, ()
+        elif r < 0.80:
+            yield "keyword", db.search_keyword_ids, (WORDS[int(len(WORDS) * rnd.random() ** 2)],)
+        elif r < 0.90:
+            yield "oem", db.search_oem_page, (f"OEM-{int(5000 * rnd.random() ** 3)}",)
+        elif r < 0.95:
+            lo = 50 * int(10 * rnd.random() ** 2)
+            yield "price", db.search_price_page, (lo, lo + 50)
+        else:
+            yield "count", db.count_parts, ()
+
+
+async def run(n_parts: int, ops: int, write_every: int) -> dict:
+    rnd = random.Random(11)
+    samples = {}
+    for i, (kind, fn, args) in enumerate(workload(n_parts, ops, rnd)):
+        if write_every and i and i % write_every == 0:
+            await db.add_part("WVWZZZ1JZXW999999", "OEM-1", "brake pad", 120.0, "fresh upload", "", 1, None)
+        t0 = time.perf_counter()
+        await fn(*args)
+        samples.setdefault(kind, []).append(time.perf_counter() - t0)
+    return samples
+
+
+def report(label: str, samples: dict):
+    every = [s for v in samples.values() for s in v]
+    total = sum(every)
+    print(f"{label:<9} {len(every) / total:9.0f} reads/s | p50 {statistics.median(every) * 1000:6.3f} ms")
+    for kind, v in sorted(samples.items()):
+        v.sort()
+        print(f"  {kind:<8} p50 {v[len(v) // 2] * 1000:7.3f} ms | p99 {v[int(len(v) * 0.99)] * 1000:7.3f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--parts", type=int, default=50_000)
+    ap.add_argument("--ops", type=int, default=20_000)
+    ap.add_argument("--write-every", type=int, default=200)
+    args = ap.parse_args()
+    for label, entries in (("uncached", 0), ("cached", db.QUERY_CACHE_ENTRIES)):
+        with tempfile.TemporaryDirectory() as tmp:
+            db.configure(os.path.join(tmp, "bench.db"))
+            db.init_db()
+            seed(args.parts)
+            db.query_cache.max_entries = entries
+            samples = asyncio.run(run(args.parts, args.ops, args.write_every))
+            report(label, samples)
+            if entries:
+                print("  cache", db.query_cache.stats())
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Render cost per 1000 views of a 10-listing result page and of a detail
+# view: formatting each row's text and building fresh keyboards on every view
+# (as before listing cards) against the stored cards and cached keyboards,
+# alone and together with building and serializing the sendMessage request.
+#
+#   python benchmarks/bench_render.py [--views 20000] [--listings 500]
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aiogram import Bot  # noqa: E402
+from aiogram.methods import SendMessage  # noqa: E402
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+
+import cards  # noqa: E402
+import fakeapi  # noqa: E402
+import render  # noqa: E402
+
+WORDS = ["brake", "pad_set", "filter", "oil", "rotor*", "bumper", "mirror", "sensor", "pump", "belt"]
+PAGE = 10
+NAV = [InlineKeyboardButton(text="🔔 Alert me", callback_data="save_search"),
+       InlineKeyboardButton(text="Next ▶", callback_data="pg:s:n:123")]
+
+
+# --- what every view did before cards
+def old_line(n: int, row) -> str:
+    part_id, vin, oem, name, price, description = row[:6]
+    if len(description or "") > cards.DESCRIPTION_PREVIEW:
+        description = description[:cards.DESCRIPTION_PREVIEW - 1] + "…"
+    return f"*{n}. {name}* — 💰 *{price} AZN*\nVIN: `{vin}` | OEM: `{oem}`\n📝 {description}"
+
+
+def old_page(rows):
+    numbered = list(enumerate(rows, 1))
+    text = "\n\n".join(["🛒 Latest parts:"] + [old_line(n, row) for n, row in numbered])
+    keyboard = [[InlineKeyboardButton(text=f"{n}. View Details", callback_data=f"view_{row[0]}"),
+                 InlineKeyboardButton(text="Contact Seller", callback_data=f"contact_{row[0]}")] for n, row in numbered]
+    keyboard.append(NAV)
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def old_detail(row):
+    part_id, vin, oem, name, price, description, _, uploader_id, uploader_username = row[:9]
+    text = (f"🔎 *{name}*\nVIN: `{vin}`\nOEM: `{oem}`\n💰 *{price} AZN*\n"
+            f"📝 {description}\n\nUploaded by: @{uploader_username if uploader_username else str(uploader_id)}")
+    return text, InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Contact Seller",
+                                                                              callback_data=f"contact_{part_id}")]])
+
+
+def new_page(rows):
+    return render.listing_message(rows, "🛒 Latest parts:", NAV)
+
+
+def new_detail(row):
+    return render.card(row).detail, render.detail_keyboard(row[0])
+
+
+def make_rows(n: int, rnd: random.Random):
+    rows = []
+    for i in range(1, n + 1):
+        vin, oem, name = f"WVWZZZ1JZXW{rnd.randrange(10 ** 6):06d}", f"OEM-{i}", " ".join(rnd.sample(WORDS, 2))
+        price, description = round(rnd.uniform(5, 900), 2), " ".join(rnd.choices(WORDS, k=rnd.randrange(3, 30)))
+        card = cards.dump(cards.render(vin, oem, name, price, description, 10 + i % 50, f"seller_{i % 50}"))
+        rows.append((i, vin, oem, name, price, description, "", 10 + i % 50, f"seller_{i % 50}", "2024-01-01",
+                     None, None, card))
+    return rows
+
+
+def per_1k_ms(fn, views: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(views):
+        fn(i)
+    return (time.perf_counter() - t0) / views * 1000 * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--views", type=int, default=20_000)
+    ap.add_argument("--listings", type=int, default=500)
+    args = ap.parse_args()
+
+    rows = make_rows(args.listings, random.Random(4))
+    pages = [rows[i:i + PAGE] for i in range(0, len(rows), PAGE)]
+    session = fakeapi.FakeSession()
+    bot = Bot("1:A", session=session)
+
+    def serialized(build):
+        # as far as the session takes a send before the HTTP call
+        def view(rows):
+            text, markup = build(rows)
+            method = SendMessage(chat_id=1, text=text, parse_mode="Markdown", reply_markup=markup)
+            return {k: session.prepare_value(v, bot, {}) for k, v in method.model_dump(warnings=False).items()}
+        return view
+
+    print(f"{'per 1000 views':<32} {'before':>9} {'cards':>9}")
+    for label, old, new, pick in (("result page (10 rows)", old_page, new_page, lambda i: pages[i % len(pages)]),
+                                  ("detail view", old_detail, new_detail, lambda i: rows[i % len(rows)])):
+        for suffix, wrap in (("", lambda build: build), (" + request", serialized)):
+            before = per_1k_ms(lambda i: wrap(old)(pick(i)), args.views)
+            after = per_1k_ms(lambda i: wrap(new)(pick(i)), args.views)
+            print(f"{label + suffix:<32} {before:>7.1f}ms {after:>7.1f}ms  ({before / after:.1f}x)")
+    print(f"keyboard cache: {render.page_keyboard.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# Keyword search latency: the FTS5 index vs. the old LOWER(...) LIKE '%q%' scan.
+#
+#   python benchmarks/bench_search.py [--sizes 100000,1000000] [--queries 200]
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database as db  # noqa: E402
+
+WORDS = ["brake", "pad", "pads", "front", "rear", "filter", "oil", "air", "rotor", "disc", "bumper",
+         "mirror", "left", "right", "sensor", "oxygen", "pump", "water", "fuel", "belt", "timing",
+         "headlight", "tail", "lamp", "radiator", "alternator", "starter", "clutch", "kit", "shock",
+         "absorber", "spring", "control", "arm", "bearing", "hub", "gasket", "valve", "cover", "hose"]
+CONDITIONS = ["new", "used", "original", "aftermarket", "like new", "minor scratches", "tested"]
+
+LIKE_SQL = f"""SELECT {db.PART_COLUMNS} FROM parts
+               WHERE LOWER(name) LIKE ? OR LOWER(description) LIKE ?"""
+
+
+def seed(n: int):
+    rnd = random.Random(42)
+
+    def rows():
+        for i in range(n):
+            name = " ".join(rnd.sample(WORDS, 3)).title()
+            desc = f"{rnd.choice(CONDITIONS)} {' '.join(rnd.sample(WORDS, 5))}"
+            yield (f"WVW{rnd.randrange(10**13):014d}", f"{rnd.randrange(10**5):05d}-{rnd.randrange(10**5):05d}",
+                   name, round(rnd.uniform(5, 2000), 2), desc, "", rnd.randrange(10**6), None, "2024-01-01")
+
+    with db.get_pool().connection() as conn, conn:
+        conn.executemany("""INSERT INTO parts
+            (vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows())
+
+
+def timed(fn, queries):
+    samples = []
+    for q in queries:
+        t0 = time.perf_counter()
+        fn(q)
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def like_search(q: str):
+    pattern = f"%{q.lower()}%"
+    with db.get_pool().connection() as conn:
+        return conn.execute(LIKE_SQL, (pattern, pattern)).fetchall()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="100000,1000000")
+    ap.add_argument("--queries", type=int, default=200)
+    args = ap.parse_args()
+    rnd = random.Random(7)
+    queries = [rnd.choice([w, w[:4], f"{w} {rnd.choice(WORDS)}"]) for w in rnd.choices(WORDS, k=args.queries)]
+    # the LIKE path is a full scan; a handful of queries is enough to see it
+    like_queries = queries[:max(5, args.queries // 20)]
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            db.configure(os.path.join(tmp, "bench.db"))
+            # time the index, not the query cache in front of it
+            db.query_cache.max_entries = 0
+            db.init_db()
+            t0 = time.perf_counter()
+            seed(size)
+            print(f"{size:>9} parts seeded and indexed in {time.perf_counter() - t0:.1f}s")
+            p50, p99 = timed(db.search_parts_by_keyword.sync, queries)
+            print(f"{'':>9} fts5  p50 {p50 * 1000:8.2f} ms | p99 {p99 * 1000:8.2f} ms  (cap {db.SEARCH_LIMIT} rows)")
+            p50, p99 = timed(like_search, like_queries)
+            print(f"{'':>9} like  p50 {p50 * 1000:8.2f} ms | p99 {p99 * 1000:8.2f} ms  (unbounded)")
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
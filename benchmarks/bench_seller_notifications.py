@@ -0,0 +1,94 @@
+# Messages sellers get for an hour of "Contact Seller" clicks on listings of
+# skewed popularity, with buyers clicking the same listing again now and then:
+# one per click (as before the outbox) against the outbox's digests, and how
+# long queueing a click takes. The outbox runs on a simulated clock, one pass
+# per simulated second.
+#
+#   python benchmarks/bench_seller_notifications.py [--clicks 3000] [--sellers 20] [--listings 200]
+#       [--buyers 500] [--repeat 0.3]
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database as db  # noqa: E402
+import notifications  # noqa: E402
+
+HOUR = 3600
+
+
+class Clock:
+    def __init__(self, start: float):
+        self.now = start
+
+    def time(self) -> float:
+        return self.now
+
+
+async def simulate(args, clock: Clock):
+    rnd = random.Random(8)
+    listings = [(i, i % args.sellers) for i in range(1, args.listings + 1)]
+    weights = [1 / rank for rank in range(1, len(listings) + 1)]
+    click_times = sorted(rnd.uniform(0, HOUR) for _ in range(args.clicks))
+    messages, clicks = Counter(), Counter()
+
+    async def send(seller_id: int, text: str):
+        messages[seller_id] += 1
+
+    outbox = notifications.SellerOutbox(send)
+    start, asked, queue_ms = clock.now, [], []
+    second = 0
+    for t in click_times + [HOUR + notifications.DIGEST_INTERVAL]:
+        while second <= t:
+            clock.now = start + second
+            await outbox.deliver_due()
+            second += 1
+        clock.now = start + t
+        if t >= HOUR:
+            break
+        if asked and rnd.random() < args.repeat:
+            buyer, (part_id, seller) = rnd.choice(asked)
+        else:
+            buyer, (part_id, seller) = rnd.randrange(args.buyers), rnd.choices(listings, weights)[0]
+            asked.append((buyer, (part_id, seller)))
+        clicks[seller] += 1
+        t0 = time.perf_counter()
+        await outbox.queue(seller, buyer, f"@buyer{buyer}", part_id, f"part {part_id}")
+        queue_ms.append((time.perf_counter() - t0) * 1000)
+    return messages, clicks, outbox.stats(), queue_ms
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clicks", type=int, default=3000)
+    ap.add_argument("--sellers", type=int, default=20)
+    ap.add_argument("--listings", type=int, default=200)
+    ap.add_argument("--buyers", type=int, default=500)
+    ap.add_argument("--repeat", type=float, default=0.3)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        db.configure(os.path.join(tmp, "bench.db"))
+        db.init_db()
+        clock = Clock(time.time())
+        notifications.time = clock
+        messages, clicks, stats, queue_ms = asyncio.run(simulate(args, clock))
+        db.close()
+    queue_ms.sort()
+    print(f"clicks: {args.clicks}, {stats['repeats']} repeats of a buyer/listing pair")
+    print(f"seller messages, one per click: {args.clicks} (busiest seller {max(clicks.values())})")
+    print(f"seller messages, outbox:        {sum(messages.values())} "
+          f"(busiest seller {max(messages.values())}, for {stats['sent']} interests)")
+    print(f"queueing a click: p50 {statistics.median(queue_ms):.2f} ms, "
+          f"p95 {queue_ms[int(0.95 * len(queue_ms))]:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Load test for the outbound rate limiter: many chats send as fast as they can
+# against the local fake Bot API server, which answers 429 like Telegram does.
+# Reports sustained throughput, 429s seen by the server and per-lane latency.
+#
+#   python benchmarks/bench_send_rate.py [--chats 200] [--seconds 10] [--no-limiter]
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakeapi  # noqa: E402
+import ratelimit  # noqa: E402
+from aiohttp import ClientSession  # noqa: E402
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.exceptions import TelegramRetryAfter  # noqa: E402
+
+
+async def chat_user(bot: Bot, chat_id: int, deadline: float, latencies: list, errors: list):
+    # an impatient user: clicks again as soon as the previous reply arrives
+    while time.monotonic() < deadline:
+        t0 = time.monotonic()
+        try:
+            await bot.send_message(chat_id, "reply")
+            latencies.append(time.monotonic() - t0)
+        except TelegramRetryAfter:
+            errors.append(chat_id)
+
+
+async def notifier(bot: Bot, n: int, deadline: float, latencies: list, errors: list):
+    # a seller-notification fan-out competing with the interactive traffic
+    chat_id = 10_000_000 * (n + 1)
+    while time.monotonic() < deadline:
+        chat_id += 1
+        t0 = time.monotonic()
+        try:
+            with ratelimit.priority(ratelimit.NOTIFICATION):
+                await bot.send_message(chat_id, "someone is interested")
+            latencies.append(time.monotonic() - t0)
+        except TelegramRetryAfter:
+            errors.append(chat_id)
+
+
+def pct(samples, q):
+    if not samples:
+        return float("nan")
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))] * 1000
+
+
+async def wait_for_server(url: str) -> None:
+    async with ClientSession() as http:
+        for _ in range(100):
+            try:
+                async with http.get(f"{url}/stats"):
+                    return
+            except OSError:
+                await asyncio.sleep(0.05)
+
+
+async def fetch_stats(url: str) -> dict:
+    async with ClientSession() as http:
+        async with http.get(f"{url}/stats") as resp:
+            return await resp.json()
+
+
+async def main(args):
+    # the server runs in its own process, like the real API would
+    url = f"http://127.0.0.1:{args.port}"
+    await wait_for_server(url)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(url))
+    limiter = None
+    if not args.no_limiter:
+        limiter = ratelimit.RateLimitMiddleware()
+        session.middleware(limiter)
+    bot = Bot("123456:TEST", session=session)
+
+    interactive, notifications, errors = [], [], []
+    t0 = time.monotonic()
+    wall0 = time.time()
+    deadline = t0 + args.seconds
+    await asyncio.gather(
+        *(chat_user(bot, 1000 + i, deadline, interactive, errors) for i in range(args.chats)),
+        *(notifier(bot, n, deadline, notifications, errors) for n in range(args.notifiers)),
+    )
+    elapsed = time.monotonic() - t0
+    await session.close()
+    server = await fetch_stats(url)
+
+    # steady state: skip the first second, when the initial bursts drain
+    steady = [t for t in server["sent_times"] if wall0 + 1 <= t < wall0 + args.seconds]
+    print(f"{'limiter' if limiter else 'no limiter'}: {args.chats} chats + {args.notifiers} notifiers, "
+          f"{elapsed:.1f}s")
+    print(f"  delivered        : {len(server['sent_times'])} messages, "
+          f"{len(steady) / max(args.seconds - 1, 1):.1f} msg/s sustained (limit 30/s)")
+    print(f"  429 from server  : {server['too_many']}  (errors surfaced to callers: {len(errors)})")
+    print(f"  interactive      : {len(interactive)} sent, p50 {pct(interactive, .5):.0f} ms, "
+          f"p99 {pct(interactive, .99):.0f} ms")
+    print(f"  notifications    : {len(notifications)} sent, p50 {pct(notifications, .5):.0f} ms")
+    if limiter:
+        print(f"  limiter stats    : {limiter.stats()}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, default=200)
+    ap.add_argument("--notifiers", type=int, default=5)
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--no-limiter", action="store_true")
+    args = ap.parse_args()
+    proc = multiprocessing.Process(target=fakeapi.serve, args=(args.port,), daemon=True)
+    proc.start()
+    try:
+        asyncio.run(main(args))
+    finally:
+        proc.terminate()
@@ -0,0 +1,84 @@
+# Startup cost of init_db as the parts table grows: with the schema current
+# (one user_version read), against re-running every schema step the way
+# startup did before versioned migrations; then the one-off cost of the last
+# migration (two indexes and ANALYZE) on the full table.
+#
+#   python benchmarks/bench_startup.py [--parts 400000] [--steps 4]
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database as db  # noqa: E402
+
+WORDS = ["brake", "pad", "filter", "oil", "rotor", "bumper", "mirror", "sensor", "pump", "belt"]
+
+
+def timed_ms(fn, repeat: int = 5) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def startup(path: str):
+    db.configure(path)
+    db.init_db()
+    db.close()
+
+
+def every_step(path: str):
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            for step in db.MIGRATIONS:
+                step(conn)
+    finally:
+        conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--parts", type=int, default=400_000)
+    ap.add_argument("--steps", type=int, default=4)
+    args = ap.parse_args()
+
+    rnd = random.Random(9)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "startup.db")
+        os.chdir(tmp)
+        db.configure(path)
+        t0 = time.perf_counter()
+        db.init_db()
+        print(f"fresh database, {len(db.MIGRATIONS)} migrations: {(time.perf_counter() - t0) * 1000:.1f} ms")
+        print(f"{'parts':>8} {'versioned':>10} {'every step':>11}")
+        for _ in range(args.steps):
+            for _ in range(0, args.parts // args.steps, 5000):
+                db.add_parts_bulk.sync([(f"WVWZZZ1JZXW{rnd.randint(0, 999999):06d}", f"OEM-{rnd.randint(1, 3000)}",
+                                         " ".join(rnd.sample(WORDS, 2)), rnd.uniform(5, 900), "", None, 1, None)]
+                                       * 5000)
+            count = db.count_parts.sync()
+            db.close()
+            print(f"{count:>8} {timed_ms(lambda: startup(path)):>8.2f}ms {timed_ms(lambda: every_step(path)):>9.1f}ms")
+            db.configure(path)
+        db.close()
+        conn = sqlite3.connect(path)
+        conn.execute("DROP INDEX idx_parts_upload_date")
+        conn.execute("DROP INDEX idx_parts_uploader")
+        conn.execute(f"PRAGMA user_version = {len(db.MIGRATIONS) - 1}")
+        conn.commit()
+        conn.close()
+        t0 = time.perf_counter()
+        startup(path)
+        print(f"last migration on {count} parts: {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
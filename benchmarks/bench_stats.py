@@ -0,0 +1,104 @@
+# Admin stats from the rollup tables against the same numbers aggregated on
+# demand from parts and the events log, as history grows; and the cost of
+# writing events in EventLog-sized batches against one transaction each.
+#
+#   python benchmarks/bench_stats.py [--parts 200000] [--events 200000] [--batch 500]
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database as db  # noqa: E402
+
+WORDS = ["brake", "pad", "filter", "oil", "rotor", "bumper", "mirror", "sensor", "pump", "belt"]
+
+
+def make_events(n: int, rnd: random.Random):
+    start = datetime.utcnow() - timedelta(days=90)
+    for i in range(n):
+        ts = (start + timedelta(seconds=i * 90 * 86400 // n)).isoformat()
+        user_id = rnd.randint(1, n // 20 + 1)
+        r = rnd.random()
+        if r < 0.5:
+            mode = rnd.choice(("name", "oem", "vin"))
+            query = f"OEM-{rnd.randint(1, 3000)}" if mode == "oem" else " ".join(rnd.sample(WORDS, 2))
+            yield ts, "search", user_id, None, mode, query, rnd.choice((0, 3, 5))
+        else:
+            yield ts, "view" if r < 0.9 else "contact", user_id, rnd.randint(1, 1000), None, None, None
+
+
+def on_demand(conn):
+    # what admin stats would cost without the rollups
+    listings = conn.execute("SELECT COUNT(*) FROM parts").fetchone()[0]
+    users = conn.execute("SELECT COUNT(DISTINCT user_id) FROM events").fetchone()[0]
+    by_kind = conn.execute("SELECT kind, COUNT(*), SUM(results = 0) FROM events GROUP BY kind").fetchall()
+    daily = conn.execute("SELECT substr(ts, 1, 10), kind, COUNT(*) FROM events WHERE ts >= ? GROUP BY 1, 2",
+                         ((datetime.utcnow() - timedelta(days=14)).isoformat(),)).fetchall()
+    oems = conn.execute("""SELECT query, COUNT(*) n FROM events WHERE kind = 'search' AND mode = 'oem'
+                           GROUP BY query ORDER BY n DESC LIMIT 10""").fetchall()
+    return listings, users, by_kind, daily, oems
+
+
+def from_rollups():
+    since = (datetime.utcnow() - timedelta(days=14)).date().isoformat()
+    return (db.get_stats.sync(), db.get_daily_stats.sync(since), db.top_searched_oems.sync(),
+            db.top_zero_result_queries.sync())
+
+
+def timed_ms(fn, repeat: int = 20) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--parts", type=int, default=200_000)
+    ap.add_argument("--events", type=int, default=200_000)
+    ap.add_argument("--batch", type=int, default=500)
+    ap.add_argument("--single-sample", type=int, default=2000)
+    args = ap.parse_args()
+
+    rnd = random.Random(5)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.configure(os.path.join(tmp, "stats.db"))
+        db.init_db()
+        print(f"{'parts':>8} {'events':>8} {'on demand':>10} {'rollups':>8}")
+        steps = 4
+        events = list(make_events(args.events, rnd))
+        users = sorted({e[2] for e in events})
+        write_s = 0.0
+        for step in range(1, steps + 1):
+            for _ in range(0, args.parts // steps, 5000):
+                db.add_parts_bulk.sync([("", f"OEM-{rnd.randint(1, 3000)}", " ".join(rnd.sample(WORDS, 2)),
+                                         rnd.uniform(5, 900), "", None, 1, None)] * 5000)
+            chunk = events[(step - 1) * len(events) // steps:step * len(events) // steps]
+            t0 = time.perf_counter()
+            for i in range(0, len(chunk), args.batch):
+                batch = chunk[i:i + args.batch]
+                db.record_events.sync(batch, [(u, batch[0][0], None) for u in {e[2] for e in batch}])
+            write_s += time.perf_counter() - t0
+            with db.get_pool().connection() as conn:
+                demand = timed_ms(lambda: on_demand(conn), 5)
+            print(f"{db.count_parts.sync():>8} {step * len(events) // steps:>8} {demand:>8.1f}ms "
+                  f"{timed_ms(from_rollups):>6.2f}ms")
+        print(f"batched writes ({args.batch}/txn): {len(events) / write_s:,.0f} events/s; "
+              f"{db.get_stats.sync()['users']} users (of {len(users)})")
+        sample = events[:args.single_sample]
+        t0 = time.perf_counter()
+        for event in sample:
+            db.record_events.sync([event], [(event[2], event[0], None)])
+        print(f"one transaction per event: {len(sample) / (time.perf_counter() - t0):,.0f} events/s")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# Replays updates at a fixed rate against the local webhook server and reports
+# end-to-end latency: from the HTTP POST leaving the client to the handler
+# finishing. Bot API calls are answered by the in-process fake session.
+#
+#   python benchmarks/bench_webhook.py [--rps 500] [--seconds 5] [--replay updates.jsonl]
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakeapi  # noqa: E402
+
+SECRET = "bench-secret"
+
+
+def synthetic_updates(n: int, parts: int) -> list:
+    rnd = random.Random(3)
+    updates = []
+    for _ in range(n):
+        uid = rnd.randrange(1, 5000)
+        kind = rnd.random()
+        if kind < 0.4:
+            u = fakeapi.callback_update(uid, "browse")
+        elif kind < 0.7:
+            u = fakeapi.callback_update(uid, f"view_{rnd.randrange(1, parts + 1)}")
+        elif kind < 0.9:
+            u = fakeapi.callback_update(uid, f"pg:b:n:{rnd.randrange(2, parts + 1)}")
+        else:
+            u = fakeapi.message_update(uid, "/start")
+        updates.append(u.model_dump(mode="json", exclude_none=True))
+    return updates
+
+
+async def replay(url: str, updates: list, rps: float, sent_at: dict):
+    from aiohttp import ClientSession, TCPConnector
+    async with ClientSession(connector=TCPConnector(limit=200)) as http:
+        async def post(update):
+            sent_at[update["update_id"]] = time.perf_counter()
+            async with http.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as r:
+                if r.status != 200:
+                    print("status", r.status)
+
+        t0 = time.perf_counter()
+        tasks = []
+        for i, update in enumerate(updates):
+            delay = t0 + i / rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post(update)))
+        await asyncio.gather(*tasks)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rps", type=float, default=500)
+    ap.add_argument("--seconds", type=float, default=5)
+    ap.add_argument("--max-in-flight", type=int, default=100)
+    ap.add_argument("--parts", type=int, default=200)
+    ap.add_argument("--port", type=int, default=8090)
+    ap.add_argument("--replay", help="JSONL file of recorded Update objects")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(tmp)
+    os.environ.update(BOT_TOKEN="123456:TEST", ADMIN_IDS="1", DB_PATH=os.path.join(tmp, "bench.db"))
+    import bot as bot_module
+    import webhook
+
+    bot_module.bot.session = fakeapi.FakeSession()
+    for i in range(args.parts):
+        bot_module.db.add_part.sync(f"VIN{i:014d}", f"OEM{i}", f"Part {i}", 10.0 + i, "bench", "", 1, None)
+
+    if args.replay:
+        with open(os.path.join(cwd, args.replay)) as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        updates = synthetic_updates(int(args.rps * args.seconds), args.parts)
+
+    done_at = {}
+
+    async def timing(handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            done_at[event.update_id] = time.perf_counter()
+
+    bot_module.dp.update.outer_middleware(timing)
+
+    async def go():
+        server = webhook.WebhookServer(bot_module.dp, bot_module.bot, "/webhook", SECRET, args.max_in_flight)
+        from aiohttp import web
+        runner = web.AppRunner(server.app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", args.port).start()
+        sent_at = {}
+        t0 = time.perf_counter()
+        await replay(f"http://127.0.0.1:{args.port}/webhook", updates, args.rps, sent_at)
+        while server.in_flight:
+            await asyncio.sleep(0.01)
+        wall = time.perf_counter() - t0
+        await runner.cleanup()
+        return sent_at, wall, server
+
+    sent_at, wall, server = asyncio.run(go())
+    bot_module.db.close()
+    os.chdir(cwd)
+    shutil.rmtree(tmp)
+
+    lat = sorted(done_at[k] - sent_at[k] for k in sent_at if k in done_at)
+    pick = lambda q: lat[min(len(lat) - 1, int(len(lat) * q))] * 1000  # noqa: E731
+    print(f"{len(updates)} updates offered at {args.rps:.0f} rps, max {args.max_in_flight} in flight")
+    print(f"  handled {server.handled}, failed {server.failed}, {len(lat) / wall:.0f} updates/s achieved")
+    print(f"  end-to-end latency p50 {pick(.5):.1f} ms | p95 {pick(.95):.1f} ms | p99 {pick(.99):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# Throughput of the bot run by supervisor.py with 1, 2 and 4 worker processes
+# on the same simulated update stream: every chat goes through start, browse,
+# a listing, a keyword search (an FSM flow, so its steps must reach the same
+# worker) and another listing, one step per round. Updates are posted to the
+# supervisor's webhook as Telegram would; the Bot API is a fake server in its
+# own process. A round ends when the workers have handled all its updates.
+#
+# Scaling is bounded by the cores left over for the workers: the supervisor,
+# the fake API and this client need some too.
+#
+#   python benchmarks/bench_workers.py [--workers 1,2,4] [--chats 1000] [--parts 2000] [--api-latency 0.0]
+import argparse
+import asyncio
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, BENCH)
+sys.path.insert(0, ROOT)
+from aiohttp import ClientError, ClientSession, TCPConnector  # noqa: E402
+
+import fakeapi  # noqa: E402
+
+SECRET = "bench-secret"
+WORDS = ["brake", "pad", "filter", "oil", "rotor", "bumper", "mirror", "sensor", "pump", "belt"]
+
+
+def chat_script(uid: int, parts: int, rnd: random.Random) -> list:
+    steps = [fakeapi.message_update(uid, "/start"),
+             fakeapi.callback_update(uid, "browse"),
+             fakeapi.callback_update(uid, f"view_{rnd.randrange(1, parts + 1)}"),
+             fakeapi.callback_update(uid, "search"),
+             fakeapi.callback_update(uid, "search_name"),
+             fakeapi.message_update(uid, rnd.choice(WORDS)),
+             fakeapi.callback_update(uid, f"view_{rnd.randrange(1, parts + 1)}")]
+    return [u.model_dump(mode="json", exclude_none=True) for u in steps]
+
+
+def seed(path: str, parts: int):
+    os.environ["DB_PATH"] = path
+    import database as db
+    db.configure(path)
+    db.init_db()
+    rnd = random.Random(5)
+    db.add_parts_bulk.sync([(f"WVWZZZ1JZXW{rnd.randrange(10 ** 6):06d}", f"OEM-{i}", " ".join(rnd.sample(WORDS, 2)),
+                             round(rnd.uniform(5, 900), 2), "bench listing", None, 10 + i % 50, f"seller{i % 50}")
+                            for i in range(parts)])
+    db.close()
+
+
+async def wait_up(http: ClientSession, url: str, timeout: float = 90.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with http.get(url) as r:
+                if r.status == 200 and all(w["ready"] for w in (await r.json())["workers"]):
+                    return
+        except ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} not up")
+
+
+async def handled(http: ClientSession, ports: list) -> int:
+    total = 0
+    for port in ports:
+        async with http.get(f"http://127.0.0.1:{port}/healthz") as r:
+            status = await r.json()
+            total += status["handled"] + status["failed"]
+    return total
+
+
+async def drive(rounds: list, port: int, worker_ports: list) -> float:
+    url = f"http://127.0.0.1:{port}"
+    async with ClientSession(connector=TCPConnector(limit=100)) as http:
+        await wait_up(http, f"{url}/healthz")
+        base = await handled(http, worker_ports)
+        target = base
+        t0 = time.perf_counter()
+        for updates in rounds:
+            async def post(update):
+                async with http.post(f"{url}/webhook", json=update,
+                                     headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as r:
+                    r.raise_for_status()
+            await asyncio.gather(*(post(u) for u in updates))
+            target += len(updates)
+            while await handled(http, worker_ports) < target:
+                await asyncio.sleep(0.01)
+        return time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", default="1,2,4")
+    ap.add_argument("--chats", type=int, default=1000)
+    ap.add_argument("--parts", type=int, default=2000)
+    ap.add_argument("--api-latency", type=float, default=0.0)
+    ap.add_argument("--port", type=int, default=8300)
+    args = ap.parse_args()
+
+    rnd = random.Random(11)
+    scripts = [chat_script(uid, args.parts, rnd) for uid in range(1000, 1000 + args.chats)]
+    rounds = [[script[i] for script in scripts] for i in range(len(scripts[0]))]
+    total = sum(len(r) for r in rounds)
+    api_port, worker_base = args.port + 1, args.port + 10
+    print(f"{total} updates from {args.chats} chats, {os.cpu_count()} CPUs")
+    print(f"{'workers':>7} {'seconds':>8} {'updates/s':>10} {'speedup':>8}")
+    api = subprocess.Popen([sys.executable, "-c", "import fakeapi; fakeapi.serve(%d, chat_burst=10**9, "
+                            "global_limit=10**9, latency=%r)" % (api_port, args.api_latency)], cwd=BENCH)
+    first = None
+    try:
+        for n in [int(x) for x in args.workers.split(",")]:
+            with tempfile.TemporaryDirectory() as tmp:
+                seed(os.path.join(tmp, "bench.db"), args.parts)
+                env = dict(os.environ, BOT_TOKEN="123456:TEST", ADMIN_IDS="1", DB_PATH=os.path.join(tmp, "bench.db"),
+                           RUN_MODE="webhook", WEBHOOK_PORT=str(args.port), WEBHOOK_HOST="127.0.0.1",
+                           WEBHOOK_SECRET=SECRET, WORKERS=str(n), WORKER_BASE_PORT=str(worker_base),
+                           METRICS_PORT="0", TELEGRAM_API_URL=f"http://127.0.0.1:{api_port}",
+                           SEND_GLOBAL_RATE="1000000")
+                supervisor = subprocess.Popen([sys.executable, os.path.join(ROOT, "supervisor.py")], cwd=tmp, env=env,
+                                              stdout=subprocess.DEVNULL)
+                try:
+                    seconds = asyncio.run(drive(rounds, args.port, [worker_base + i for i in range(n)]))
+                finally:
+                    supervisor.send_signal(signal.SIGTERM)
+                    supervisor.wait()
+            rate = total / seconds
+            first = first or rate
+            print(f"{n:>7} {seconds:>8.2f} {rate:>10.0f} {rate / first:>7.2f}x")
+    finally:
+        api.terminate()
+        api.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import threading
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+
+def levenshtein(a: str, b: str) -> int:
+    if len(a) < len(b):
+        a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+class BKTree:
+    """Burkhard-Keller tree: finds every stored key within ``radius`` of a query
+    under any metric, visiting only the branches the triangle inequality allows.
+    """
+
+    def __init__(self, distance: Callable[[Hashable, Hashable], int] = levenshtein):
+        self.distance = distance
+        self._root: Optional[Tuple[Hashable, Dict[int, tuple]]] = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, key: Hashable) -> bool:
+        with self._lock:
+            if self._root is None:
+                self._root = (key, {})
+                self._size = 1
+                return True
+            node = self._root
+            while True:
+                d = self.distance(key, node[0])
+                if d == 0:
+                    return False
+                child = node[1].get(d)
+                if child is None:
+                    node[1][d] = (key, {})
+                    self._size += 1
+                    return True
+                node = child
+
+    def search(self, key: Hashable, radius: int) -> List[Tuple[int, Hashable]]:
+        if self._root is None:
+            return []
+        found = []
+        stack = [self._root]
+        while stack:
+            node_key, children = stack.pop()
+            d = self.distance(key, node_key)
+            if d <= radius:
+                found.append((d, node_key))
+            for edge in range(d - radius, d + radius + 1):
+                child = children.get(edge)
+                if child is not None:
+                    stack.append(child)
+        found.sort()
+        return found
@@ -0,0 +1,204 @@
+# A stand-in for the Telegram Bot API used by the benchmarks: an aiogram
+# session that answers every method locally and counts what would have been
+# sent over the wire, a small HTTP server that speaks the Bot API and enforces
+# Telegram-like flood limits, and helpers that build incoming updates.
+import asyncio
+import itertools
+import json
+import os
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Optional
+
+from aiohttp import web
+
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, Chat, File, FSInputFile, InputFile, Message, PhotoSize, Update, User
+
+_ids = itertools.count(1)
+
+
+def _file_size(f: InputFile) -> int:
+    if isinstance(f, FSInputFile):
+        return os.path.getsize(f.path)
+    if isinstance(f, BufferedInputFile):
+        return len(f.data)
+    return 0
+
+
+class FakeSession(BaseSession):
+    def __init__(self, latency: float = 0.0, download: bytes = b"", **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        # body served for every file the bot downloads
+        self.download = download
+        self.calls: Counter = Counter()
+        self.uploaded_bytes = 0
+        self.uploads = 0
+        self.known_file_ids: set = set()
+        self.revoked_file_ids: set = set()
+
+    def reset(self):
+        self.calls.clear()
+        self.uploaded_bytes = 0
+        self.uploads = 0
+
+    def _photo(self, value) -> list:
+        if isinstance(value, InputFile):
+            self.uploads += 1
+            self.uploaded_bytes += _file_size(value)
+            file_id = f"AgAC{next(_ids):012d}"
+            self.known_file_ids.add(file_id)
+        else:
+            file_id = value
+        return [PhotoSize(file_id=file_id, file_unique_id=file_id[-8:], width=1280, height=960)]
+
+    def _message(self, method, **fields) -> Message:
+        return Message(message_id=next(_ids), date=datetime.now(), chat=Chat(id=method.chat_id, type="private"),
+                       **fields)
+
+    async def make_request(self, bot, method, timeout: Optional[int] = None):
+        name = type(method).__name__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if name == "SendPhoto":
+            if isinstance(method.photo, str) and method.photo in self.revoked_file_ids:
+                raise TelegramBadRequest(method=method, message="Bad Request: wrong file identifier")
+            return self._message(method, photo=self._photo(method.photo), caption=method.caption)
+        if name == "SendMessage":
+            return self._message(method, text=method.text)
+        if name == "SendMediaGroup":
+            return [self._message(method, photo=self._photo(item.media), caption=item.caption)
+                    for item in method.media]
+        if name == "GetMe":
+            return User(id=1, is_bot=True, first_name="bot", username="detaltap_bot")
+        if name == "GetFile":
+            return File(file_id=method.file_id, file_unique_id=method.file_id[-8:],
+                        file_path=f"photos/{method.file_id}.jpg")
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield self.download
+
+
+class FakeBotAPIServer:
+    """Answers Bot API calls over HTTP and replies 429 with ``retry_after``
+    when a chat exceeds ``chat_burst`` messages plus ``chat_rate`` per second,
+    or the bot exceeds ``global_limit`` messages in any one-second window.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081, chat_rate: float = 1.0,
+                 chat_burst: int = 3, global_limit: int = 30, latency: float = 0.0):
+        self.host, self.port = host, port
+        self.chat_rate, self.chat_burst, self.global_limit = chat_rate, chat_burst, global_limit
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.sent_times: deque = deque()
+        self.too_many = 0
+        self._chats: dict = {}
+        self._window: deque = deque()
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _chat_allows(self, chat_id: str, now: float) -> bool:
+        tokens, stamp = self._chats.get(chat_id, (self.chat_burst, now))
+        tokens = min(self.chat_burst, tokens + (now - stamp) * self.chat_rate)
+        if tokens < 1:
+            self._chats[chat_id] = (tokens, now)
+            return False
+        self._chats[chat_id] = (tokens - 1, now)
+        return True
+
+    def _global_room(self, now: float) -> bool:
+        while self._window and now - self._window[0] >= 1.0:
+            self._window.popleft()
+        return len(self._window) < self.global_limit
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = await request.post()
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        chat_id = form.get("chat_id")
+        if chat_id is not None:
+            now = time.monotonic()
+            if not (self._global_room(now) and self._chat_allows(chat_id, now)):
+                self.too_many += 1
+                return web.json_response({"ok": False, "error_code": 429,
+                                          "description": "Too Many Requests: retry after 1",
+                                          "parameters": {"retry_after": 1}}, status=429)
+            self._window.append(now)
+            self.sent_times.append(time.time())
+            result = {"message_id": next(_ids), "date": int(time.time()),
+                      "chat": {"id": int(chat_id), "type": "private"}}
+            if method.lower() == "sendphoto":
+                file_id = f"AgAC{next(_ids):012d}"
+                result["photo"] = [{"file_id": file_id, "file_unique_id": file_id[-8:], "width": 1, "height": 1}]
+            elif method.lower() == "sendmessage":
+                result["text"] = form.get("text", "")
+            elif method.lower() == "sendmediagroup":
+                result = [dict(result, message_id=next(_ids)) for _ in json.loads(form.get("media", "[]"))]
+            return web.json_response({"ok": True, "result": result})
+        return web.json_response({"ok": True, "result": True})
+
+    async def _stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"calls": self.calls, "too_many": self.too_many,
+                                  "sent_times": list(self.sent_times)})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        app.router.add_get("/stats", self._stats)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+def serve(port: int, **limits):
+    # entry point for running the server in its own process
+    async def run():
+        server = FakeBotAPIServer(port=port, **limits)
+        await server.start()
+        await asyncio.Event().wait()
+    asyncio.run(run())
+
+
+def user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+
+
+def message_update(user_id: int, text: Optional[str] = None, photo_file_id: Optional[str] = None) -> Update:
+    message = {"message_id": next(_ids), "date": 0, "chat": {"id": user_id, "type": "private"},
+               "from": user(user_id)}
+    if text is not None:
+        message["text"] = text
+    if photo_file_id is not None:
+        message["photo"] = [{"file_id": photo_file_id, "file_unique_id": photo_file_id[-8:],
+                             "width": 1280, "height": 960}]
+    return Update(update_id=next(_ids), message=message)
+
+
+def callback_update(user_id: int, data: str) -> Update:
+    return Update(update_id=next(_ids), callback_query={
+        "id": str(next(_ids)), "from": user(user_id), "chat_instance": str(user_id), "data": data,
+        "message": {"message_id": next(_ids), "date": 0, "chat": {"id": user_id, "type": "private"}, "text": "menu"},
+    })
+
+
+def inline_query_update(user_id: int, query: str, offset: str = "") -> Update:
+    return Update(update_id=next(_ids), inline_query={
+        "id": str(next(_ids)), "from": user(user_id), "query": query, "offset": offset})
@@ -1,29 +1,109 @@
 import asyncio
+import logging
 import os
+import secrets
+import tempfile
+from datetime import datetime, timedelta
+from typing import List, Optional
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputFile, Message, FSInputFile, CallbackQuery
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.filters import Command, CommandObject
+from aiogram.types import (InlineKeyboardMarkup, InlineKeyboardButton, InputFile, Message, FSInputFile, CallbackQuery,
+                           InlineQuery)
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.storage.memory import MemoryStorage
+import alerts
+import analytics
+import bans
+import bulk
+import cards
 import database as db
+import fsm_storage
+import images
+import metrics
+import notifications
+import ratelimit
+import render
+import webhook
 from dotenv import load_dotenv
 load_dotenv()
 
 # === CONFIG ===
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+# "polling" (default), "webhook", or "worker" when run by supervisor.py
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", "8080")))
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "100"))
+# where upload/search flows live: "sqlite" (default), "redis" or "memory"
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+FSM_TTL = int(os.getenv("FSM_TTL", str(fsm_storage.FSM_TTL)))
+# seconds Telegram may reuse an inline answer for the same query text
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "30"))
+# Prometheus text metrics on http://METRICS_HOST:METRICS_PORT/metrics; off by
+# default (0). A port that is taken is logged and skipped.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# a self-hosted Bot API server instead of api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# the bot's overall send limit, shared evenly by the worker processes
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", str(ratelimit.GLOBAL_RATE)))
+# set by supervisor.py for each worker it runs
+WORKERS = int(os.getenv("WORKERS", "1")) if RUN_MODE == "worker" else 1
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+WORKER_PORT = int(os.getenv("WORKER_PORT", "8200"))
+WORKER_SECRET = os.getenv("WORKER_SECRET")
+# how often a worker picks up the listings, saved searches and bans the others wrote
+WORKER_SYNC_INTERVAL = float(os.getenv("WORKER_SYNC_INTERVAL", "2"))
+
+def make_storage():
+    if FSM_STORAGE == "redis":
+        return fsm_storage.RedisStorage.from_url(REDIS_URL, ttl=FSM_TTL)
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    return fsm_storage.SQLiteStorage(ttl=FSM_TTL)
+
+bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+          if TELEGRAM_API_URL else None)
+# paces outbound calls under Telegram's per-chat and global flood limits
+send_limiter = ratelimit.RateLimitMiddleware(global_rate=SEND_GLOBAL_RATE / WORKERS)
+bot.session.middleware(send_limiter)
+bot.session.middleware(metrics.ApiMetricsMiddleware())
+dp = Dispatcher(storage=make_storage(), disable_fsm=True)
+# Updates from banned users are dropped before the FSM middleware loads their
+# state, so that one is registered here rather than by the Dispatcher.
+ban_list = bans.BanList()
+dp.update.outer_middleware(bans.BanMiddleware(ban_list))
+dp.update.outer_middleware(dp.fsm)
+metrics.instrument(dp)
+metrics.Gauge("bot_send_queue_depth", "Bot API calls waiting for the rate limiter",
+              lambda: {(lane,): send_limiter.gate.depth(n) for lane, n in
+                       (("interactive", ratelimit.INTERACTIVE), ("notification", ratelimit.NOTIFICATION))},
+              ("lane",))
+# searches, views and contacts for the admin stats (see analytics.py)
+event_log = analytics.EventLog()
+dp.update.outer_middleware(analytics.SeenUsersMiddleware(event_log))
+metrics.Gauge("bot_events_pending", "Analytics events waiting to be written", lambda: event_log.stats()["pending"])
 
 # Ensure DB exists
 db.init_db()
-os.makedirs("images", exist_ok=True)
+ban_list.load()
+os.makedirs(images.IMAGES_DIR, exist_ok=True)
 
 
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",")]
 def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_IDS
 
+ADMIN_PAGE_SIZE = 10
+
 # === FSM states for upload and search ===
 class UploadStates(StatesGroup):
     vin = State()
@@ -40,47 +120,137 @@ class SearchStates(StatesGroup):
     price_range_min = State()
     price_range_max = State()
 
+class AdminStates(StatesGroup):
+    ban = State()
+
 # --- Utility: build main menu keyboard
 def main_menu_kb():
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🛒 Browse Parts", callback_data="browse")],
         [InlineKeyboardButton(text="🔧 Upload a Part", callback_data="upload")],
         [InlineKeyboardButton(text="🔍 Search Parts", callback_data="search")],
+        [InlineKeyboardButton(text="🔔 My Alerts", callback_data="my_alerts")],
     ])
 
 # === /start command ===
 @dp.message(Command("start"))
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, command: CommandObject):
+    # deep links from inline results: /start part_<id>
+    if command.args and command.args.startswith("part_") and command.args[5:].isdigit():
+        await send_part_detail(message, int(command.args[5:]))
+        return
     await message.answer(
         "👋 Welcome to *DetalTap* — your digital garage!\nChoose an option below:",
         parse_mode="Markdown",
         reply_markup=main_menu_kb()
     )
 
+# === Pagination ===
+# Result lists are keyset pages. The Prev/Next buttons carry the page kind and
+# the boundary row's sort key: "pg:<kind>:<n|p>:<key>[:<key>]". Kinds are
+# b (browse), s<search key> (the search kept in FSM data) and a (admin
+# listings). The search key ties a result message to the search that made
+# it, so its buttons stop working once the user has searched again.
+def encode_cursor(cursor) -> str:
+    return ":".join(repr(v) for v in cursor)
+
+def decode_cursor(parts) -> tuple:
+    # ValueError for anything encode_cursor didn't make
+    if not parts:
+        raise ValueError("empty cursor")
+    return tuple(int(v) if v.lstrip("-").isdigit() else float(v) for v in parts)
+
+def page_nav_buttons(kind: str, page: db.Page):
+    buttons = []
+    if page.prev_cursor:
+        buttons.append(InlineKeyboardButton(text="◀ Prev", callback_data=f"pg:{kind}:p:{encode_cursor(page.prev_cursor)}"))
+    if page.next_cursor:
+        buttons.append(InlineKeyboardButton(text="Next ▶", callback_data=f"pg:{kind}:n:{encode_cursor(page.next_cursor)}"))
+    return buttons
+
+def save_search_button(search: dict, text: str = "🔔 Alert me") -> InlineKeyboardButton:
+    return InlineKeyboardButton(text=text, callback_data=f"save_search:{search['key']}")
+
+def new_search(**search) -> dict:
+    search["key"] = secrets.token_hex(3)
+    return search
+
+async def current_search(state: FSMContext, key: str) -> Optional[dict]:
+    # the search in FSM data if ``key`` is still its key
+    search = (await state.get_data()).get("search")
+    return search if search and search.get("key") == key else None
+
+async def send_page(message: Message, kind: str, page: db.Page, header: str, search: Optional[dict] = None):
+    if kind == "a":
+        await render.send_results(message, page.rows, header, line=render.admin_line,
+                                  buttons=render.admin_buttons, extra_buttons=page_nav_buttons(kind, page),
+                                  parse_mode=None, thumbnails=True)
+    else:
+        if search:
+            kind = f"s{search['key']}"
+        buttons = page_nav_buttons(kind, page)
+        if search:
+            buttons.insert(len(buttons) - bool(page.next_cursor), save_search_button(search))
+        await render.send_results(message, page.rows, header, extra_buttons=buttons)
+
+async def fetch_search_page(search: dict, cursor=None, backward: bool = False) -> db.Page:
+    mode = search.get("mode")
+    if mode == "price":
+        return await db.search_price_page(search["min"], search["max"], cursor, backward)
+    if mode == "vin":
+        return await db.search_vin_page(search["q"], cursor, backward)
+    if mode == "oem":
+        return await db.search_oem_page(search["q"], cursor, backward)
+    # keyword pages go through the ranked ids pinned on the first one (see
+    # Keyset pagination in database.py)
+    if "ids" not in search:
+        search["ids"] = await db.search_keyword_ids(search["q"])
+    return await db.get_ranked_page(search["ids"], cursor, backward)
+
+async def finish_search(state: FSMContext, search: dict):
+    # leave the search state but keep the query so Prev/Next can re-run it
+    await state.set_state(None)
+    await state.set_data({"search": search})
+    metrics.flow("search", "completed")
+
+@dp.callback_query(F.data.startswith("pg:"))
+async def cb_page(query: types.CallbackQuery, state: FSMContext):
+    try:
+        _, kind, direction, *raw = query.data.split(":")
+        cursor, backward = decode_cursor(raw), direction == "p"
+    except ValueError:
+        # forged, or left over from an older version of the buttons
+        await query.answer("This page has expired. Please open it again.", show_alert=True)
+        return
+    search = None
+    if kind == "a":
+        if not is_admin(query.from_user.id):
+            await query.answer("❌ Unauthorized", show_alert=True)
+            return
+        page = await db.get_latest_page(cursor, backward, limit=ADMIN_PAGE_SIZE)
+    elif kind.startswith("s"):
+        search = await current_search(state, kind[1:])
+        if not search:
+            await query.answer("This search has expired. Please search again.", show_alert=True)
+            return
+        page = await fetch_search_page(search, cursor, backward)
+    else:
+        page = await db.get_latest_page(cursor, backward)
+    await query.answer()
+    if not page.rows:
+        await query.message.answer("No more results.")
+        return
+    await send_page(query.message, kind, page, "📄 More results:", search)
+
 # === Callback: Browse ===
 @dp.callback_query(F.data == "browse")
 async def cb_browse(query: types.CallbackQuery):
     await query.answer()
-    rows = db.get_latest_parts(limit=10)
-    if not rows:
+    page = await db.get_latest_page()
+    if not page.rows:
         await query.message.answer("No parts uploaded yet. Be the first to upload!")
         return
-    await query.message.answer("🛒 Latest parts:")
-    for row in rows:
-        part_id, vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date = row
-        caption = f"🔧 *{name}*\nVIN: `{vin}` | OEM: `{oem}`\n💰 *{price} AZN*\n📝 {description}"
-        buttons = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Contact Seller", callback_data=f"contact_{part_id}")],
-            [InlineKeyboardButton(text="View Details", callback_data=f"view_{part_id}")]
-        ])
-        if photo_path and os.path.exists(photo_path):
-            try:
-                await bot.send_photo(chat_id=query.from_user.id, photo=FSInputFile(photo_path), caption=caption, parse_mode="Markdown", reply_markup=buttons)
-            except Exception:
-                # fallback to text if photo sending fails
-                await query.message.answer(caption, parse_mode="Markdown", reply_markup=buttons)
-        else:
-            await query.message.answer(caption, parse_mode="Markdown", reply_markup=buttons)
+    await send_page(query.message, "b", page, "🛒 Latest parts:")
 
 # === Callback: Upload start ===
 @dp.callback_query(F.data == "upload")
@@ -88,6 +258,7 @@ async def cb_upload(query: types.CallbackQuery, state: FSMContext):
     await query.answer()
     await query.message.answer("🔧 Upload flow started. Please enter the *VIN* code for the vehicle:", parse_mode="Markdown")
     await state.set_state(UploadStates.vin)
+    metrics.flow("upload", "started")
 
 # === Upload flow handlers ===
 @dp.message(UploadStates.vin, F.text)
@@ -130,12 +301,17 @@ async def upload_description(message: Message, state: FSMContext):
 async def upload_photo(message: Message, state: FSMContext):
     data = await state.get_data()
     
-    # Save photo properly
-    dest_path = f"images/{message.photo[-1].file_unique_id}.jpg"
-    await bot.download(message.photo[-1], destination=dest_path)
+    # Recompress and store the photo off the event loop (see images.py)
+    photo = await bot.download(message.photo[-1])
+    try:
+        stored = await images.store_image(photo.getvalue())
+    except OSError:
+        await message.answer("⚠️ Couldn't read that photo. Please send another one.")
+        return
 
-    # 🟢 Store the photo path in FSM memory
-    await state.update_data(photo_path=dest_path)
+    # 🟢 Store the photo path and Telegram's file_id in FSM memory
+    await state.update_data(photo_path=stored.path, photo_file_id=message.photo[-1].file_id,
+                            photo_hash=stored.dhash)
 
     vin = data.get("vin", "")
     oem = data.get("oem", "")
@@ -145,11 +321,11 @@ async def upload_photo(message: Message, state: FSMContext):
 
     caption = (
         f"🔎 *Please confirm your listing:*\n\n"
-        f"*Name:* {name}\n"
-        f"*VIN:* `{vin}`\n"
-        f"*OEM:* `{oem}`\n"
+        f"*Name:* {cards.escape(name)}\n"
+        f"*VIN:* {cards.code(vin)}\n"
+        f"*OEM:* {cards.code(oem)}\n"
         f"*Price:* *{price} AZN*\n"
-        f"*Description:* {description}"
+        f"*Description:* {cards.escape(description)}"
     )
 
     uploader_id = message.from_user.id
@@ -161,8 +337,8 @@ async def upload_photo(message: Message, state: FSMContext):
         [InlineKeyboardButton(text="🔄 Cancel", callback_data="cancel_upload")]
     ])
 
-    photo = FSInputFile(dest_path)
-    await message.answer_photo(photo=photo, caption=caption, parse_mode="Markdown", reply_markup=kb)
+    # echo the photo back by file_id; Telegram already has it
+    await message.answer_photo(photo=message.photo[-1].file_id, caption=caption, parse_mode="Markdown", reply_markup=kb)
 
     await state.set_state(UploadStates.confirm)
 
@@ -170,24 +346,44 @@ async def upload_photo(message: Message, state: FSMContext):
 async def cb_confirm_upload(query: types.CallbackQuery, state: FSMContext):
     await query.answer()
     data = await state.get_data()
+    uploader_id = int(data.get("uploader_id"))
+    # A seller re-posting their own listing is turned away; a match with
+    # someone else's listing is kept but flagged for the admins.
+    duplicates = await db.find_duplicates(data.get("photo_hash"), data.get("oem", ""), data.get("name", ""),
+                                          float(data.get("price", 0)))
+    own = [row for row in duplicates if row[7] == uploader_id]
+    if own:
+        await query.message.answer(f"⚠️ This looks like your listing #{own[0][0]} ({own[0][3]}), "
+                                   f"so it wasn't posted again.")
+        await state.clear()
+        metrics.flow("upload", "rejected")
+        return
     # Save to DB
-    db.add_part(
+    part_id = await db.add_part(
         vin=data.get("vin", ""),
         oem=data.get("oem", ""),
         name=data.get("name", ""),
         price=float(data.get("price", 0)),
         description=data.get("description", ""),
         photo_path=data.get("photo_path", ""),
-        uploader_id=int(data.get("uploader_id")),
+        photo_file_id=data.get("photo_file_id"),
+        photo_hash=data.get("photo_hash"),
+        duplicate_of=duplicates[0][0] if duplicates else None,
+        uploader_id=uploader_id,
         uploader_username=data.get("uploader_username")
     )
     await query.message.answer("✅ Your part was uploaded successfully! Thanks — it will appear in Browse/Search.")
     await state.clear()
+    metrics.flow("upload", "completed")
+    matches = await db.match_saved_searches(data.get("vin", ""), data.get("oem", ""), data.get("name", ""),
+                                            float(data.get("price", 0)), data.get("description", ""), uploader_id)
+    alert_dispatcher.notify(matches, part_id)
 
 @dp.callback_query(F.data == "cancel_upload")
 async def cb_cancel_upload(query: types.CallbackQuery, state: FSMContext):
     await query.answer("Upload cancelled.")
     await state.clear()
+    metrics.flow("upload", "cancelled")
 
 # === Callback: Search start ===
 @dp.callback_query(F.data == "search")
@@ -202,6 +398,7 @@ async def cb_search_start(query: types.CallbackQuery, state: FSMContext):
     ])
     await query.message.answer("How do you want to search?", reply_markup=kb)
     await state.set_state(SearchStates.choose)
+    metrics.flow("search", "started")
 
 # specific search options
 
@@ -220,38 +417,17 @@ async def process_search_query(message: Message, state: FSMContext):
     # but here we read the state machine: if state is SearchStates.query it's used for name/vin/oem depending on prior action
     # To know which type the user selected, we'll rely on an extra stored key in state data
     data = await state.get_data()
-    mode = data.get("mode")
-    # Fallback: try keyword search
-    if not mode:
-        # assume name/keyword
-        rows = db.search_parts_by_keyword(q)
-    else:
-        if mode == "name":
-            rows = db.search_parts_by_keyword(q)
-        elif mode == "vin":
-            rows = db.search_parts_by_vin(q)
-        elif mode == "oem":
-            rows = db.search_parts_by_oem(q)
-        else:
-            rows = db.search_parts_by_keyword(q)
-
-    if not rows:
-        await message.answer("No results found.")
-    else:
-        await message.answer(f"🔍 Results for: *{q}*", parse_mode="Markdown")
-        for row in rows:
-            part_id, vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date = row
-            caption = f"🔧 *{name}*\nVIN: `{vin}` | OEM: `{oem}`\n💰 *{price} AZN*\n📝 {description}"
-            kb = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="Contact Seller", callback_data=f"contact_{part_id}")],
-                [InlineKeyboardButton(text="View Details", callback_data=f"view_{part_id}")]
-            ])
-            if photo_path and os.path.exists(photo_path):
-                await message.answer_photo(photo=FSInputFile(photo_path), caption=caption, parse_mode="Markdown", reply_markup=kb)
-            else:
-                await message.answer(caption, parse_mode="Markdown", reply_markup=kb)
-
-    await state.clear()
+    # fall back to a keyword search when no mode was chosen
+    search = new_search(mode=data.get("mode") or "name", q=q)
+    page = await fetch_search_page(search)
+    event_log.search(message.from_user.id, search["mode"], q, len(page.rows))
+
+    if not page.rows:
+        await message.answer("No results found.", reply_markup=no_results_kb(search))
+        await finish_search(state, search)
+        return
+    await send_page(message, "s", page, f"🔍 Results for: {cards.bold(q)}", search)
+    await finish_search(state, search)
 
 # handle price-range steps
 @dp.message(SearchStates.price_range_min, F.text)
@@ -274,23 +450,15 @@ async def price_max(message: Message, state: FSMContext):
         return
     data = await state.get_data()
     vmin = data.get("price_min", 0)
-    rows = db.search_parts_by_price_range(vmin, vmax)
-    if not rows:
-        await message.answer("No parts found in that price range.")
-    else:
-        await message.answer(f"🔎 Results between {vmin} AZN and {vmax} AZN:")
-        for row in rows:
-            part_id, vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date = row
-            caption = f"🔧 *{name}*\nVIN: `{vin}` | OEM: `{oem}`\n💰 *{price} AZN*\n📝 {description}"
-            kb = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="Contact Seller", callback_data=f"contact_{part_id}")],
-                [InlineKeyboardButton(text="View Details", callback_data=f"view_{part_id}")]
-            ])
-            if photo_path and os.path.exists(photo_path):
-                await message.answer_photo(photo=FSInputFile(photo_path), caption=caption, parse_mode="Markdown", reply_markup=kb)
-            else:
-                await message.answer(caption, parse_mode="Markdown", reply_markup=kb)
-    await state.clear()
+    search = new_search(mode="price", min=vmin, max=vmax)
+    page = await fetch_search_page(search)
+    event_log.search(message.from_user.id, "price", f"{vmin}-{vmax}", len(page.rows))
+    if not page.rows:
+        await message.answer("No parts found in that price range.", reply_markup=no_results_kb(search))
+        await finish_search(state, search)
+        return
+    await send_page(message, "s", page, f"🔎 Results between {vmin} AZN and {vmax} AZN:", search)
+    await finish_search(state, search)
 
 # To remember search mode (we need to set 'mode' before user types query)
 @dp.callback_query(F.data == "search_name")
@@ -304,62 +472,157 @@ async def cb_search_name_set(query: types.CallbackQuery, state: FSMContext):
 async def cb_search_vin_set(query: types.CallbackQuery, state: FSMContext):
     await query.answer()
     await state.update_data(mode="vin")
-    await query.message.answer("Enter VIN (exact match):")
+    await query.message.answer("Enter VIN (full VIN or its first characters):")
     await state.set_state(SearchStates.query)
 
 @dp.callback_query(F.data == "search_oem")
 async def cb_search_oem_set(query: types.CallbackQuery, state: FSMContext):
     await query.answer()
     await state.update_data(mode="oem")
-    await query.message.answer("Enter OEM code (exact match):")
+    await query.message.answer("Enter OEM code (dashes and spaces are ignored):")
     await state.set_state(SearchStates.query)
 
+# === Saved searches and alerts (see alerts.py) ===
+def no_results_kb(search: dict):
+    return InlineKeyboardMarkup(inline_keyboard=[[save_search_button(search, "🔔 Alert me when it's listed")]])
+
+def search_label(mode: str, query, price_min, price_max) -> str:
+    if mode == "price":
+        return f"{price_min}–{price_max} AZN"
+    if mode in ("vin", "oem"):
+        return f"{mode.upper()} {query}"
+    return f"“{query}”"
+
+async def send_alert(user_id: int, part_ids: List[int]):
+    if user_id in ban_list:
+        return
+    rows = [row for row in await asyncio.gather(*(db.get_part_by_id(i) for i in part_ids)) if row]
+    if not rows:
+        return
+    text, kb = render.listing_message(rows, "🔔 New listings matching your saved searches:")
+    try:
+        with ratelimit.priority(ratelimit.NOTIFICATION):
+            await bot.send_message(user_id, text, parse_mode="Markdown", reply_markup=kb)
+    except TelegramForbiddenError:
+        # the user blocked the bot; stop matching their searches
+        await db.delete_user_searches(user_id)
+    await render.save_cards()
+
+alert_dispatcher = alerts.AlertDispatcher(send_alert)
+metrics.Gauge("bot_alerts_pending", "Users with an alert waiting to be sent", lambda: alert_dispatcher.stats()["pending"])
+
+async def send_seller_notification(seller_id: int, text: str):
+    with ratelimit.priority(ratelimit.NOTIFICATION):
+        await bot.send_message(seller_id, text, parse_mode="Markdown")
+
+seller_outbox = notifications.SellerOutbox(send_seller_notification)
+metrics.Gauge("bot_seller_notifications_total", "Contact requests for sellers, by outcome",
+              lambda: {(outcome,): n for outcome, n in seller_outbox.stats().items()}, ("outcome",), kind="counter")
+
+@dp.callback_query(F.data.startswith("save_search"))
+async def cb_save_search(query: types.CallbackQuery, state: FSMContext):
+    search = await current_search(state, query.data.partition(":")[2])
+    if not search:
+        await query.answer("This search has expired. Please search again.", show_alert=True)
+        return
+    search_id = await db.save_search(query.from_user.id, search)
+    if search_id is None:
+        if len(await db.get_saved_searches(query.from_user.id)) >= db.MAX_SAVED_SEARCHES:
+            await query.answer(f"You can keep up to {db.MAX_SAVED_SEARCHES} alerts. Remove one under 🔔 My Alerts.",
+                               show_alert=True)
+        else:
+            await query.answer("There is nothing in this search to watch for.", show_alert=True)
+        return
+    await query.answer("🔔 Saved! I'll message you when a matching part is listed.", show_alert=True)
+
+async def send_saved_searches(message: Message, user_id: int):
+    searches = await db.get_saved_searches(user_id)
+    if not searches:
+        await message.answer("You have no alerts. Run a search and tap 🔔 to be told about new matches.")
+        return
+    lines = ["🔔 Your alerts:"] + [f"{n}. {search_label(*row[1:])}" for n, row in enumerate(searches, 1)]
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"🗑 Remove {n}", callback_data=f"unalert_{row[0]}")]
+        for n, row in enumerate(searches, 1)])
+    await message.answer("\n".join(lines), reply_markup=kb)
+
+@dp.message(Command("alerts"))
+async def cmd_alerts(message: Message):
+    await send_saved_searches(message, message.from_user.id)
+
+@dp.callback_query(F.data == "my_alerts")
+async def cb_my_alerts(query: types.CallbackQuery):
+    await query.answer()
+    await send_saved_searches(query.message, query.from_user.id)
+
+@dp.callback_query(F.data.startswith("unalert_"))
+async def cb_remove_alert(query: types.CallbackQuery):
+    removed = await db.delete_saved_search(query.from_user.id, int(query.data.split("_", 1)[1]))
+    await query.answer("Alert removed." if removed else "That alert was already removed.")
+
 # === View details handler (optional) ===
 @dp.callback_query(F.data.startswith("view_"))
 async def cb_view_detail(query: types.CallbackQuery):
     await query.answer()
-    part_id = int(query.data.split("_", 1)[1])
-    row = db.get_part_by_id(part_id)
+    await send_part_detail(query.message, int(query.data.split("_", 1)[1]))
+
+async def send_part_detail(message: Message, part_id: int):
+    row = await db.get_part_by_id(part_id)
     if not row:
-        await query.message.answer("Part not found.")
+        await message.answer("Part not found.")
         return
-    part_id, vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date = row
-    caption = (f"🔎 *{name}*\nVIN: `{vin}`\nOEM: `{oem}`\n💰 *{price} AZN*\n"
-               f"📝 {description}\n\nUploaded by: @{uploader_username if uploader_username else str(uploader_id)}")
-    if photo_path and os.path.exists(photo_path):
-        await bot.send_photo(chat_id=query.from_user.id, photo=FSInputFile(photo_path), caption=caption, parse_mode="Markdown")
-    else:
-        await query.message.answer(caption, parse_mode="Markdown")
+    event_log.view(message.chat.id, part_id)
+    caption = render.card(row).detail
+    kb = render.detail_keyboard(part_id)
+    if not await render.answer_part_photo(message, row, caption=caption, parse_mode="Markdown", reply_markup=kb):
+        await message.answer(caption, parse_mode="Markdown", reply_markup=kb)
+    await render.save_cards()
+
+# === Inline mode: "@bot <query>" from any chat ===
+# Telegram sends a query per keystroke; an answer to one the user has
+# already typed over is dropped instead of sent.
+_inline_latest: dict = {}
+
+@dp.inline_query()
+async def inline_search(query: InlineQuery):
+    user_id = query.from_user.id
+    _inline_latest[user_id] = query.id
+    try:
+        top, skip = decode_cursor(query.offset.split(":")) if query.offset else (None, 0)
+    except ValueError:
+        top, skip = None, 0
+    page = await db.search_inline_page(query.query, top, skip)
+    if _inline_latest.get(user_id) != query.id:
+        return
+    del _inline_latest[user_id]
+    me = await bot.me()
+    await query.answer([render.inline_result(row, me.username) for row in page.rows], cache_time=INLINE_CACHE_TIME,
+                       is_personal=False, next_offset=encode_cursor(page.next_cursor) if page.next_cursor else "")
+    await render.save_cards()
 
 # === Contact seller flow ===
 @dp.callback_query(F.data.startswith("contact_"))
 async def cb_contact_seller(query: types.CallbackQuery):
     await query.answer()
     part_id = int(query.data.split("_", 1)[1])
-    row = db.get_part_by_id(part_id)
+    row = await db.get_part_by_id(part_id)
     if not row:
         await query.message.answer("Part not found.")
         return
-    _, vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date = row
+    event_log.contact(query.from_user.id, part_id)
+    _, vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date = row[:10]
 
-    # Notify seller: we'll forward a templated message to seller with buyer info
+    # the seller is told through the outbox, batched with other interest (see notifications.py)
     buyer = query.from_user
     buyer_name = f"@{buyer.username}" if buyer.username else f"{buyer.full_name} (id:{buyer.id})"
-
-    # send message to seller
-    try:
-        await bot.send_message(uploader_id,
-                               f"🟢 Someone is interested in your listing *{name}*.\n"
-                               f"Buyer: {buyer_name}\n"
-                               f"Message from bot: If you want to contact, reply to this message or open chat with the buyer.",
-                               parse_mode="Markdown")
-        await query.message.answer("✅ I notified the seller. They will contact you soon (or check their Telegram).")
-    except Exception:
-        # If bot cannot message (seller blocked bot) fallback: provide seller username if available
-        if uploader_username:
-            await query.message.answer(f"Seller's username: @{uploader_username}. You can message them directly.")
-        else:
-            await query.message.answer("Could not message seller. Seller may have privacy settings. Try browsing other listings or ask admin for help.")
+    if await seller_outbox.queue(uploader_id, buyer.id, buyer_name, part_id, name):
+        text = "✅ I'll let the seller know you're interested. They will contact you soon (or check their Telegram)."
+    else:
+        text = "✅ The seller already knows you're interested in this listing."
+    # in case the seller blocked the bot or is slow to answer
+    if uploader_username:
+        text += f"\nSeller's username: @{uploader_username}. You can message them directly."
+    await query.message.answer(text)
 
 # Admins Section
 from aiogram.types import ReplyKeyboardRemove
@@ -376,10 +639,65 @@ async def admin_menu(message: Message):
         [InlineKeyboardButton(text="🗑 Delete a listing", callback_data="admin_delete")],
         [InlineKeyboardButton(text="⛔ Ban a user", callback_data="admin_ban")],
         [InlineKeyboardButton(text="📊 View stats", callback_data="admin_stats")],
+        [InlineKeyboardButton(text="📈 Trends", callback_data="admin_trends")],
         [InlineKeyboardButton(text="↩ Back to main menu", callback_data="back_menu")]
     ]
 )
-    await message.answer("🛠 Welcome to the Admin Panel:", reply_markup=kb)
+    await message.answer("🛠 Welcome to the Admin Panel:\n"
+                         "Bulk upload: send a .csv or .jsonl file with the caption /import.\n"
+                         "Download all listings: /export (or /export jsonl).", reply_markup=kb)
+
+@dp.message(Command("import"))
+async def admin_import(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ You are not authorized to use this.")
+        return
+    if not message.document:
+        await message.answer("Attach a .csv or .jsonl file and put /import in its caption.\n"
+                             "Columns: name, price (required), vin, oem, description, photo_file_id, "
+                             "uploader_id, uploader_username.")
+        return
+    try:
+        fmt = bulk.file_format(message.document.file_name or "")
+    except ValueError as e:
+        await message.answer(f"⚠️ {e}")
+        return
+    await message.answer("⏳ Importing…")
+    tally = bulk.ImportTally()
+    with tempfile.NamedTemporaryFile(suffix=f".{fmt}") as tmp:
+        await bot.download(message.document, destination=tmp.name)
+        with open(tmp.name, encoding="utf-8-sig", newline="") as f:
+            chunks = bulk.read_chunks(f, fmt, message.from_user.id, message.from_user.username, tally)
+            try:
+                # parsed in a thread, inserted in line with the bot's other writes
+                while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+                    part_ids = await db.add_parts_bulk(chunk)
+                    tally.imported += len(part_ids)
+                    for part_id, matches in zip(part_ids, await db.match_saved_searches_bulk(chunk)):
+                        alert_dispatcher.notify(matches, part_id)
+            except (ValueError, UnicodeDecodeError) as e:
+                await message.answer(f"⚠️ Import stopped after {tally.imported} listings: {e}"
+                                     if tally.imported else f"⚠️ Import failed: {e}")
+                return
+    await message.answer(bulk.format_report(tally.report()))
+
+@dp.message(Command("export"))
+async def admin_export(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ You are not authorized to use this.")
+        return
+    fmt = "jsonl" if "jsonl" in (message.text or "") else "csv"
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"listings.{fmt}")
+        count, after = 0, 0
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            write = bulk.row_writer(f, fmt)
+            # batch by batch, so no reader connection is held for the whole export
+            while rows := await db.get_parts_batch(after, bulk.EXPORT_BATCH, ", ".join(bulk.EXPORT_COLUMNS)):
+                write(rows)
+                count += len(rows)
+                after = rows[-1][0]
+        await message.answer_document(FSInputFile(path), caption=f"📤 {count} listings")
 
 @dp.callback_query(F.data == "admin_listings")
 async def admin_listings(query: CallbackQuery):
@@ -387,29 +705,11 @@ async def admin_listings(query: CallbackQuery):
         await query.answer("❌ Unauthorized", show_alert=True)
         return
 
-    parts = db.fetch_parts(limit=20, offset=0)  # For demo, fetch first 20
-    if not parts:
+    page = await db.get_latest_page(limit=ADMIN_PAGE_SIZE)
+    if not page.rows:
         await query.message.answer("No listings available.")
         return
-
-    for part in parts:
-        part_id = part[0]  # or part['id'] if using dicts
-        caption = (
-            f"ID: {part_id}\n"
-            f"Name: {part[3]}\n"
-            f"VIN: {part[1]}\n"
-            f"Price: {part[4]} AZN\n"
-            f"Uploaded by: @{part[8] if part[8] else part[7]}"
-        )
-
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🗑 Delete", callback_data=f"admin_delete_{part_id}")]
-        ])
-
-        if part[6] and os.path.exists(part[6]):
-            await query.message.answer_photo(photo=FSInputFile(part[6]), caption=caption, reply_markup=kb)
-        else:
-            await query.message.answer(caption, reply_markup=kb)
+    await send_page(query.message, "a", page, "📄 Listings:")
 
 @dp.callback_query(F.data.startswith("admin_delete_"))
 async def admin_delete_listing(query: CallbackQuery):
@@ -418,24 +718,197 @@ async def admin_delete_listing(query: CallbackQuery):
         return
 
     part_id = int(query.data.split("_")[-1])
-    db.delete_part(part_id)
+    orphaned = await db.delete_part(part_id)
+    images.remove_image(orphaned)
     await query.message.answer(f"✅ Listing {part_id} has been deleted.")
 
+# === Bans (see bans.py) ===
+async def send_ban_panel(message: Message):
+    lines = [f"⛔ Banned users: {len(ban_list)}"]
+    kb = []
+    for user_id, username, reason, banned_at in await db.get_banned_users():
+        who = f"@{username} ({user_id})" if username else str(user_id)
+        lines.append(f"• {who}, {banned_at[:10]}" + (f" — {reason}" if reason else ""))
+        kb.append([InlineKeyboardButton(text=f"✅ Unban {who}", callback_data=f"admin_unban_{user_id}")])
+    lines.append("\nSend the numeric id or @username of the user to ban, optionally followed by a reason.")
+    kb.append([InlineKeyboardButton(text="↩ Cancel", callback_data="admin_ban_cancel")])
+    await message.answer("\n".join(lines), reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+
+async def ban_target(message: Message, user_id: int, reason, admin_id: int):
+    if is_admin(user_id):
+        await message.answer("⚠️ Admins can't be banned.")
+        return
+    await ban_list.ban(user_id, reason, admin_id)
+    await message.answer(f"⛔ User {user_id} is banned; the bot now ignores them.")
+
+@dp.callback_query(F.data == "admin_ban")
+async def admin_ban(query: CallbackQuery, state: FSMContext):
+    if not is_admin(query.from_user.id):
+        await query.answer("❌ Unauthorized", show_alert=True)
+        return
+    await query.answer()
+    await send_ban_panel(query.message)
+    await state.set_state(AdminStates.ban)
+
+@dp.message(AdminStates.ban, F.text)
+async def admin_ban_input(message: Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        await state.clear()
+        return
+    target, _, reason = message.text.strip().partition(" ")
+    user_id = int(target) if target.isdigit() else await db.find_user_id(target)
+    if user_id is None:
+        await message.answer(f"⚠️ I haven't seen {target}. Send their numeric id instead.")
+        return
+    await state.clear()
+    await ban_target(message, user_id, reason.strip() or None, message.from_user.id)
+
+@dp.callback_query(F.data == "admin_ban_cancel")
+async def admin_ban_cancel(query: CallbackQuery, state: FSMContext):
+    await query.answer("Cancelled.")
+    await state.clear()
+
+@dp.callback_query(F.data.startswith("admin_banuser_"))
+async def admin_ban_seller(query: CallbackQuery):
+    # from the ban button under a listing in the admin list
+    if not is_admin(query.from_user.id):
+        await query.answer("❌ Unauthorized", show_alert=True)
+        return
+    await query.answer()
+    await ban_target(query.message, int(query.data.rsplit("_", 1)[1]), None, query.from_user.id)
+
+@dp.callback_query(F.data.startswith("admin_unban_"))
+async def admin_unban(query: CallbackQuery):
+    if not is_admin(query.from_user.id):
+        await query.answer("❌ Unauthorized", show_alert=True)
+        return
+    removed = await ban_list.unban(int(query.data.rsplit("_", 1)[1]))
+    await query.answer("Unbanned." if removed else "That user wasn't banned.")
+
 @dp.callback_query(F.data == "admin_stats")
 async def admin_stats(query: CallbackQuery):
     if not is_admin(query.from_user.id):
         await query.answer("❌ Unauthorized", show_alert=True)
         return
 
-    total_listings = db.count_parts()
-    # For demo, searches & users can be implemented later
-    await query.message.answer(f"📊 Stats:\n• Total uploads: {total_listings}\n• Total users: TBD\n• Searches: TBD")
+    totals = await db.get_stats()
+    today = {key: sum(days.values())
+             for key, days in (await db.get_daily_stats(datetime.utcnow().date().isoformat())).items()}
+    await query.message.answer(
+        "📊 Stats:\n"
+        f"• Listings: {totals.get('listings', 0)} ({totals.get('uploads', 0)} uploaded in all, "
+        f"{today.get('uploads', 0)} today)\n"
+        f"• Total users: {totals.get('users', 0)} ({today.get('users', 0)} new today)\n"
+        f"• Searches: {totals.get('searches', 0)} ({totals.get('zero_results', 0)} found nothing; "
+        f"{today.get('searches', 0)} today)\n"
+        f"• Listing views: {totals.get('views', 0)}, seller contacts: {totals.get('contacts', 0)}\n\n"
+        "Since restart:\n" + stats_summary())
+
+TREND_DAYS = 14
+TREND_SERIES = (("uploads", "Uploads"), ("searches", "Searches"), ("zero_results", "No results"),
+                ("views", "Views"), ("contacts", "Contacts"), ("users", "New users"))
+
+@dp.callback_query(F.data == "admin_trends")
+async def admin_trends(query: CallbackQuery):
+    if not is_admin(query.from_user.id):
+        await query.answer("❌ Unauthorized", show_alert=True)
+        return
+    await query.answer()
+    first = datetime.utcnow().date() - timedelta(days=TREND_DAYS - 1)
+    days = [(first + timedelta(days=i)).isoformat() for i in range(TREND_DAYS)]
+    daily, oems, misses = await asyncio.gather(db.get_daily_stats(days[0]), db.top_searched_oems(),
+                                               db.top_zero_result_queries())
+    lines = [f"{label:<10} {render.sparkline([daily.get(key, {}).get(d, 0) for d in days])} "
+             f"{sum(daily.get(key, {}).values())}" for key, label in TREND_SERIES]
+    text = f"📈 Last {TREND_DAYS} days ({days[0]} – {days[-1]}):\n```\n" + "\n".join(lines) + "\n```"
+    if oems:
+        text += "\n\n🔝 Most searched OEM codes:\n" + "\n".join(f"`{oem}` — {n}" for oem, n in oems)
+    if misses:
+        # price searches are logged as "min-max"
+        text += "\n\n🕳 Searches that found nothing:\n" + "\n".join(
+            cards.escape(f"{q} AZN" if mode == "price" else search_label(mode, q, None, None)) + f" — {n}"
+            for mode, q, n in misses)
+    await query.message.answer(text, parse_mode="Markdown")
+
+def _ms(seconds) -> str:
+    return "–" if seconds is None else f"{seconds * 1000:.0f} ms"
+
+def stats_summary() -> str:
+    # since this process started; /metrics has the full picture
+    active = dict(metrics.ACTIVE_USERS.counts())
+    upload, search = metrics.flow_summary("upload"), metrics.flow_summary("search")
+    updates = metrics.UPDATES.values()
+    handlers = metrics.HANDLER_LATENCY
+    slowest = sorted(((handlers.quantile(0.95, *labels), labels[0]) for labels in handlers.values()), reverse=True)[:3]
+    db_calls = metrics.DB_LATENCY
+    api_calls = metrics.API_LATENCY.count()
+    api_errors = sum(metrics.API_ERRORS.values().values())
+    cache = db.query_cache.stats()
+    lines = [
+        f"• Active users: {active[('5m',)]} (5 min) / {active[('1h',)]} (1 h) / {active[('24h',)]} (24 h)",
+        f"• Searches: {search['completed']} (+{handlers.count('inline_search')} inline), "
+        f"{search['abandoned']} abandoned",
+        f"• Upload dialogs: {upload['started']} started, {upload['completed']} completed, "
+        f"{upload['cancelled']} cancelled, {upload['rejected']} duplicates, {upload['abandoned']} abandoned",
+        f"• Updates: {int(sum(updates.values()))}, "
+        f"{int(sum(n for (_, outcome), n in updates.items() if outcome == 'error'))} failed",
+        f"• Handler latency: p50 {_ms(handlers.quantile(0.5))}, p95 {_ms(handlers.quantile(0.95))}",
+        "• Slowest handlers (p95): " + (", ".join(f"{name} {_ms(p95)}" for p95, name in slowest) or "–"),
+        f"• DB calls: {db_calls.count()}, p95 {_ms(db_calls.quantile(0.95))}; "
+        f"query cache hit rate {cache['hit_rate']:.0%}",
+        f"• Bot API calls: {api_calls}, {api_errors} failed",
+    ]
+    return "\n".join(lines)
+
+
+# === Start polling or webhook ===
+async def sync_worker_state():
+    # see db.sync_indexes
+    while True:
+        await asyncio.sleep(WORKER_SYNC_INTERVAL)
+        try:
+            await db.sync_indexes()
+            await ban_list.refresh()
+        except Exception:
+            logging.exception("worker sync failed")
 
 
-# === Start polling ===
 async def main():
     print("Bot is starting...")
-    await dp.start_polling(bot)
+    images.start()
+    background = []
+    # one sweeper is enough for the images directory all workers share, and
+    # one outbox delivers the notifications any of them queued
+    if WORKER_INDEX == 0:
+        background.append(asyncio.create_task(images.sweep_forever(db.referenced_photo_paths)))
+        background.append(asyncio.create_task(seller_outbox.run()))
+    if RUN_MODE == "worker":
+        await db.sync_indexes()
+        background.append(asyncio.create_task(sync_worker_state()))
+    metrics_server = await metrics.serve(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    try:
+        if RUN_MODE == "worker":
+            await webhook.run_worker(dp, bot, WORKER_SECRET, WORKER_INDEX, WORKER_PORT, WEBHOOK_MAX_IN_FLIGHT)
+        elif RUN_MODE == "webhook":
+            await webhook.run_webhook(dp, bot, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+                                      WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_MAX_IN_FLIGHT)
+        else:
+            # polling and a registered webhook are mutually exclusive
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        for task in background:
+            task.cancel()
+        if RUN_MODE != "polling":
+            # start_polling closes it on the way out
+            await dp.storage.close()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        await alert_dispatcher.close()
+        await event_log.close()
+        await bot.session.close()
+        images.close()
+        db.close()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,225 @@
+# Bulk import and export of listings, for dealers with whole catalogues.
+#
+#   python bulk.py import parts.csv --uploader-id 123 [--username dealer] [--db carparts.db]
+#   python bulk.py export parts.jsonl [--db carparts.db]
+#
+# Files are CSV with a header row, or JSON Lines with one object per line,
+# told apart by extension. Columns/keys: name and price (required), vin, oem,
+# description, photo_file_id (a Telegram file_id the bot can send), and
+# uploader_id / uploader_username to list parts for someone other than the
+# importer. Unknown columns are ignored.
+#
+# Imported rows go through the fingerprint half of duplicate detection (same
+# OEM, name words and price as an older listing, see database.py) and are
+# flagged, not rejected. Saved-search alerts only go out for imports sent to
+# the bot with /import; this script has no bot to send them.
+import argparse
+import csv
+import json
+import math
+import sys
+from typing import IO, Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+import database as db
+
+IMPORT_CHUNK = 5000
+EXPORT_BATCH = 1000
+# errors kept for the report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+REQUIRED = ("name", "price")
+EXPORT_COLUMNS = ("id", "vin", "oem", "name", "price", "description", "photo_file_id", "uploader_id",
+                  "uploader_username", "upload_date")
+
+MAX_LENGTHS = {"vin": 32, "oem": 64, "name": 200, "description": 1000, "photo_file_id": 200,
+               "uploader_username": 64}
+
+
+class ImportReport(NamedTuple):
+    imported: int
+    failed: int
+    # (line number, message) of the first MAX_REPORTED_ERRORS bad rows
+    errors: List[Tuple[int, str]]
+
+
+class ImportTally:
+    # running counts of an import fed by read_chunks
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors: List[Tuple[int, str]] = []
+
+    def reject(self, line_no: int, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line_no, message))
+
+    def report(self) -> ImportReport:
+        return ImportReport(self.imported, self.failed, self.errors)
+
+
+def file_format(filename: str) -> str:
+    name = filename.lower()
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    if name.endswith((".csv", ".txt")):
+        return "csv"
+    raise ValueError("expected a .csv or .jsonl file")
+
+
+def iter_records(stream: IO[str], fmt: str) -> Iterator[Tuple[int, object]]:
+    # (line number, record) pairs, read one line at a time
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        missing = [col for col in REQUIRED if col not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"CSV header is missing: {', '.join(missing)}")
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_no, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, ValueError(f"invalid JSON: {e.msg}")
+
+
+def _text(record: dict, key: str) -> str:
+    value = record.get(key)
+    value = "" if value is None else str(value).strip()
+    if len(value) > MAX_LENGTHS[key]:
+        raise ValueError(f"{key} is longer than {MAX_LENGTHS[key]} characters")
+    return value
+
+
+def validate(record, uploader_id: int, uploader_username: Optional[str]) -> Tuple:
+    """Row values for ``db.add_parts_bulk``, or ValueError saying what is wrong."""
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError("expected an object")
+    name = _text(record, "name")
+    if not name:
+        raise ValueError("name is required")
+    try:
+        price = float(str(record.get("price", "")).replace(",", "."))
+    except ValueError:
+        raise ValueError(f"price {record.get('price')!r} is not a number") from None
+    if not math.isfinite(price) or price < 0:
+        raise ValueError("price must be zero or more")
+    vin = _text(record, "vin")
+    if len(db.normalize_code(vin)) > 17:
+        raise ValueError("vin has more than 17 characters")
+    owner = record.get("uploader_id")
+    if owner not in (None, ""):
+        try:
+            owner = int(owner)
+        except (TypeError, ValueError):
+            raise ValueError("uploader_id must be an integer") from None
+        username = _text(record, "uploader_username") or None
+    else:
+        owner, username = uploader_id, uploader_username
+    return (vin, _text(record, "oem"), name, price, _text(record, "description"),
+            _text(record, "photo_file_id") or None, owner, username)
+
+
+def read_chunks(stream: IO[str], fmt: str, uploader_id: int, uploader_username: Optional[str],
+                tally: ImportTally, chunk_size: int = IMPORT_CHUNK) -> Iterator[List[Tuple]]:
+    """Stream-parse ``stream`` into lists of up to ``chunk_size`` valid rows for
+    ``db.add_parts_bulk``; bad rows are counted in ``tally``."""
+    chunk = []
+    for line_no, record in iter_records(stream, fmt):
+        try:
+            chunk.append(validate(record, uploader_id, uploader_username))
+        except ValueError as e:
+            tally.reject(line_no, str(e))
+            continue
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_parts(stream: IO[str], fmt: str, uploader_id: int, uploader_username: Optional[str] = None,
+                 chunk_size: int = IMPORT_CHUNK) -> ImportReport:
+    """Insert the valid rows of ``stream``, ``chunk_size`` per transaction.
+    Blocking; the bot feeds read_chunks to the database writer instead."""
+    tally = ImportTally()
+    for chunk in read_chunks(stream, fmt, uploader_id, uploader_username, tally, chunk_size):
+        tally.imported += len(db.add_parts_bulk.sync(chunk))
+    return tally.report()
+
+
+def row_writer(out: IO[str], fmt: str) -> Callable[[List[Tuple]], None]:
+    # writes the CSV header right away, then each batch of EXPORT_COLUMNS rows
+    # it is called with
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(EXPORT_COLUMNS)
+        return writer.writerows
+
+    def write(rows: List[Tuple]):
+        for row in rows:
+            out.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n")
+    return write
+
+
+def export_parts(out: IO[str], fmt: str, batch: int = EXPORT_BATCH) -> int:
+    """Write every listing to ``out``, reading ``batch`` rows at a time."""
+    write = row_writer(out, fmt)
+    count, after = 0, 0
+    while rows := db.get_parts_batch.sync(after, batch, ", ".join(EXPORT_COLUMNS)):
+        write(rows)
+        count += len(rows)
+        after = rows[-1][0]
+    return count
+
+
+def format_report(report: ImportReport, limit: int = 20) -> str:
+    lines = [f"📥 Imported {report.imported} listings; {report.failed} rows rejected."]
+    lines += [f"line {line_no}: {message}" for line_no, message in report.errors[:limit]]
+    if report.failed > limit:
+        lines.append(f"… and {report.failed - limit} more")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Bulk import and export of listings.")
+    ap.add_argument("--db", help="database file (default: DB_PATH or carparts.db)")
+    sub = ap.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="add listings from a CSV or JSONL file")
+    imp.add_argument("file")
+    imp.add_argument("--uploader-id", type=int, required=True, help="owner of rows that don't name one")
+    imp.add_argument("--username", help="Telegram username of that owner")
+    imp.add_argument("--chunk", type=int, default=IMPORT_CHUNK)
+    exp = sub.add_parser("export", help="write every listing to a CSV or JSONL file ('-' for stdout)")
+    exp.add_argument("file")
+    exp.add_argument("--format", choices=("csv", "jsonl"))
+    args = ap.parse_args(argv)
+
+    if args.db:
+        db.configure(args.db)
+    db.init_db()
+    try:
+        if args.command == "import":
+            with open(args.file, encoding="utf-8-sig", newline="") as f:
+                report = import_parts(f, file_format(args.file), args.uploader_id, args.username, args.chunk)
+            print(format_report(report, MAX_REPORTED_ERRORS))
+            return 1 if report.failed else 0
+        fmt = args.format or ("csv" if args.file == "-" else file_format(args.file))
+        if args.file == "-":
+            count = export_parts(sys.stdout, fmt)
+        else:
+            with open(args.file, "w", encoding="utf-8", newline="") as f:
+                count = export_parts(f, fmt)
+        print(f"exported {count} listings", file=sys.stderr)
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+import functools
+import json
+import re
+from typing import NamedTuple, Optional
+
+# A listing's texts are rendered and Markdown-escaped once, when the part is
+# stored, and kept with the row in parts.card; a view only puts the list
+# number in front. Rows stored before cards existed, or under another
+# CARD_VERSION, are rendered on their next view and written back (see
+# render.card). Bump CARD_VERSION whenever a template below changes.
+CARD_VERSION = 2
+# list lines are kept short so a full page stays well under 4096 characters
+DESCRIPTION_PREVIEW = 80
+# parsed cards kept, keyed by their stored text
+LOADED_CACHE_SIZE = 4096
+
+
+class Card(NamedTuple):
+    line: str    # list entry, after its "*<n>.* " prefix (Markdown)
+    detail: str  # detail view and inline result caption (Markdown)
+    album: str   # album photo caption, after its "<n>. " prefix (plain text)
+
+
+def escape(text) -> str:
+    # user text outside of an entity, in legacy Markdown
+    return re.sub(r"([_*`\[])", r"\\\1", str(text))
+
+
+def bold(text) -> str:
+    # user text in bold. Legacy Markdown has no escapes inside an entity, so
+    # the characters that need one are left out of the bold runs, escaped.
+    parts = re.split(r"([_*`\[])", str(text))
+    return "".join("\\" + part if i % 2 else f"*{part}*" if part.strip() else part
+                   for i, part in enumerate(parts))
+
+
+def code(text) -> str:
+    # nothing can be escaped inside `code`, so a backtick becomes a quote
+    text = str(text or "").replace("`", "'")
+    return f"`{text}`" if text else "—"
+
+
+def render(vin: Optional[str], oem: Optional[str], name: Optional[str], price, description: Optional[str],
+           uploader_id: Optional[int], uploader_username: Optional[str]) -> Card:
+    title, description = bold(name or ""), str(description or "")
+    preview = description
+    if len(preview) > DESCRIPTION_PREVIEW:
+        preview = preview[:DESCRIPTION_PREVIEW - 1] + "…"
+    seller = escape(uploader_username) if uploader_username else str(uploader_id)
+    return Card(
+        line=f"{title} — 💰 *{price} AZN*\nVIN: {code(vin)} | OEM: {code(oem)}\n📝 {escape(preview)}",
+        detail=(f"🔎 {title}\nVIN: {code(vin)}\nOEM: {code(oem)}\n💰 *{price} AZN*\n"
+                f"📝 {escape(description)}\n\nUploaded by: @{seller}"),
+        album=f"{name or ''} — {price} AZN",
+    )
+
+
+def for_row(row) -> Card:
+    # ``row`` in database.PART_COLUMNS order
+    return render(row[1], row[2], row[3], row[4], row[5], row[7], row[8])
+
+
+def dump(card: Card) -> str:
+    return json.dumps([CARD_VERSION, *card], ensure_ascii=False)
+
+
+@functools.lru_cache(maxsize=LOADED_CACHE_SIZE)
+def load(stored: Optional[str]) -> Optional[Card]:
+    # None when there is no card, or it was rendered by other templates
+    if not stored:
+        return None
+    version, *texts = json.loads(stored)
+    return Card(*texts) if version == CARD_VERSION else None
@@ -1,15 +1,359 @@
+import asyncio
+import functools
+import inspect
+import json
+import os
+import queue
+import re
 import sqlite3
-from typing import List, Tuple, Optional
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Tuple, Optional
 from datetime import datetime
-import os
 
-DB_PATH = "carparts.db"
+import cards
+import metrics
+from alerts import AlertIndex
+from hamming import MultiIndexHash
+from querycache import QueryCache, _MISSING
 
-def init_db():
-    os.makedirs("images", exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
+DB_PATH = os.getenv("DB_PATH", "carparts.db")
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+
+PART_COLUMNS = ("id, vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date, "
+                "photo_file_id, duplicate_of, card")
+# same columns, qualified for joins against the FTS index
+P_COLUMNS = ", ".join(f"p.{col.strip()}" for col in PART_COLUMNS.split(","))
+
+# hard cap on rows returned by a single full-text search
+SEARCH_LIMIT = 50
+
+# Applied to every pooled connection. WAL lets readers run alongside the writer,
+# NORMAL sync is safe under WAL, and the cache/mmap sizes keep hot pages in memory.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA busy_timeout=5000",
+)
+# Worker processes each have their own writer thread, so between them the
+# write lock is taken in SQLite's busy handler. A write still locked out after
+# busy_timeout, as behind another worker's bulk import, is tried again up to
+# WRITE_RETRIES times, WRITE_RETRY_DELAY seconds later and doubling.
+WRITE_RETRIES = int(os.getenv("WRITE_RETRIES", "3"))
+WRITE_RETRY_DELAY = float(os.getenv("WRITE_RETRY_DELAY", "0.25"))
+
+# In-process cache in front of the read functions below (see querycache.py).
+# The TTL bounds staleness from writes made by other processes.
+QUERY_CACHE_ENTRIES = int(os.getenv("QUERY_CACHE_ENTRIES", "2048"))
+QUERY_CACHE_BYTES = int(os.getenv("QUERY_CACHE_BYTES", str(16 * 1024 * 1024)))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "300"))
+
+
+# === Connection pool ===
+class ConnectionPool:
+    def __init__(self, path: str, size: int = POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False, cached_statements=256)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            grow = self._created < self.size
+            if grow:
+                self._created += 1
+        if grow:
+            return self._connect()
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        if self._closed:
+            raise RuntimeError("connection pool is closed")
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                # refreshes planner statistics the connection's queries found stale
+                conn.execute("PRAGMA optimize")
+            except sqlite3.Error:
+                pass
+            conn.close()
+
+
+_pool: Optional[ConnectionPool] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_writer: Optional[ThreadPoolExecutor] = None
+_init_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool, _executor, _writer
+    if _pool is None:
+        with _init_lock:
+            if _pool is None:
+                # one worker thread per connection, so a job never waits for a free
+                # connection; the writer thread gets the extra one
+                _executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="db")
+                _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+                _pool = ConnectionPool(DB_PATH, POOL_SIZE + 1)
+    return _pool
+
+
+def configure(path: Optional[str] = None, pool_size: Optional[int] = None):
+    """Point the data layer at another database file (tests, benchmarks, CLI)."""
+    global DB_PATH, POOL_SIZE, _photo_index, _alert_index
+    close()
+    if path is not None:
+        DB_PATH = path
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    query_cache.clear()
+    # in-memory indexes of the old file
+    _photo_index = _alert_index = None
+    _sync_marks.clear()
+
+
+def close():
+    global _pool, _executor, _writer
+    for executor in (_executor, _writer):
+        if executor is not None:
+            executor.shutdown(wait=True)
+    if _pool is not None:
+        _pool.close()
+    _pool, _executor, _writer = None, None, None
+
+
+def _locked(e: sqlite3.OperationalError) -> bool:
+    # SQLITE_BUSY, including the BUSY_SNAPSHOT the busy handler never waits on
+    return "database is locked" in str(e)
+
+
+def _pooled(fn=None, *, write: bool = False):
+    """Run ``fn(conn, ...)`` on the DB executor with a pooled connection.
+
+    The decorated name is awaitable; ``name.sync(...)`` runs it inline for
+    scripts that have no event loop. Calls are timed into ``metrics`` under
+    the function's name.
+
+    ``write=True`` functions queue for a single writer thread instead, so the
+    process's writes go through one at a time, in order, rather than several
+    threads spinning in SQLite's busy handler for the write lock while readers
+    wait for a thread. Between processes only the WAL write lock and
+    busy_timeout serialize them, so a write that finds the database locked
+    is rolled back and run again (see WRITE_RETRIES); each write function is
+    one transaction, which makes that safe.
+    """
+    if fn is None:
+        return functools.partial(_pooled, write=write)
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def sync(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            for attempt in range(WRITE_RETRIES + 1 if write else 1):
+                try:
+                    with get_pool().connection() as conn:
+                        return fn(conn, *args, **kwargs)
+                except sqlite3.OperationalError as e:
+                    if attempt == WRITE_RETRIES or not _locked(e):
+                        raise
+                    metrics.DB_BUSY_RETRIES.inc(name)
+                    time.sleep(WRITE_RETRY_DELAY * 2 ** attempt)
+        finally:
+            metrics.DB_LATENCY.observe(time.perf_counter() - t0, name)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        get_pool()
+        loop = asyncio.get_running_loop()
+        queued = time.perf_counter()
+
+        def run():
+            metrics.DB_WAIT.observe(time.perf_counter() - queued)
+            return sync(*args, **kwargs)
+        return await loop.run_in_executor(_writer if write else _executor, run)
+
+    wrapper.sync = sync
+    return wrapper
+
+
+# === Query cache ===
+query_cache = QueryCache(QUERY_CACHE_ENTRIES, QUERY_CACHE_BYTES, QUERY_CACHE_TTL)
+metrics.Gauge("bot_query_cache_lookups_total", "Query cache lookups, by result",
+              lambda: {("hit",): query_cache.hits, ("miss",): query_cache.misses}, ("result",), kind="counter")
+metrics.Gauge("bot_query_cache_bytes", "Estimated size of the cached results", lambda: query_cache.bytes)
+
+
+def _result_part_ids(result) -> List[int]:
+    if isinstance(result, Page):
+        result = result.rows
+    if isinstance(result, list):
+        return [row[0] if isinstance(row, tuple) else row for row in result]
+    if isinstance(result, tuple):
+        return [result[0]]
+    return []
+
+
+def _cached(match=None, generational=False):
+    """Serve a ``_pooled`` read function from ``query_cache``.
+
+    ``match(arguments)`` returns a predicate telling whether adding or removing
+    the part described by a probe (see ``_probe``) could change the result.
+    ``generational`` results are keyed by the cache generation instead, which
+    every added or removed part bumps.
+    """
+    def decorate(pooled):
+        signature = inspect.signature(pooled.__wrapped__)
+        name = pooled.__name__
+
+        def lookup(args, kwargs):
+            bound = signature.bind(None, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(list(bound.arguments.items())[1:])
+            key = (name, query_cache.generation if generational else 0) + tuple(arguments.values())
+            return key, arguments
+
+        def store(key, arguments, version, result):
+            query_cache.put(key, result, version, _result_part_ids(result), match(arguments) if match else None)
+
+        @functools.wraps(pooled)
+        def sync(*args, **kwargs):
+            key, arguments = lookup(args, kwargs)
+            result = query_cache.get(key)
+            if result is _MISSING:
+                version = query_cache.version
+                result = pooled.sync(*args, **kwargs)
+                store(key, arguments, version, result)
+            return result
+
+        @functools.wraps(pooled)
+        async def wrapper(*args, **kwargs):
+            key, arguments = lookup(args, kwargs)
+            result = query_cache.get(key)
+            if result is _MISSING:
+                version = query_cache.version
+                result = await pooled(*args, **kwargs)
+                store(key, arguments, version, result)
+            return result
+
+        wrapper.sync = sync
+        return wrapper
+    return decorate
+
+
+def _fold(text: str) -> str:
+    # lowercase without diacritics, as the FTS tokenizer sees it
+    return "".join(c for c in unicodedata.normalize("NFKD", text.lower()) if not unicodedata.combining(c))
+
+
+# Words as the unicode61 tokenizer of parts_fts splits them: runs of letters
+# and digits, so "_" separates words like any other punctuation. FTS queries
+# and the cache predicates below both go through fts_tokens, so a predicate
+# sees the same words as the SQL it stands in for.
+_FTS_WORD = re.compile(r"[^\W_]+")
+
+
+def fts_tokens(text: Optional[str]) -> List[str]:
+    return _FTS_WORD.findall(_fold(text or ""))
+
+
+def _probe(part_id: int, vin: str, oem: str, name: str, price: float, description: str) -> dict:
+    text = " ".join(v or "" for v in (name, description, oem, vin))
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        price = None
+    return {"id": part_id, "price": price, "tokens": set(fts_tokens(text)),
+            "vin_norm": normalize_code(vin), "oem_norm": normalize_code(oem)}
+
+
+def _any_part(arguments):
+    return lambda probe: True
+
+
+def _same_id(arguments):
+    return lambda probe: probe["id"] == arguments["part_id"]
+
+
+def _keyword_match(arguments):
+    terms = fts_tokens(arguments["keyword"])
+    return lambda probe: bool(terms) and all(any(tok.startswith(t) for tok in probe["tokens"]) for t in terms)
+
+
+def _code_match(column, argument, full_length=None):
+    # true for anything _code_filter could pick up in any tier
+    def match(arguments):
+        code = normalize_code(arguments[argument])
+        prefix = code if full_length is None or len(code) < full_length else code[:VIN_MODEL_PREFIX]
+
+        def check(probe):
+            value = probe[column]
+            return bool(code and value) and (value.startswith(prefix) or _within_one_edit(value, code))
+        return check
+    return match
+
+
+def _price_match(arguments):
+    return lambda probe: probe["price"] is not None and arguments["min_p"] <= probe["price"] <= arguments["max_p"]
+
+
+def _inline_match(arguments):
+    terms = _inline_terms(arguments["text"])
+    if not terms:
+        return _any_part(arguments)
+    checks = [lambda probe: all(any(tok.startswith(t) for tok in probe["tokens"]) if prefix else t in probe["tokens"]
+                                for t, prefix in terms)]
+    if _looks_like_code(arguments["text"]):
+        checks += [_code_match("vin_norm", "text", 17)(arguments), _code_match("oem_norm", "text")(arguments)]
+    return lambda probe: any(check(probe) for check in checks)
+
+
+# === Schema ===
+# Steps of the schema, applied in order by the runner in Migrations below.
+def _run_script(conn: sqlite3.Connection, script: str):
+    # like executescript, which would commit the migration's transaction first
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ""
+
+
+def _create_parts(conn: sqlite3.Connection):
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS parts (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         vin TEXT,
@@ -23,129 +367,1252 @@ def init_db():
         upload_date TEXT
     )
     """)
-    conn.commit()
-    conn.close()
 
-def add_part(vin: str, oem: str, name: str, price: float, description: str,
-             photo_path: str, uploader_id: int, uploader_username: Optional[str]):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+
+def _add_photo_file_id(conn: sqlite3.Connection):
+    # Telegram file_id of the listing photo, so it is uploaded only once
+    _add_missing_columns(conn, "parts", (("photo_file_id", "TEXT"),))
+
+
+def _create_parts_indexes(conn: sqlite3.Connection):
+    # serves the (price, id) keyset of price-range pages
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_parts_price ON parts(price)")
+    # photo files are shared by identical uploads; delete_part checks for other users
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_parts_photo_path ON parts(photo_path)")
+
+
+def _create_fsm_state(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS fsm_state (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_state_expires ON fsm_state(expires_at)")
+
+
+def _create_saved_searches(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS saved_searches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        mode TEXT NOT NULL,
+        query TEXT,
+        price_min REAL,
+        price_max REAL,
+        created_at TEXT
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_saved_searches_user ON saved_searches(user_id)")
+
+
+_FTS_INSERT_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS parts_fts_ai AFTER INSERT ON parts BEGIN
+        INSERT INTO parts_fts(rowid, name, description, oem, vin)
+        VALUES (new.id, new.name, new.description, new.oem, new.vin);
+    END;
+"""
+
+def _init_fts(conn: sqlite3.Connection):
+    # External-content FTS5 index over the searchable text columns, kept in sync
+    # by triggers. Name matches weigh most, then the codes, then the description.
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'parts_fts'").fetchone()
+    conn.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS parts_fts USING fts5(
+        name, description, oem, vin,
+        content='parts', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """)
+    _run_script(conn, _FTS_INSERT_TRIGGER + """
+    CREATE TRIGGER IF NOT EXISTS parts_fts_ad AFTER DELETE ON parts BEGIN
+        INSERT INTO parts_fts(parts_fts, rowid, name, description, oem, vin)
+        VALUES ('delete', old.id, old.name, old.description, old.oem, old.vin);
+    END;
+    CREATE TRIGGER IF NOT EXISTS parts_fts_au AFTER UPDATE OF name, description, oem, vin ON parts BEGIN
+        INSERT INTO parts_fts(parts_fts, rowid, name, description, oem, vin)
+        VALUES ('delete', old.id, old.name, old.description, old.oem, old.vin);
+        INSERT INTO parts_fts(rowid, name, description, oem, vin)
+        VALUES (new.id, new.name, new.description, new.oem, new.vin);
+    END;
+    """)
+    if not exists:
+        conn.execute("INSERT INTO parts_fts(parts_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0, 5.0, 5.0)')")
+        # index rows that were there before the FTS table existed
+        conn.execute("INSERT INTO parts_fts(parts_fts) VALUES ('rebuild')")
+
+
+def fts_query(text: str) -> str:
+    # every word must match, as a prefix, so "brak pad" finds "Brake Pads"
+    terms = fts_tokens(text)
+    return " ".join(f'"{t}"*' for t in terms)
+
+
+# === Normalized VIN / OEM codes ===
+# Users type codes with dashes, spaces and mixed case, so lookups go through
+# shadow columns holding the uppercased alphanumerics only.
+NORM_COLUMNS = (("vin_norm", "TEXT"), ("oem_norm", "TEXT"))
+# a VIN's maker/model/year split, which nothing looked up; dropped again
+VIN_SPLIT_COLUMNS = ("vin_wmi", "vin_vds", "vin_year")
+
+# The first 11 VIN characters pin down maker, model, year and plant; parts
+# listed for a VIN sharing them fit the same car.
+VIN_MODEL_PREFIX = 11
+
+_NON_ALNUM = re.compile(r"[^0-9A-Z]")
+
+
+def normalize_code(code: Optional[str]) -> str:
+    return _NON_ALNUM.sub("", (code or "").upper())
+
+
+def _norm_values(vin: Optional[str], oem: Optional[str]) -> Tuple[str, str]:
+    return normalize_code(vin), normalize_code(oem)
+
+
+def _add_missing_columns(conn: sqlite3.Connection, table: str, columns):
+    have = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for col, col_type in columns:
+        if col not in have:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {col_type}")
+
+
+def _migrate_normalized_codes(conn: sqlite3.Connection):
+    _add_missing_columns(conn, "parts", NORM_COLUMNS)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_parts_vin_norm ON parts(vin_norm)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_parts_oem_norm ON parts(oem_norm)")
+    # backfill rows written before the shadow columns existed
+    pending = conn.execute("SELECT id, vin, oem FROM parts WHERE vin_norm IS NULL OR oem_norm IS NULL").fetchall()
+    conn.executemany(
+        "UPDATE parts SET vin_norm = ?, oem_norm = ? WHERE id = ?",
+        (_norm_values(vin, oem) + (part_id,) for part_id, vin, oem in pending))
+
+
+def _drop_vin_split(conn: sqlite3.Connection):
+    conn.execute("DROP INDEX IF EXISTS idx_parts_vin_wmi")
+    have = {row[1] for row in conn.execute("PRAGMA table_info(parts)")}
+    for col in VIN_SPLIT_COLUMNS:
+        if col in have:
+            conn.execute(f"ALTER TABLE parts DROP COLUMN {col}")
+
+
+# Codes one typo away are found through their deletion neighbourhood: each
+# distinct code is stored in code_variants under itself and every string left
+# by deleting one of its characters. Two codes within one edit share a
+# variant, so a lookup lists the query's own variants, reads the candidates
+# off the primary key and confirms each with _within_one_edit. add_part,
+# add_parts_bulk and delete_part keep the table in step with parts.
+CODE_COLUMNS = ("vin_norm", "oem_norm")
+
+
+def _code_variants(code: str) -> set:
+    return {code} | {code[:i] + code[i + 1:] for i in range(len(code))}
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    # Levenshtein distance <= 1, in one pass
+    if len(a) < len(b):
+        a, b = b, a
+    if len(a) - len(b) > 1:
+        return False
+    i = 0
+    while i < len(b) and a[i] == b[i]:
+        i += 1
+    return a[i + 1:] == (b[i + 1:] if len(a) == len(b) else b[i:])
+
+
+def _create_code_variants(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS code_variants (
+        col TEXT NOT NULL,
+        variant TEXT NOT NULL,
+        code TEXT NOT NULL,
+        PRIMARY KEY (col, variant, code)
+    ) WITHOUT ROWID
+    """)
+    for column in CODE_COLUMNS:
+        codes = conn.execute(f"SELECT DISTINCT {column} FROM parts WHERE {column} != ''").fetchall()
+        _index_codes(conn, ((column, code) for (code,) in codes))
+
+
+def _index_codes(conn: sqlite3.Connection, codes):
+    # ``codes`` holds (column, normalized code) pairs
+    # in key order, which SQLite inserts much faster than scattered keys
+    conn.executemany("INSERT OR IGNORE INTO code_variants (col, variant, code) VALUES (?, ?, ?)",
+                     sorted((column, variant, code) for column, code in set(codes) if code
+                            for variant in _code_variants(code)))
+
+
+def _unindex_codes(conn: sqlite3.Connection, codes):
+    # after a delete, for the codes no listing has any more
+    for column, code in codes:
+        if code and not conn.execute(f"SELECT 1 FROM parts WHERE {column} = ? LIMIT 1", (code,)).fetchone():
+            conn.executemany("DELETE FROM code_variants WHERE col = ? AND variant = ? AND code = ?",
+                             ((column, variant, code) for variant in _code_variants(code)))
+
+
+def _near_codes(conn: sqlite3.Connection, column: str, code: str) -> List[str]:
+    variants = tuple(_code_variants(code))
+    found = conn.execute(f"SELECT DISTINCT code FROM code_variants WHERE col = ? AND variant IN "
+                         f"({', '.join('?' * len(variants))})", (column,) + variants)
+    return sorted(other for (other,) in found if _within_one_edit(other, code))
+
+
+def _prefix_bounds(prefix: str) -> Tuple[str, str]:
+    # [prefix, next prefix) is a plain B-tree range scan on the shadow column
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _code_filter(conn: sqlite3.Connection, column: str, code: str, full_length: Optional[int],
+                 fuzzy: bool = True) -> Optional[Tuple[str, tuple]]:
+    # Picks the tightest tier that has any hit: exact code, then the prefix
+    # (a full VIN falls back to its first 11 characters), then one typo away
+    # unless ``fuzzy`` is off.
+    if not code:
+        return None
+    if conn.execute(f"SELECT 1 FROM parts WHERE {column} = ? LIMIT 1", (code,)).fetchone():
+        return f"{column} = ?", (code,)
+    if full_length is None or len(code) < full_length:
+        prefix = code
+    else:
+        prefix = code[:VIN_MODEL_PREFIX]
+    bounds = _prefix_bounds(prefix)
+    if conn.execute(f"SELECT 1 FROM parts WHERE {column} >= ? AND {column} < ? LIMIT 1", bounds).fetchone():
+        return f"{column} >= ? AND {column} < ?", bounds
+    if not fuzzy:
+        return None
+    near = tuple(_near_codes(conn, column, code)[:SEARCH_LIMIT])
+    if not near:
+        return None
+    return f"{column} IN ({', '.join('?' * len(near))})", near
+
+
+# === Duplicate detection ===
+# A listing is a likely re-post when its photo's 64-bit dHash (see images.py)
+# is within PHOTO_HASH_RADIUS bits of another listing's with a compatible OEM,
+# or when its normalized (OEM, name, price) fingerprint is identical.
+PHOTO_HASH_RADIUS = 6
+
+DUPLICATE_COLUMNS = (("photo_hash", "INTEGER"), ("fingerprint", "TEXT"), ("duplicate_of", "INTEGER"))
+
+
+def fingerprint(oem: Optional[str], name: Optional[str], price) -> str:
+    words = sorted(set(re.findall(r"\w+", _fold(name or ""))))
+    try:
+        price = f"{float(price):.0f}"
+    except (TypeError, ValueError):
+        price = ""
+    return f"{normalize_code(oem)}|{' '.join(words)}|{price}"
+
+
+def _signed64(h: Optional[int]) -> Optional[int]:
+    # SQLite integers are signed
+    return h - (1 << 64) if h is not None and h >= 1 << 63 else h
+
+
+def _unsigned64(h: int) -> int:
+    return h + (1 << 64) if h < 0 else h
+
+
+def _migrate_duplicate_keys(conn: sqlite3.Connection):
+    _add_missing_columns(conn, "parts", DUPLICATE_COLUMNS)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_parts_fingerprint ON parts(fingerprint)")
+    pending = conn.execute("SELECT id, oem, name, price FROM parts WHERE fingerprint IS NULL").fetchall()
+    conn.executemany("UPDATE parts SET fingerprint = ? WHERE id = ?",
+                     ((fingerprint(oem, name, price), part_id) for part_id, oem, name, price in pending))
+
+
+# In-memory multi-index of photo hashes, loaded on first use.
+_photo_index: Optional[MultiIndexHash] = None
+_photo_index_lock = threading.Lock()
+
+
+def _photo_hashes(conn: sqlite3.Connection) -> MultiIndexHash:
+    global _photo_index
+    if _photo_index is None:
+        with _photo_index_lock:
+            if _photo_index is None:
+                index = MultiIndexHash()
+                for part_id, h in conn.execute("SELECT id, photo_hash FROM parts WHERE photo_hash IS NOT NULL"):
+                    index.add(part_id, _unsigned64(h))
+                _photo_index = index
+    return _photo_index
+
+
+# === Keyset pagination ===
+# Pages are addressed by the sort key of their first/last row instead of an
+# OFFSET, so page N costs the same index seek as page 1. A cursor is that key
+# as a tuple, e.g. (id,) or (price, id).
+#
+# Keyword results are the exception: their bm25 order moves with every insert
+# or delete, so a (rank, id) key would skip or repeat rows between pages. The
+# search flow instead pins the ids of the SEARCH_LIMIT best matches when the
+# search runs (search_keyword_ids) and pages through that list by position
+# (get_ranked_page): deleted listings drop out of their page, and new ones
+# show up on the next search.
+PAGE_SIZE = 5
+
+
+class Page(NamedTuple):
+    rows: List[Tuple]
+    prev_cursor: Optional[tuple]
+    next_cursor: Optional[tuple]
+
+
+def _keyset_page(conn: sqlite3.Connection, select: str, where: str, params: tuple, keys: Tuple[str, ...],
+                 descending: bool, cursor: Optional[tuple], backward: bool, limit: int) -> Page:
+    # ``select`` must end with the key columns; they are split off the rows.
+    seek_down = descending != backward
+    key = f"({', '.join(keys)})"
+    if cursor is not None:
+        where = f"({where}) AND {key} {'<' if seek_down else '>'} ({', '.join('?' * len(keys))})"
+        params = params + tuple(cursor)
+    order = ", ".join(f"{k} {'DESC' if seek_down else 'ASC'}" for k in keys)
+    fetched = conn.execute(f"{select} WHERE {where} ORDER BY {order} LIMIT ?", params + (limit + 1,)).fetchall()
+    more = len(fetched) > limit
+    fetched = fetched[:limit]
+    if backward:
+        fetched.reverse()
+    if not fetched:
+        return Page([], None, None)
+    n = len(keys)
+    has_prev, has_next = (more, cursor is not None) if backward else (cursor is not None, more)
+    return Page([row[:-n] for row in fetched],
+                tuple(fetched[0][-n:]) if has_prev else None,
+                tuple(fetched[-1][-n:]) if has_next else None)
+
+
+def _latest_page(conn, cursor=None, backward=False, limit=PAGE_SIZE) -> Page:
+    return _keyset_page(conn, f"SELECT {PART_COLUMNS}, id FROM parts", "1", (), ("id",),
+                        True, cursor, backward, limit)
+
+
+def _keyword_ids(conn, keyword, limit=SEARCH_LIMIT) -> List[int]:
+    match = fts_query(keyword)
+    if not match:
+        return []
+    return [part_id for (part_id,) in conn.execute(
+        "SELECT rowid FROM parts_fts WHERE parts_fts MATCH ? ORDER BY rank, rowid LIMIT ?",
+        (match, min(limit, SEARCH_LIMIT)))]
+
+
+def _ranked_page(conn, ids, cursor=None, backward=False, limit=PAGE_SIZE) -> Page:
+    # the cursor is a position in ``ids``: where the next page starts, or
+    # where the previous one ends
+    if backward:
+        end = cursor[0] if cursor else len(ids)
+        start = max(0, end - limit)
+    else:
+        start = cursor[0] if cursor else 0
+        end = start + limit
+    window = ids[start:end]
+    if not window:
+        return Page([], None, None)
+    found = {row[0]: row for row in conn.execute(
+        f"SELECT {PART_COLUMNS} FROM parts WHERE id IN ({', '.join('?' * len(window))})", window)}
+    return Page([found[i] for i in window if i in found],
+                (start,) if start > 0 else None,
+                (end,) if end < len(ids) else None)
+
+
+def _code_page(conn, column, code, full_length, cursor=None, backward=False, limit=PAGE_SIZE) -> Page:
+    found = _code_filter(conn, column, code, full_length)
+    if found is None:
+        return Page([], None, None)
+    where, params = found
+    return _keyset_page(conn, f"SELECT {PART_COLUMNS}, id FROM parts", where, params, ("id",),
+                        True, cursor, backward, min(limit, SEARCH_LIMIT))
+
+
+def _price_page(conn, min_p, max_p, cursor=None, backward=False, limit=PAGE_SIZE) -> Page:
+    return _keyset_page(conn, f"SELECT {PART_COLUMNS}, price, id FROM parts", "price BETWEEN ? AND ?",
+                        (min_p, max_p), ("price", "id"), False, cursor, backward, min(limit, SEARCH_LIMIT))
+
+
+# === Inline mode ===
+# Inline queries arrive on every keystroke and must come back fast whatever
+# the catalogue size, so they rank (BM25) only the INLINE_WINDOW newest
+# matches instead of every match. Only the word being typed and words short
+# enough for the FTS prefix index (2-3 letters) match as prefixes; finished
+# longer words match whole, since an unindexed prefix makes FTS5 load every
+# posting of every word it covers. One-letter words are ignored. The window
+# is pinned at the newest id when the first page was served, so later pages
+# don't shift as parts are added; the next page's cursor is (top id, results
+# already shown).
+INLINE_PAGE = 20
+INLINE_WINDOW = 1000
+INLINE_MIN_TERM = 2
+INLINE_PREFIX_INDEX = 3
+
+
+def _inline_terms(text: str) -> List[Tuple[str, bool]]:
+    # (term, matches as a prefix)
+    tokens = fts_tokens(text)
+    words = [t for t in tokens if len(t) >= INLINE_MIN_TERM]
+    # the last word is still being typed unless a space or punctuation follows it
+    typing = bool(words) and len(tokens[-1]) >= INLINE_MIN_TERM and text[-1:].isalnum()
+    return [(t, len(t) <= INLINE_PREFIX_INDEX or (typing and i == len(words) - 1)) for i, t in enumerate(words)]
+
+
+def _looks_like_code(text: str) -> bool:
+    # A single word is tried against the code indexes first: VINs typed a
+    # character at a time would otherwise expand to every VIN in the FTS index.
+    text = text.strip()
+    return bool(text) and not any(c.isspace() for c in text) and len(normalize_code(text)) >= 4
+
+
+def _inline_page(conn, text, top, skip, limit) -> Page:
+    if top is None:
+        top = conn.execute("SELECT COALESCE(MAX(id), 0) FROM parts").fetchone()[0]
+    limit = min(limit, INLINE_WINDOW - skip)
+    if limit <= 0:
+        return Page([], None, None)
+    rows = None
+    if _looks_like_code(text):
+        code = normalize_code(text)
+        columns = (("vin_norm", 17), ("oem_norm", None)) if len(code) == 17 else (("oem_norm", None), ("vin_norm", 17))
+        for column, full_length in columns:
+            found = _code_filter(conn, column, code, full_length, fuzzy=False)
+            if found:
+                where, params = found
+                # at most INLINE_WINDOW ids straight off the code index, then
+                # newest first; a short prefix can cover much of the table
+                rows = conn.execute(f"""SELECT {PART_COLUMNS} FROM parts
+                                        WHERE id IN (SELECT id FROM parts WHERE ({where}) AND +id <= ? LIMIT ?)
+                                        ORDER BY id DESC LIMIT ? OFFSET ?""",
+                                    params + (top, INLINE_WINDOW, limit + 1, skip)).fetchall()
+                break
+    if rows is None:
+        terms = _inline_terms(text)
+        if terms:
+            match = " ".join(f'"{t}"*' if prefix else f'"{t}"' for t, prefix in terms)
+            rows = conn.execute(f"""SELECT {P_COLUMNS}
+                                    FROM (SELECT rowid, rank FROM parts_fts WHERE parts_fts MATCH ? AND rowid <= ?
+                                          ORDER BY rowid DESC LIMIT ?) m
+                                    JOIN parts p ON p.id = m.rowid
+                                    ORDER BY m.rank, m.rowid DESC LIMIT ? OFFSET ?""",
+                                (match, top, INLINE_WINDOW, limit + 1, skip)).fetchall()
+        else:
+            # nothing to search for yet: the newest listings
+            rows = conn.execute(f"SELECT {PART_COLUMNS} FROM parts WHERE id <= ? ORDER BY id DESC LIMIT ? OFFSET ?",
+                                (top, limit + 1, skip)).fetchall()
+    more = len(rows) > limit and skip + limit < INLINE_WINDOW
+    return Page(rows[:limit], None, (top, skip + limit) if more else None)
+
+
+# === Parts ===
+@_pooled(write=True)
+def add_part(conn: sqlite3.Connection, vin: str, oem: str, name: str, price: float, description: str,
+             photo_path: str, uploader_id: int, uploader_username: Optional[str],
+             photo_file_id: Optional[str] = None, photo_hash: Optional[int] = None,
+             duplicate_of: Optional[int] = None) -> int:
     upload_date = datetime.utcnow().isoformat()
-    c.execute("""INSERT INTO parts
-                 (vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date)
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-              (vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date))
-    conn.commit()
-    conn.close()
-
-def get_latest_parts(limit: int = 10) -> List[Tuple]:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date FROM parts ORDER BY id DESC LIMIT ?", (limit,))
-    rows = c.fetchall()
-    conn.close()
-    return rows
-
-def search_parts_by_keyword(keyword: str) -> List[Tuple]:
-    q = f"%{keyword.lower()}%"
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""SELECT id, vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date
-                 FROM parts
-                 WHERE LOWER(name) LIKE ? OR LOWER(description) LIKE ?""", (q, q))
-    rows = c.fetchall()
-    conn.close()
-    return rows
-
-def search_parts_by_vin(vin: str) -> List[Tuple]:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""SELECT id, vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date
-                 FROM parts WHERE vin = ?""", (vin,))
-    rows = c.fetchall()
-    conn.close()
-    return rows
-
-def search_parts_by_oem(oem: str) -> List[Tuple]:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""SELECT id, vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date
-                 FROM parts WHERE oem = ?""", (oem,))
-    rows = c.fetchall()
-    conn.close()
-    return rows
-
-def search_parts_by_price_range(min_p: float, max_p: float) -> List[Tuple]:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""SELECT id, vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date
-                 FROM parts WHERE price BETWEEN ? AND ? ORDER BY price""", (min_p, max_p))
-    rows = c.fetchall()
-    conn.close()
-    return rows
-
-def get_part_by_id(part_id: int) -> Optional[Tuple]:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""SELECT id, vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date
-                 FROM parts WHERE id = ?""", (part_id,))
-    row = c.fetchone()
-    conn.close()
-    return row
-
-def fetch_parts(limit: int = 20, offset: int = 0) -> List[Tuple]:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        SELECT id, vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date
-        FROM parts
-        ORDER BY id DESC
-        LIMIT ? OFFSET ?
-    """, (limit, offset))
-    rows = c.fetchall()
-    conn.close()
-    return rows
-
-def delete_part(part_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM parts WHERE id = ?", (part_id,))
-    conn.commit()
-    conn.close()
-
-def count_parts() -> int:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM parts")
-    total = c.fetchone()[0]
-    conn.close()
-    return total
+    norm = _norm_values(vin, oem)
+    card = cards.dump(cards.render(vin, oem, name, price, description, uploader_id, uploader_username))
+    with conn:
+        c = conn.execute("""INSERT INTO parts
+                     (vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date,
+                      photo_file_id, photo_hash, fingerprint, duplicate_of, card,
+                      vin_norm, oem_norm)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                  (vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date,
+                   photo_file_id, _signed64(photo_hash), fingerprint(oem, name, price), duplicate_of, card) + norm)
+        _index_codes(conn, zip(CODE_COLUMNS, norm))
+    if _photo_index is not None and photo_hash is not None:
+        _photo_index.add(c.lastrowid, photo_hash)
+    query_cache.invalidate_row(_probe(c.lastrowid, vin, oem, name, price, description))
+    return c.lastrowid
 
-def init_db():
-    # existing tables
-    conn = sqlite3.connect("database.db")
-    c = conn.cursor()
-    
-    # Add banned_users table
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS banned_users (
-            user_id INTEGER PRIMARY KEY,
-            reason TEXT,
-            banned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
+@_pooled(write=True)
+def add_parts_bulk(conn: sqlite3.Connection, parts: List[Tuple]) -> List[int]:
+    # ``parts`` holds (vin, oem, name, price, description, photo_file_id, uploader_id,
+    # uploader_username) tuples; all of them go in one transaction, and their ids are
+    # returned in order. A row is flagged as a duplicate of the oldest listing with its
+    # fingerprint, stored before or earlier in the same file; there is no photo to
+    # compare, only a file_id. The per-row FTS
+    # trigger is dropped for the load and the new rows indexed with one INSERT ...
+    # SELECT, which is several times faster; the schema change commits atomically
+    # with the rows, so no other writer ever sees parts without the trigger. The
+    # stats trigger is swapped for one rollup update the same way.
+    upload_date = datetime.utcnow().isoformat()
+    norms = [_norm_values(part[0], part[1]) for part in parts]
+    keys = [fingerprint(part[1], part[2], part[3]) for part in parts]
+    conn.execute("BEGIN IMMEDIATE")
+    with conn:
+        first_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM parts").fetchone()[0]
+        conn.execute("DROP TRIGGER IF EXISTS parts_fts_ai")
+        conn.execute("DROP TRIGGER IF EXISTS parts_stats_ai")
+        conn.executemany("""INSERT INTO parts
+                     (vin, oem, name, price, description, photo_path, uploader_id, uploader_username, upload_date,
+                      photo_file_id, fingerprint, duplicate_of, card, vin_norm, oem_norm)
+                     VALUES (?, ?, ?, ?, ?, '', ?, ?, ?, ?, ?, (SELECT MIN(id) FROM parts WHERE fingerprint = ?),
+                             ?, ?, ?)""",
+                         ((vin, oem, name, price, description, uploader_id, uploader_username, upload_date,
+                           file_id, key, key,
+                           cards.dump(cards.render(vin, oem, name, price, description, uploader_id,
+                                                   uploader_username))) + norm
+                          for (vin, oem, name, price, description, file_id, uploader_id, uploader_username), norm, key
+                          in zip(parts, norms, keys)))
+        _index_codes(conn, (pair for norm in norms for pair in zip(CODE_COLUMNS, norm)))
+        conn.execute("""INSERT INTO parts_fts(rowid, name, description, oem, vin)
+                        SELECT id, name, description, oem, vin FROM parts WHERE id > ?""", (first_id,))
+        conn.execute(_FTS_INSERT_TRIGGER)
+        conn.executemany(_UPSERT_TOTAL, (("listings", len(parts)), ("uploads", len(parts))))
+        conn.execute(_UPSERT_DAILY, (upload_date[:10], "uploads", len(parts)))
+        conn.execute(_STATS_INSERT_TRIGGER)
+        ids = [part_id for (part_id,) in conn.execute("SELECT id FROM parts WHERE id > ? ORDER BY id", (first_id,))]
+    query_cache.clear()
+    return ids
+
+@_pooled
+def get_parts_batch(conn: sqlite3.Connection, after_id: int = 0, limit: int = 1000,
+                    columns: str = PART_COLUMNS) -> List[Tuple]:
+    # the next ``limit`` listings by id, for exports; ``columns`` starts with id
+    return conn.execute(f"SELECT {columns} FROM parts WHERE id > ? ORDER BY id LIMIT ?",
+                        (after_id, limit)).fetchall()
+
+@_cached(generational=True)
+@_pooled
+def get_latest_parts(conn: sqlite3.Connection, limit: int = 10) -> List[Tuple]:
+    return _latest_page(conn, limit=limit).rows
+
+@_cached(generational=True)
+@_pooled
+def get_latest_page(conn: sqlite3.Connection, cursor: Optional[tuple] = None, backward: bool = False,
+                    limit: int = PAGE_SIZE) -> Page:
+    return _latest_page(conn, cursor, backward, limit)
+
+@_cached(_keyword_match)
+@_pooled
+def search_parts_by_keyword(conn: sqlite3.Connection, keyword: str, limit: int = SEARCH_LIMIT) -> List[Tuple]:
+    ids = _keyword_ids(conn, keyword, limit)
+    return _ranked_page(conn, ids, limit=len(ids)).rows
+
+@_cached(_keyword_match)
+@_pooled
+def search_keyword_ids(conn: sqlite3.Connection, keyword: str, limit: int = SEARCH_LIMIT) -> List[int]:
+    # best matches first
+    return _keyword_ids(conn, keyword, limit)
+
+@_pooled
+def get_ranked_page(conn: sqlite3.Connection, ids: List[int], cursor: Optional[tuple] = None,
+                    backward: bool = False, limit: int = PAGE_SIZE) -> Page:
+    # a page of the listings in ``ids``, in that order
+    return _ranked_page(conn, ids, cursor, backward, limit)
+
+@_cached(_code_match("vin_norm", "vin", 17))
+@_pooled
+def search_parts_by_vin(conn: sqlite3.Connection, vin: str, limit: int = SEARCH_LIMIT) -> List[Tuple]:
+    return _code_page(conn, "vin_norm", normalize_code(vin), 17, limit=limit).rows
+
+@_cached(_code_match("vin_norm", "vin", 17))
+@_pooled
+def search_vin_page(conn: sqlite3.Connection, vin: str, cursor: Optional[tuple] = None,
+                    backward: bool = False, limit: int = PAGE_SIZE) -> Page:
+    return _code_page(conn, "vin_norm", normalize_code(vin), 17, cursor, backward, limit)
+
+@_cached(_code_match("oem_norm", "oem"))
+@_pooled
+def search_parts_by_oem(conn: sqlite3.Connection, oem: str, limit: int = SEARCH_LIMIT) -> List[Tuple]:
+    return _code_page(conn, "oem_norm", normalize_code(oem), None, limit=limit).rows
+
+@_cached(_code_match("oem_norm", "oem"))
+@_pooled
+def search_oem_page(conn: sqlite3.Connection, oem: str, cursor: Optional[tuple] = None,
+                    backward: bool = False, limit: int = PAGE_SIZE) -> Page:
+    return _code_page(conn, "oem_norm", normalize_code(oem), None, cursor, backward, limit)
+
+@_cached(_price_match)
+@_pooled
+def search_parts_by_price_range(conn: sqlite3.Connection, min_p: float, max_p: float,
+                                limit: int = SEARCH_LIMIT) -> List[Tuple]:
+    return _price_page(conn, min_p, max_p, limit=limit).rows
+
+@_cached(_price_match)
+@_pooled
+def search_price_page(conn: sqlite3.Connection, min_p: float, max_p: float, cursor: Optional[tuple] = None,
+                      backward: bool = False, limit: int = PAGE_SIZE) -> Page:
+    return _price_page(conn, min_p, max_p, cursor, backward, limit)
+
+@_cached(_same_id)
+@_pooled
+def get_part_by_id(conn: sqlite3.Connection, part_id: int) -> Optional[Tuple]:
+    return conn.execute(f"SELECT {PART_COLUMNS} FROM parts WHERE id = ?", (part_id,)).fetchone()
+
+@_pooled(write=True)
+def set_photo_file_id(conn: sqlite3.Connection, part_id: int, file_id: Optional[str]):
+    with conn:
+        conn.execute("UPDATE parts SET photo_file_id = ? WHERE id = ?", (file_id, part_id))
+    query_cache.invalidate_part(part_id)
+
+@_pooled(write=True)
+def set_cards(conn: sqlite3.Connection, items: List[Tuple[str, int]]):
+    # (card, part id) pairs rendered on view for rows stored without one
+    with conn:
+        conn.executemany("UPDATE parts SET card = ? WHERE id = ?", items)
+    for _, part_id in items:
+        query_cache.invalidate_part(part_id)
+
+@_pooled(write=True)
+def delete_part(conn: sqlite3.Connection, part_id: int) -> Optional[str]:
+    # Returns the part's photo path if no other listing uses that file, so the
+    # caller can remove it.
+    with conn:
+        row = conn.execute("""SELECT id, vin, oem, name, price, description, photo_path, vin_norm, oem_norm
+                              FROM parts WHERE id = ?""", (part_id,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("DELETE FROM parts WHERE id = ?", (part_id,))
+        _unindex_codes(conn, zip(CODE_COLUMNS, row[7:]))
+        if _photo_index is not None:
+            _photo_index.remove(part_id)
+        photo_path = row[6]
+        if photo_path and conn.execute("SELECT 1 FROM parts WHERE photo_path = ? LIMIT 1", (photo_path,)).fetchone():
+            photo_path = None
+    query_cache.invalidate_row(_probe(*row[:6]))
+    return photo_path
+
+@_cached(_inline_match)
+@_pooled
+def search_inline_page(conn: sqlite3.Connection, text: str, top: Optional[int] = None, skip: int = 0,
+                       limit: int = INLINE_PAGE) -> Page:
+    return _inline_page(conn, text, top, skip, limit)
+
+@_cached(_any_part)
+@_pooled
+def count_parts(conn: sqlite3.Connection) -> int:
+    # kept by the parts_stats triggers (see Analytics)
+    row = conn.execute("SELECT value FROM stats_totals WHERE key = 'listings'").fetchone()
+    return row[0] if row else 0
+
+@_pooled
+def find_duplicates(conn: sqlite3.Connection, photo_hash: Optional[int], oem: str, name: str,
+                    price: float) -> List[Tuple]:
+    # listings the given one would likely duplicate, oldest first
+    ids = {part_id for (part_id,) in conn.execute("SELECT id FROM parts WHERE fingerprint = ?",
+                                                  (fingerprint(oem, name, price),))}
+    if photo_hash is not None:
+        near = [part_id for _, part_id in _photo_hashes(conn).search(photo_hash, PHOTO_HASH_RADIUS)]
+        if near:
+            # the same photo is only a re-post if the OEM codes don't disagree;
+            # sellers reuse one generic shot for different parts
+            oem_norm = normalize_code(oem)
+            rows = conn.execute(f"SELECT id, oem_norm FROM parts WHERE id IN ({', '.join('?' * len(near))})",
+                                near).fetchall()
+            ids.update(part_id for part_id, other in rows if not oem_norm or not other or other == oem_norm)
+    if not ids:
+        return []
+    ids = sorted(ids)[:SEARCH_LIMIT]
+    return conn.execute(f"SELECT {PART_COLUMNS} FROM parts WHERE id IN ({', '.join('?' * len(ids))}) ORDER BY id",
+                        ids).fetchall()
+
+@_pooled
+def referenced_photo_paths(conn: sqlite3.Connection) -> List[str]:
+    return [path for (path,) in conn.execute("SELECT DISTINCT photo_path FROM parts WHERE photo_path != ''")]
+
+
+# === FSM storage (see fsm_storage.py) ===
+@_pooled
+def load_fsm_record(conn: sqlite3.Connection, key: str, now: float) -> Optional[Tuple[Optional[str], str]]:
+    return conn.execute("SELECT state, data FROM fsm_state WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+
+@_pooled(write=True)
+def save_fsm_records(conn: sqlite3.Connection, upserts: List[Tuple], deletes: List[str]):
+    with conn:
+        conn.executemany("""INSERT INTO fsm_state (key, state, data, expires_at) VALUES (?, ?, ?, ?)
+                            ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data,
+                                                           expires_at = excluded.expires_at""", upserts)
+        conn.executemany("DELETE FROM fsm_state WHERE key = ?", ((k,) for k in deletes))
+
+@_pooled(write=True)
+def purge_expired_fsm(conn: sqlite3.Connection, now: float) -> int:
+    with conn:
+        return conn.execute("DELETE FROM fsm_state WHERE expires_at <= ?", (now,)).rowcount
+
+
+# === Saved searches (see alerts.py) ===
+# A user keeps up to MAX_SAVED_SEARCHES searches and is alerted when a new
+# listing matches one: every keyword as a word prefix, the VIN/OEM code or its
+# prefix (a full VIN by its first 11 characters), or the price range.
+MAX_SAVED_SEARCHES = 10
+
+SAVED_SEARCH_COLUMNS = "id, mode, query, price_min, price_max"
+
+
+def _alert_key(mode: str, query: Optional[str], price_min, price_max):
+    # what AlertIndex files the search under; None if it can't match anything
+    if mode == "price":
+        if price_min is None or price_max is None:
+            return None
+        return min(price_min, price_max), max(price_min, price_max)
+    if mode in ("vin", "oem"):
+        code = normalize_code(query)
+        return code[:VIN_MODEL_PREFIX] if mode == "vin" and len(code) >= 17 else code or None
+    return tuple(sorted(set(fts_tokens(query)))) or None
+
+
+_alert_index: Optional[AlertIndex] = None
+_alert_index_lock = threading.Lock()
+
+
+def _saved_search_index(conn: sqlite3.Connection) -> AlertIndex:
+    global _alert_index
+    if _alert_index is None:
+        with _alert_index_lock:
+            if _alert_index is None:
+                index = AlertIndex()
+                for search_id, user_id, mode, query, price_min, price_max in conn.execute(
+                        "SELECT id, user_id, mode, query, price_min, price_max FROM saved_searches"):
+                    key = _alert_key(mode, query, price_min, price_max)
+                    if key is not None:
+                        index.add(search_id, user_id, mode, key)
+                _alert_index = index
+    return _alert_index
+
+@_pooled(write=True)
+def save_search(conn: sqlite3.Connection, user_id: int, search: dict) -> Optional[int]:
+    # ``search`` is the dict kept in FSM data by the search flow. Returns the
+    # saved search's id (an existing one if it was saved before), or None if
+    # there is nothing to match on or the user is at MAX_SAVED_SEARCHES.
+    mode = search.get("mode") or "name"
+    query = None if mode == "price" else search.get("q", "")
+    price_min, price_max = (search.get("min"), search.get("max")) if mode == "price" else (None, None)
+    key = _alert_key(mode, query, price_min, price_max)
+    if key is None:
+        return None
+    with conn:
+        row = conn.execute("""SELECT id FROM saved_searches WHERE user_id = ? AND mode = ? AND query IS ?
+                              AND price_min IS ? AND price_max IS ?""",
+                           (user_id, mode, query, price_min, price_max)).fetchone()
+        if row:
+            return row[0]
+        if conn.execute("SELECT COUNT(*) FROM saved_searches WHERE user_id = ?",
+                        (user_id,)).fetchone()[0] >= MAX_SAVED_SEARCHES:
+            return None
+        search_id = conn.execute("""INSERT INTO saved_searches (user_id, mode, query, price_min, price_max, created_at)
+                                    VALUES (?, ?, ?, ?, ?, ?)""",
+                                 (user_id, mode, query, price_min, price_max,
+                                  datetime.utcnow().isoformat())).lastrowid
+    _saved_search_index(conn).add(search_id, user_id, mode, key)
+    return search_id
+
+@_pooled
+def get_saved_searches(conn: sqlite3.Connection, user_id: int) -> List[Tuple]:
+    return conn.execute(f"SELECT {SAVED_SEARCH_COLUMNS} FROM saved_searches WHERE user_id = ? ORDER BY id",
+                        (user_id,)).fetchall()
+
+@_pooled(write=True)
+def delete_saved_search(conn: sqlite3.Connection, user_id: int, search_id: int) -> bool:
+    with conn:
+        deleted = conn.execute("DELETE FROM saved_searches WHERE id = ? AND user_id = ?",
+                               (search_id, user_id)).rowcount
+    if deleted and _alert_index is not None:
+        _alert_index.remove(search_id)
+    return bool(deleted)
+
+@_pooled(write=True)
+def delete_user_searches(conn: sqlite3.Connection, user_id: int) -> int:
+    # for users who blocked the bot
+    with conn:
+        ids = [i for (i,) in conn.execute("SELECT id FROM saved_searches WHERE user_id = ?", (user_id,))]
+        conn.execute("DELETE FROM saved_searches WHERE user_id = ?", (user_id,))
+    if _alert_index is not None:
+        for search_id in ids:
+            _alert_index.remove(search_id)
+    return len(ids)
+
+def _match_saved(conn: sqlite3.Connection, index: AlertIndex, vin: str, oem: str, name: str, price: float,
+                 description: str, uploader_id: Optional[int]) -> Dict[int, int]:
+    probe = _probe(0, vin, oem, name, price, description)
+    hits = index.match(probe["tokens"], probe["vin_norm"], probe["oem_norm"], probe["price"])
+    if hits:
+        # searches another worker process deleted are still in this one's index
+        live = {search_id for (search_id,) in conn.execute(
+            "SELECT id FROM saved_searches WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(hits.values())),))}
+        stale = set(hits.values()) - live
+        if stale:
+            for search_id in stale:
+                index.remove(search_id)
+            hits = index.match(probe["tokens"], probe["vin_norm"], probe["oem_norm"], probe["price"])
+    hits.pop(uploader_id, None)
+    return hits
+
+@_pooled
+def match_saved_searches(conn: sqlite3.Connection, vin: str, oem: str, name: str, price: float,
+                         description: str, uploader_id: Optional[int] = None) -> Dict[int, int]:
+    # {user_id: search_id} to alert about a new listing; the seller is left out
+    return _match_saved(conn, _saved_search_index(conn), vin, oem, name, price, description, uploader_id)
+
+@_pooled
+def match_saved_searches_bulk(conn: sqlite3.Connection, parts: List[Tuple]) -> List[Dict[int, int]]:
+    # match_saved_searches for each add_parts_bulk row, in one call
+    index = _saved_search_index(conn)
+    return [_match_saved(conn, index, vin, oem, name, price, description, uploader_id)
+            for vin, oem, name, price, description, _, uploader_id, _ in parts]
+
+
+# === Analytics ===
+# Searches, views and contacts are appended to ``events`` in batches (see
+# analytics.py); the same transaction bumps the rollup tables, and triggers on
+# parts and users keep the listing and user counts, so reading stats never
+# scans history.
+STATS_TOP = 10
+
+# event kind -> the counter it bumps in stats_totals / stats_daily
+EVENT_COUNTERS = {"search": "searches", "view": "views", "contact": "contacts"}
+
+_STATS_INSERT_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS parts_stats_ai AFTER INSERT ON parts BEGIN
+        INSERT INTO stats_totals(key, value) VALUES ('listings', 1), ('uploads', 1)
+        ON CONFLICT(key) DO UPDATE SET value = value + 1;
+        INSERT INTO stats_daily(day, key, value) VALUES (substr(new.upload_date, 1, 10), 'uploads', 1)
+        ON CONFLICT(day, key) DO UPDATE SET value = value + 1;
+    END;
+"""
+
+_UPSERT_TOTAL = ("INSERT INTO stats_totals(key, value) VALUES (?, ?) "
+                 "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value")
+_UPSERT_DAILY = ("INSERT INTO stats_daily(day, key, value) VALUES (?, ?, ?) "
+                 "ON CONFLICT(day, key) DO UPDATE SET value = value + excluded.value")
+
+
+def _init_analytics(conn: sqlite3.Connection):
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'stats_totals'").fetchone()
+    _run_script(conn, """
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY,
+        ts TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        user_id INTEGER,
+        part_id INTEGER,
+        mode TEXT,
+        query TEXT,
+        results INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        first_seen TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS stats_totals (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        day TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value INTEGER NOT NULL,
+        PRIMARY KEY (day, key)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS stats_oem_searches (
+        oem_norm TEXT PRIMARY KEY,
+        searches INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_stats_oem_searches ON stats_oem_searches(searches);
+    CREATE TABLE IF NOT EXISTS stats_zero_results (
+        mode TEXT NOT NULL,
+        query TEXT NOT NULL,
+        searches INTEGER NOT NULL,
+        last_seen TEXT,
+        PRIMARY KEY (mode, query)
+    );
+    CREATE INDEX IF NOT EXISTS idx_stats_zero_results ON stats_zero_results(searches);
+    CREATE TRIGGER IF NOT EXISTS parts_stats_ad AFTER DELETE ON parts BEGIN
+        UPDATE stats_totals SET value = value - 1 WHERE key = 'listings';
+    END;
+    """ + _STATS_INSERT_TRIGGER)
+    if not exists:
+        # count the listings that predate the rollups, once
+        total = conn.execute("SELECT COUNT(*) FROM parts").fetchone()[0]
+        conn.executemany(_UPSERT_TOTAL, (("listings", total), ("uploads", total)))
+        conn.execute("""INSERT INTO stats_daily(day, key, value)
+                        SELECT substr(upload_date, 1, 10), 'uploads', COUNT(*) FROM parts
+                        WHERE upload_date IS NOT NULL GROUP BY 1""")
+
+
+def _count_users_by_trigger(conn: sqlite3.Connection):
+    # every way a user row gets added (first sighting, ban, legacy import)
+    # counts it, once; the totals so far are recounted from the table
+    _run_script(conn, """
+    CREATE TRIGGER IF NOT EXISTS users_stats_ai AFTER INSERT ON users BEGIN
+        INSERT INTO stats_totals(key, value) VALUES ('users', 1)
+        ON CONFLICT(key) DO UPDATE SET value = value + 1;
+        INSERT INTO stats_daily(day, key, value) VALUES (substr(new.first_seen, 1, 10), 'users', 1)
+        ON CONFLICT(day, key) DO UPDATE SET value = value + 1;
+    END;
+    """)
+    conn.execute("DELETE FROM stats_daily WHERE key = 'users'")
+    conn.execute("""INSERT INTO stats_daily(day, key, value)
+                    SELECT substr(first_seen, 1, 10), 'users', COUNT(*) FROM users GROUP BY 1""")
+    conn.execute("""INSERT INTO stats_totals(key, value) SELECT 'users', COUNT(*) FROM users WHERE true
+                    ON CONFLICT(key) DO UPDATE SET value = excluded.value""")
+
+
+def _zero_result_key(mode: str, query: str) -> str:
+    # so "Brake  Pad" and "brake pad" are one entry
+    if mode in ("vin", "oem"):
+        return normalize_code(query)
+    return " ".join(_fold(query or "").split())
+
+@_pooled(write=True)
+def record_events(conn: sqlite3.Connection, events: List[Tuple], users: List[Tuple[int, str, Optional[str]]]) -> int:
+    # ``events`` holds (ts, kind, user_id, part_id, mode, query, results) tuples,
+    # ``users`` (user_id, ts, username) of users who may be new or have changed
+    # their username. Returns the number of new users.
+    totals: Dict[str, int] = {}
+    daily: Dict[Tuple[str, str], int] = {}
+    oems: Dict[str, int] = {}
+    zero: Dict[Tuple[str, str], List] = {}
+
+    def bump(day: str, key: str):
+        totals[key] = totals.get(key, 0) + 1
+        daily[day, key] = daily.get((day, key), 0) + 1
+
+    for ts, kind, _, _, mode, query, results in events:
+        bump(ts[:10], EVENT_COUNTERS[kind])
+        if kind != "search":
+            continue
+        if mode == "oem" and normalize_code(query):
+            oem = normalize_code(query)
+            oems[oem] = oems.get(oem, 0) + 1
+        if results == 0:
+            bump(ts[:10], "zero_results")
+            entry = zero.setdefault((mode, _zero_result_key(mode, query)), [0, ts])
+            entry[0] += 1
+            entry[1] = max(entry[1], ts)
+    new_users = 0
+    with conn:
+        conn.executemany("""INSERT INTO events (ts, kind, user_id, part_id, mode, query, results)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)""", events)
+        for user_id, ts, username in users:
+            # users_stats_ai counts a new one
+            if conn.execute("INSERT OR IGNORE INTO users (user_id, first_seen, username) VALUES (?, ?, ?)",
+                            (user_id, ts, username)).rowcount:
+                new_users += 1
+            else:
+                conn.execute("UPDATE users SET username = ? WHERE user_id = ? AND username IS NOT ?",
+                             (username, user_id, username))
+        conn.executemany(_UPSERT_TOTAL, totals.items())
+        conn.executemany(_UPSERT_DAILY, ((day, key, n) for (day, key), n in daily.items()))
+        conn.executemany("""INSERT INTO stats_oem_searches(oem_norm, searches) VALUES (?, ?)
+                            ON CONFLICT(oem_norm) DO UPDATE SET searches = searches + excluded.searches""",
+                         oems.items())
+        conn.executemany("""INSERT INTO stats_zero_results(mode, query, searches, last_seen) VALUES (?, ?, ?, ?)
+                            ON CONFLICT(mode, query) DO UPDATE SET searches = searches + excluded.searches,
+                            last_seen = MAX(last_seen, excluded.last_seen)""",
+                         ((mode, query, n, ts) for (mode, query), (n, ts) in zero.items()))
+    return new_users
+
+@_pooled
+def get_stats(conn: sqlite3.Connection) -> Dict[str, int]:
+    # listings, uploads, users, searches, views, contacts, zero_results
+    return dict(conn.execute("SELECT key, value FROM stats_totals").fetchall())
+
+@_pooled
+def get_daily_stats(conn: sqlite3.Connection, since: str) -> Dict[str, Dict[str, int]]:
+    # {counter: {"YYYY-MM-DD": value}} for the days from ``since`` on; days
+    # without activity are missing
+    result: Dict[str, Dict[str, int]] = {}
+    for day, key, value in conn.execute("SELECT day, key, value FROM stats_daily WHERE day >= ?", (since,)):
+        result.setdefault(key, {})[day] = value
+    return result
+
+@_pooled
+def top_searched_oems(conn: sqlite3.Connection, limit: int = STATS_TOP) -> List[Tuple[str, int]]:
+    return conn.execute("SELECT oem_norm, searches FROM stats_oem_searches ORDER BY searches DESC LIMIT ?",
+                        (limit,)).fetchall()
+
+@_pooled
+def top_zero_result_queries(conn: sqlite3.Connection, limit: int = STATS_TOP) -> List[Tuple[str, str, int]]:
+    return conn.execute("SELECT mode, query, searches FROM stats_zero_results ORDER BY searches DESC LIMIT ?",
+                        (limit,)).fetchall()
+
+
+# === Bans ===
+# A ban lives on the user's row; the bot keeps the banned ids in memory (see
+# bans.py) and only comes here to load them or change one.
+BAN_COLUMNS = (("username", "TEXT"), ("banned", "INTEGER NOT NULL DEFAULT 0"), ("ban_reason", "TEXT"),
+               ("banned_at", "TEXT"), ("banned_by", "INTEGER"))
+
+
+def _init_bans(conn: sqlite3.Connection):
+    _add_missing_columns(conn, "users", BAN_COLUMNS)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_banned ON users(user_id) WHERE banned = 1")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username COLLATE NOCASE)")
+
+@_pooled
+def banned_user_ids(conn: sqlite3.Connection) -> List[int]:
+    return [user_id for (user_id,) in conn.execute("SELECT user_id FROM users WHERE banned = 1")]
+
+@_pooled(write=True)
+def ban_user(conn: sqlite3.Connection, user_id: int, reason: Optional[str] = None,
+             banned_by: Optional[int] = None):
+    now = datetime.utcnow().isoformat()
+    with conn:
+        conn.execute("""INSERT INTO users (user_id, first_seen, banned, ban_reason, banned_at, banned_by)
+                        VALUES (?, ?, 1, ?, ?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET banned = 1, ban_reason = excluded.ban_reason,
+                        banned_at = excluded.banned_at, banned_by = excluded.banned_by""",
+                     (user_id, now, reason, now, banned_by))
+
+@_pooled(write=True)
+def unban_user(conn: sqlite3.Connection, user_id: int) -> bool:
+    with conn:
+        return bool(conn.execute("""UPDATE users SET banned = 0, ban_reason = NULL, banned_at = NULL,
+                                    banned_by = NULL WHERE user_id = ? AND banned = 1""", (user_id,)).rowcount)
+
+@_pooled
+def get_banned_users(conn: sqlite3.Connection, limit: int = 20) -> List[Tuple]:
+    # (user_id, username, ban_reason, banned_at), latest first
+    return conn.execute("""SELECT user_id, username, ban_reason, banned_at FROM users WHERE banned = 1
+                           ORDER BY banned_at DESC LIMIT ?""", (limit,)).fetchall()
+
+@_pooled
+def find_user_id(conn: sqlite3.Connection, username: str) -> Optional[int]:
+    # by Telegram username (without the @), as last seen by the bot or on a listing
+    username = username.lstrip("@")
+    row = (conn.execute("SELECT user_id FROM users WHERE username = ? COLLATE NOCASE LIMIT 1",
+                        (username,)).fetchone()
+           or conn.execute("""SELECT uploader_id FROM parts WHERE uploader_username = ? COLLATE NOCASE
+                              ORDER BY id DESC LIMIT 1""", (username,)).fetchone())
+    return row[0] if row else None
+
+
+# === Seller notifications (see notifications.py) ===
+# "Contact Seller" clicks wait here until the outbox delivers them; a row
+# stays "pending" across restarts and failed attempts, with its retry state,
+# until it is "sent" or "dropped". Sent rows are kept NOTIFICATION_RETENTION
+# seconds for the repeat check in queue_seller_notification.
+NOTIFICATION_RETENTION = 7 * 24 * 3600
+
+NOTIFICATION_COLUMNS = "id, seller_id, part_name, buyer_name, attempts"
+
+
+def _create_seller_notifications(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS seller_notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        seller_id INTEGER NOT NULL,
+        buyer_id INTEGER NOT NULL,
+        buyer_name TEXT NOT NULL,
+        part_id INTEGER NOT NULL,
+        part_name TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        next_attempt REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        sent_at REAL
+    )
     """)
-    
-    conn.commit()
-    conn.close()
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_seller_notifications_due ON seller_notifications(next_attempt)
+                    WHERE status = 'pending'""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_seller_notifications_pair
+                    ON seller_notifications(buyer_id, part_id, created_at)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_seller_notifications_seller ON seller_notifications(seller_id, sent_at)")
+
+@_pooled(write=True)
+def queue_seller_notification(conn: sqlite3.Connection, seller_id: int, buyer_id: int, buyer_name: str,
+                              part_id: int, part_name: str, now: float, repeat_window: float, delay: float,
+                              digest_interval: float) -> bool:
+    # False if the buyer already asked about the part within ``repeat_window``.
+    # A new interest joins the seller's pending digest if there is one, else
+    # it is due after ``delay``, but no sooner than ``digest_interval`` after
+    # the last message the seller got.
+    conn.execute("BEGIN IMMEDIATE")
+    with conn:
+        if conn.execute("""SELECT 1 FROM seller_notifications WHERE buyer_id = ? AND part_id = ? AND created_at > ?
+                           LIMIT 1""", (buyer_id, part_id, now - repeat_window)).fetchone():
+            return False
+        due = conn.execute("""SELECT MIN(next_attempt) FROM seller_notifications
+                              WHERE seller_id = ? AND status = 'pending'""", (seller_id,)).fetchone()[0]
+        if due is None:
+            last_sent = conn.execute("SELECT MAX(sent_at) FROM seller_notifications WHERE seller_id = ?",
+                                     (seller_id,)).fetchone()[0]
+            due = max(now + delay, (last_sent or 0) + digest_interval)
+        conn.execute("""INSERT INTO seller_notifications
+                        (seller_id, buyer_id, buyer_name, part_id, part_name, created_at, next_attempt)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                     (seller_id, buyer_id, buyer_name, part_id, part_name, now, due))
+    return True
+
+@_pooled
+def due_seller_notifications(conn: sqlite3.Connection, now: float, limit: int) -> List[Tuple]:
+    return conn.execute(f"""SELECT {NOTIFICATION_COLUMNS} FROM seller_notifications
+                            WHERE status = 'pending' AND next_attempt <= ? ORDER BY next_attempt, id LIMIT ?""",
+                        (now, limit)).fetchall()
+
+@_pooled
+def next_seller_notification_due(conn: sqlite3.Connection) -> Optional[float]:
+    return conn.execute("SELECT MIN(next_attempt) FROM seller_notifications WHERE status = 'pending'").fetchone()[0]
+
+@_pooled(write=True)
+def finish_seller_notifications(conn: sqlite3.Connection, ids: List[int], status: str, now: float,
+                                error: Optional[str] = None):
+    # ``status`` is "sent" or "dropped"
+    with conn:
+        conn.executemany("UPDATE seller_notifications SET status = ?, sent_at = ?, last_error = ? WHERE id = ?",
+                         ((status, now if status == "sent" else None, error, i) for i in ids))
+
+@_pooled(write=True)
+def retry_seller_notifications(conn: sqlite3.Connection, ids: List[int], next_attempt: float, error: str):
+    with conn:
+        conn.executemany("""UPDATE seller_notifications SET attempts = attempts + 1, next_attempt = ?,
+                            last_error = ? WHERE id = ?""", ((next_attempt, error, i) for i in ids))
+
+@_pooled(write=True)
+def purge_seller_notifications(conn: sqlite3.Connection, now: float) -> int:
+    with conn:
+        return conn.execute("""DELETE FROM seller_notifications WHERE status != 'pending' AND created_at < ?""",
+                            (now - NOTIFICATION_RETENTION,)).rowcount
+
+
+# === Worker processes (see supervisor.py) ===
+# Each worker has its own query cache and in-memory indexes, and a write only
+# updates those of the process that made it. Workers call sync_indexes every
+# few seconds to fold in the listings and saved searches the others added.
+# Deletes and edits need no sync: index hits are re-read from the tables, and
+# cached results expire after QUERY_CACHE_TTL, which the supervisor shortens.
+# Above SYNC_REBUILD new listings the indexes are dropped and rebuilt on next
+# use instead, as after a bulk import.
+SYNC_REBUILD = 1000
+
+_sync_marks: Dict[str, int] = {}
+
+@_pooled
+def sync_indexes(conn: sqlite3.Connection) -> int:
+    # returns the number of rows folded in; the first call only takes the marks
+    global _photo_index
+    marks = {table: conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+             for table in ("parts", "saved_searches")}
+    if not _sync_marks:
+        _sync_marks.update(marks)
+        return 0
+    parts = conn.execute("""SELECT id, vin, oem, name, price, description, photo_hash
+                            FROM parts WHERE id > ? AND id <= ?""", (_sync_marks["parts"], marks["parts"])).fetchall()
+    if len(parts) > SYNC_REBUILD:
+        _photo_index = None
+        query_cache.clear()
+    else:
+        for part_id, vin, oem, name, price, description, photo_hash in parts:
+            if _photo_index is not None and photo_hash is not None and part_id not in _photo_index:
+                _photo_index.add(part_id, _unsigned64(photo_hash))
+            query_cache.invalidate_row(_probe(part_id, vin, oem, name, price, description))
+    searches = conn.execute("""SELECT id, user_id, mode, query, price_min, price_max FROM saved_searches
+                               WHERE id > ? AND id <= ?""",
+                            (_sync_marks["saved_searches"], marks["saved_searches"])).fetchall()
+    if _alert_index is not None:
+        for search_id, user_id, mode, query, price_min, price_max in searches:
+            key = _alert_key(mode, query, price_min, price_max)
+            if key is not None:
+                _alert_index.add(search_id, user_id, mode, key)
+    _sync_marks.update(marks)
+    return len(parts) + len(searches)
 
-def ban_user(self, user_id: int):
-    self.cursor.execute("UPDATE users SET banned = 1 WHERE user_id = ?", (user_id,))
-    self.conn.commit()
 
-def unban_user(self, user_id: int):
-    self.cursor.execute("UPDATE users SET banned = 0 WHERE user_id = ?", (user_id,))
-    self.conn.commit()
+# === Migrations ===
+# PRAGMA user_version holds how many MIGRATIONS have been applied. Each pending
+# one runs in its own transaction together with the version bump, so startup
+# with nothing pending reads one header field, and a crash leaves the database
+# at the last complete step. The steps up to the legacy ban import date from
+# before the runner and check what exists, so databases built by older code
+# converge as well. Append new steps at the end; never edit or reorder them.
 
-def is_banned(self, user_id: int) -> bool:
-    r = self.cursor.execute("SELECT banned FROM users WHERE user_id = ?", (user_id,)).fetchone()
-    return r and r[0] == 1
\ No newline at end of file
+# Bans used to be written to this file in the working directory.
+LEGACY_BAN_DB = "database.db"
+# rows ANALYZE samples per index after a migration, so it stays quick
+ANALYSIS_LIMIT = 1000
+
+
+def _import_legacy_bans(conn: sqlite3.Connection):
+    # the old file is only read; once this has run it can be deleted
+    if not os.path.exists(LEGACY_BAN_DB) or os.path.samefile(LEGACY_BAN_DB, DB_PATH):
+        return
+    legacy = sqlite3.connect(LEGACY_BAN_DB)
+    try:
+        rows = legacy.execute("SELECT user_id, reason, banned_at FROM banned_users").fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        legacy.close()
+    now = datetime.utcnow().isoformat()
+    conn.executemany("""INSERT INTO users (user_id, first_seen, banned, ban_reason, banned_at)
+                        VALUES (?, ?, 1, ?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET banned = 1, ban_reason = excluded.ban_reason,
+                        banned_at = excluded.banned_at""",
+                     ((user_id, now, reason, (banned_at or now).replace(" ", "T"))
+                      for user_id, reason, banned_at in rows))
+
+
+def _create_lookup_indexes(conn: sqlite3.Connection):
+    # date-range stats and exports, and a seller's own listings
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_parts_upload_date ON parts(upload_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_parts_uploader ON parts(uploader_id)")
+
+
+def _add_cards(conn: sqlite3.Connection):
+    # pre-rendered listing texts (see cards.py); existing rows get theirs on first view
+    _add_missing_columns(conn, "parts", (("card", "TEXT"),))
+
+
+MIGRATIONS = (
+    _create_parts,
+    _init_fts,
+    _migrate_normalized_codes,
+    _add_photo_file_id,
+    _migrate_duplicate_keys,
+    _create_parts_indexes,
+    _create_fsm_state,
+    _create_saved_searches,
+    _init_analytics,
+    _init_bans,
+    _import_legacy_bans,
+    _create_lookup_indexes,
+    _add_cards,
+    _create_seller_notifications,
+    _create_code_variants,
+    _count_users_by_trigger,
+    _drop_vin_split,
+)
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply the pending MIGRATIONS and return how many ran."""
+    target = len(MIGRATIONS)
+    version = schema_version(conn)
+    if version > target:
+        raise RuntimeError(f"database schema version {version} is newer than this code ({target})")
+    applied = 0
+    while version < target:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # another process may have migrated while this one waited for the lock
+            version = schema_version(conn)
+            if version < target:
+                MIGRATIONS[version](conn)
+                version += 1
+                conn.execute(f"PRAGMA user_version = {version}")
+                applied += 1
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    if applied and conn.execute("SELECT 1 FROM parts LIMIT 1").fetchone():
+        # planner statistics for the new indexes; an empty database has none
+        # worth taking and is served fine by the default estimates
+        conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+        conn.execute("ANALYZE")
+    return applied
+
+
+def init_db():
+    os.makedirs("images", exist_ok=True)
+    with get_pool().connection() as conn:
+        migrate(conn)
+        conn.execute("PRAGMA optimize")
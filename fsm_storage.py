@@ -0,0 +1,218 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import database as db
+
+# Half-finished upload/search flows are dropped after this long without a write.
+FSM_TTL = 24 * 3600
+# Writes to a chat's state within this window reach the backend as one write.
+FLUSH_DELAY = 0.05
+# How often the SQLite backend sweeps out expired flows.
+PURGE_INTERVAL = 600
+
+Record = Tuple[Optional[str], Dict[str, Any]]
+
+
+def storage_key(key: StorageKey) -> str:
+    return f"fsm:{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+class CoalescingStorage(BaseStorage):
+    """FSM storage that stages writes in memory and flushes them in batches.
+
+    A handler typically calls ``update_data`` and ``set_state`` back to back;
+    both land in the staged record and reach the backend as a single write a
+    few milliseconds later. Only records waiting to be flushed are held in
+    memory, so memory use does not grow with the number of users. Subclasses
+    supply ``_read`` and ``_write_many``.
+    """
+
+    def __init__(self, ttl: int = FSM_TTL, flush_delay: float = FLUSH_DELAY):
+        self.ttl = ttl
+        self.flush_delay = flush_delay
+        self._dirty: Dict[str, Record] = {}
+        self._flushing: Dict[str, Record] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.reads = 0
+        self.writes = 0
+        self.staged = 0
+
+    async def _read(self, key: str) -> Optional[Record]:
+        raise NotImplementedError
+
+    async def _write_many(self, records: Dict[str, Record]):
+        raise NotImplementedError
+
+    async def _record(self, key: StorageKey) -> Tuple[str, Record]:
+        k = storage_key(key)
+        record = self._dirty.get(k) or self._flushing.get(k)
+        if record is None:
+            self.reads += 1
+            record = await self._read(k) or (None, {})
+        return k, record
+
+    def _stage(self, k: str, state: Optional[str], data: Dict[str, Any]):
+        self.staged += 1
+        self._dirty[k] = (state, data)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        self._flushing.update(batch)
+        try:
+            await self._write_many(batch)
+            self.writes += 1
+        except Exception:
+            # keep the records for the next flush unless newer ones replaced them
+            for k, record in batch.items():
+                self._dirty.setdefault(k, record)
+            raise
+        finally:
+            for k in batch:
+                if self._flushing.get(k) is batch[k]:
+                    del self._flushing[k]
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k, (_, data) = await self._record(key)
+        self._stage(k, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key))[1][0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k, (state, _) = await self._record(key)
+        self._stage(k, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._record(key))[1][1])
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {"reads": self.reads, "flushes": self.writes, "staged_writes": self.staged,
+                "pending": len(self._dirty)}
+
+
+class SQLiteStorage(CoalescingStorage):
+    """Keeps FSM records in the bot's own SQLite database."""
+
+    def __init__(self, ttl: int = FSM_TTL, flush_delay: float = FLUSH_DELAY):
+        super().__init__(ttl, flush_delay)
+        self._next_purge = 0.0
+
+    async def _read(self, key: str) -> Optional[Record]:
+        row = await db.load_fsm_record(key, time.time())
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    async def _write_many(self, records: Dict[str, Record]):
+        now = time.time()
+        upserts, deletes = [], []
+        for k, (state, data) in records.items():
+            if state is None and not data:
+                deletes.append(k)
+            else:
+                upserts.append((k, state, json.dumps(data), now + self.ttl))
+        await db.save_fsm_records(upserts, deletes)
+        if now >= self._next_purge:
+            self._next_purge = now + PURGE_INTERVAL
+            await db.purge_expired_fsm(now)
+
+
+class RedisStorage(CoalescingStorage):
+    """Keeps FSM records in Redis (or anything speaking its get/set/pipeline
+    API), with the TTL enforced by the server. Shared by every bot process.
+    """
+
+    def __init__(self, redis, ttl: int = FSM_TTL, flush_delay: float = FLUSH_DELAY):
+        super().__init__(ttl, flush_delay)
+        self.redis = redis
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisStorage":
+        try:
+            from redis.asyncio import Redis
+        except ImportError as e:
+            raise RuntimeError("FSM_STORAGE=redis needs the 'redis' package (pip install redis)") from e
+        return cls(Redis.from_url(url), **kwargs)
+
+    async def _read(self, key: str) -> Optional[Record]:
+        raw = await self.redis.get(key)
+        if raw is None:
+            return None
+        record = json.loads(raw)
+        return record["state"], record["data"]
+
+    async def _write_many(self, records: Dict[str, Record]):
+        pipe = self.redis.pipeline(transaction=False)
+        for k, (state, data) in records.items():
+            if state is None and not data:
+                pipe.delete(k)
+            else:
+                pipe.set(k, json.dumps({"state": state, "data": data}), ex=self.ttl)
+        await pipe.execute()
+
+    async def close(self) -> None:
+        await super().close()
+        aclose = getattr(self.redis, "aclose", None) or getattr(self.redis, "close", None)
+        if aclose is not None:
+            await aclose()
+
+
+class MemoryRedis:
+    """In-process stand-in for the slice of the Redis API RedisStorage uses."""
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[Any, Optional[float]]] = {}
+
+    async def get(self, key: str):
+        value = self._values.get(key)
+        if value is None:
+            return None
+        if value[1] is not None and value[1] <= time.monotonic():
+            del self._values[key]
+            return None
+        return value[0]
+
+    async def set(self, key: str, value, ex: Optional[int] = None):
+        self._values[key] = (value, time.monotonic() + ex if ex else None)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._values.pop(key, None)
+
+    def pipeline(self, transaction: bool = True) -> "_MemoryPipeline":
+        return _MemoryPipeline(self)
+
+
+class _MemoryPipeline:
+    def __init__(self, redis: MemoryRedis):
+        self._redis = redis
+        self._ops = []
+
+    def set(self, *args, **kwargs):
+        self._ops.append(self._redis.set(*args, **kwargs))
+
+    def delete(self, *keys):
+        self._ops.append(self._redis.delete(*keys))
+
+    async def execute(self):
+        return [await op for op in self._ops]
@@ -0,0 +1,96 @@
+import threading
+from array import array
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+@lru_cache(maxsize=None)
+def _flip_masks(width: int, radius: int) -> Tuple[int, ...]:
+    # every ``width``-bit mask with at most ``radius`` bits set
+    masks = [0]
+    frontier = [0]
+    for _ in range(radius):
+        frontier = sorted({m | (1 << b) for m in frontier for b in range(width) if not m >> b & 1})
+        masks.extend(frontier)
+    return tuple(masks)
+
+
+class MultiIndexHash:
+    """Multi-index hashing over fixed-width bit strings (Norouzi et al.).
+
+    Each hash is cut into ``chunks`` substrings and indexed once per substring.
+    Two hashes within Hamming distance ``r`` agree to within ``r // chunks``
+    bits on at least one substring, so a search only probes the buckets of
+    those few substring variants and checks the full distance of what it finds
+    there, instead of scanning every stored hash.
+    """
+
+    def __init__(self, bits: int = 64, chunks: int = 4):
+        if bits % chunks:
+            raise ValueError("bits must split evenly into chunks")
+        self.bits = bits
+        self.chunks = chunks
+        self.width = bits // chunks
+        self._mask = (1 << self.width) - 1
+        self._tables: List[Dict[int, array]] = [{} for _ in range(chunks)]
+        self._hashes = array("Q")
+        self._ids = array("q")
+        self._slots: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._slots
+
+    def _parts(self, h: int):
+        for i in range(self.chunks):
+            yield i, (h >> (i * self.width)) & self._mask
+
+    def add(self, item_id: int, h: int):
+        with self._lock:
+            if item_id in self._slots:
+                self._ids[self._slots[item_id]] = -1
+            slot = len(self._hashes)
+            self._hashes.append(h)
+            self._ids.append(item_id)
+            self._slots[item_id] = slot
+            for i, part in self._parts(h):
+                bucket = self._tables[i].get(part)
+                if bucket is None:
+                    bucket = self._tables[i][part] = array("I")
+                bucket.append(slot)
+
+    def remove(self, item_id: int):
+        # the slot stays in its buckets and is skipped by searches
+        with self._lock:
+            slot = self._slots.pop(item_id, None)
+            if slot is not None:
+                self._ids[slot] = -1
+
+    def search(self, h: int, radius: int) -> List[Tuple[int, int]]:
+        """(distance, item_id) of every stored hash within ``radius``, nearest first."""
+        masks = _flip_masks(self.width, radius // self.chunks)
+        hashes, ids = self._hashes, self._ids
+        seen = set()
+        found = []
+        for i, part in self._parts(h):
+            table = self._tables[i]
+            for m in masks:
+                bucket = table.get(part ^ m)
+                if bucket is None:
+                    continue
+                for slot in bucket:
+                    if slot in seen:
+                        continue
+                    seen.add(slot)
+                    d = (hashes[slot] ^ h).bit_count()
+                    if d <= radius and ids[slot] >= 0:
+                        found.append((d, ids[slot]))
+        found.sort()
+        return found
@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, NamedTuple, Optional
+
+from PIL import Image, ImageOps
+
+log = logging.getLogger(__name__)
+
+IMAGES_DIR = os.getenv("IMAGES_DIR", "images")
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(os.cpu_count() or 1)))
+
+# Telegram shows photos at up to 1280px; anything larger is wasted bytes.
+FULL_MAX_SIDE = 1280
+FULL_QUALITY = 82
+THUMB_MAX_SIDE = 320
+THUMB_QUALITY = 70
+THUMB_SUFFIX = "_t.jpg"
+
+# Files nobody references are only removed once they are older than this, so
+# photos of uploads still waiting for confirmation are left alone. A photo
+# uploaded again is touched, as it may be one of those now.
+ORPHAN_MIN_AGE = 24 * 3600
+SWEEP_INTERVAL = 6 * 3600
+
+
+class StoredImage(NamedTuple):
+    sha: str
+    path: str
+    thumb_path: str
+    width: int
+    height: int
+    # False when the same photo was already on disk
+    created: bool
+    # 64-bit perceptual hash; near-identical photos differ in a few bits
+    dhash: int
+
+
+# --- Storage layout
+# images/ab/cd/<sha256 of the upload>.jpg plus <sha>_t.jpg beside it, so the
+# same photo uploaded twice is stored (and encoded) once and no directory
+# collects more than a few hundred files.
+def sharded_path(sha: str, root: str = IMAGES_DIR, suffix: str = ".jpg") -> str:
+    return os.path.join(root, sha[:2], sha[2:4], sha + suffix)
+
+
+def thumb_path(photo_path: Optional[str]) -> Optional[str]:
+    # thumbnail of a stored photo; None for photos saved before the pipeline
+    if not photo_path or not photo_path.endswith(".jpg") or photo_path.endswith(THUMB_SUFFIX):
+        return None
+    path = photo_path[:-4] + THUMB_SUFFIX
+    return path if os.path.exists(path) else None
+
+
+def _shrink(img: Image.Image, max_side: int) -> Image.Image:
+    img = img.copy()
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+    return img
+
+
+def _jpeg(img: Image.Image, quality: int) -> bytes:
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def dhash(img: Image.Image) -> int:
+    # difference hash: one bit per horizontally adjacent pixel pair of a 9x8
+    # grayscale version, set where brightness falls to the right. Survives
+    # re-encoding, resizing and small edits; differs wildly for other photos.
+    px = img.convert("L").resize((9, 8), Image.LANCZOS).tobytes()
+    h = 0
+    for y in range(0, 72, 9):
+        for x in range(y, y + 8):
+            h = h << 1 | (px[x] > px[x + 1])
+    return h
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def process_image(data: bytes, root: str = IMAGES_DIR) -> StoredImage:
+    """Decode, recompress and store one photo plus its thumbnail.
+
+    CPU-bound; runs in the worker processes of ``store_image``.
+    """
+    sha = hashlib.sha256(data).hexdigest()
+    path, thumb = sharded_path(sha, root), sharded_path(sha, root, THUMB_SUFFIX)
+    try:
+        os.utime(path)
+        os.utime(thumb)
+        with Image.open(path) as img, Image.open(thumb) as small:
+            return StoredImage(sha, path, thumb, img.width, img.height, False, dhash(small))
+    except FileNotFoundError:
+        pass
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        full = _jpeg(_shrink(img, FULL_MAX_SIDE), FULL_QUALITY)
+        small_img = _shrink(img, THUMB_MAX_SIDE)
+        small = _jpeg(small_img, THUMB_QUALITY)
+        width, height = img.width, img.height
+    if len(full) >= len(data) and max(width, height) <= FULL_MAX_SIDE and data[:2] == b"\xff\xd8":
+        # already a small JPEG; re-encoding would only lose quality
+        full = data
+    scale = min(1.0, FULL_MAX_SIDE / max(width, height))
+    _write_atomic(path, full)
+    _write_atomic(thumb, small)
+    return StoredImage(sha, path, thumb, round(width * scale), round(height * scale), True, dhash(small_img))
+
+
+# --- Worker pool
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Forked workers skip re-importing the bot, which spawned ones would do;
+        # start() forks them all up front, before the bot has threads running.
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        _pool = ProcessPoolExecutor(IMAGE_WORKERS, mp_context=multiprocessing.get_context(method))
+    return _pool
+
+
+def start():
+    # a fork-based pool launches every worker on its first task
+    get_pool().submit(os.getpid).result()
+
+
+def close():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+async def store_image(data: bytes, root: str = IMAGES_DIR) -> StoredImage:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), process_image, data, root)
+
+
+# --- Garbage collection
+def remove_image(photo_path: Optional[str], min_age: float = ORPHAN_MIN_AGE):
+    # delete a photo no listing references any more, with its thumbnail; one
+    # touched within ``min_age`` is left to sweep_orphans, since a pending
+    # upload of the same photo may be using it
+    if not photo_path:
+        return
+    try:
+        if os.path.getmtime(photo_path) >= time.time() - min_age:
+            return
+    except FileNotFoundError:
+        return
+    for path in (photo_path, thumb_path(photo_path)):
+        if path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def sweep_orphans(referenced: Iterable[str], root: str = IMAGES_DIR, min_age: float = ORPHAN_MIN_AGE) -> int:
+    """Delete files under ``root`` that no listing references, e.g. photos of
+    cancelled uploads or ones left behind by older code. Returns the count."""
+    keep = {os.path.normpath(p) for p in referenced if p}
+    keep |= {p[:-4] + THUMB_SUFFIX for p in keep if p.endswith(".jpg")}
+    cutoff = time.time() - min_age
+    removed = 0
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            path = os.path.normpath(os.path.join(dirpath, name))
+            if path in keep:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+async def sweep_forever(referenced, root: str = IMAGES_DIR, interval: float = SWEEP_INTERVAL):
+    # ``referenced`` is an async callable returning the photo paths in use
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            paths = await referenced()
+            removed = await loop.run_in_executor(None, sweep_orphans, paths, root)
+            if removed:
+                log.info("removed %d orphaned image files", removed)
+        except Exception:
+            log.exception("image sweep failed")
+        await asyncio.sleep(interval)
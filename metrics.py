@@ -0,0 +1,325 @@
+import bisect
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+
+log = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency buckets; a +Inf bucket follows.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# (label, seconds) of the windows active users are counted over
+ACTIVE_WINDOWS = (("5m", 300), ("1h", 3600), ("24h", 86400))
+ACTIVE_PRUNE_INTERVAL = 600
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class _Sharded(_Metric):
+    """Values live in one dict per recording thread, so a thread only ever
+    writes its own and recording takes no lock; a scrape adds the shards up.
+    Dict reads and in-place updates are atomic under the GIL, which is all a
+    scrape racing a writer needs."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._shards_lock:
+                self._shards.append(values)
+            return values
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        values = self._shard()
+        values[labels] = values.get(labels, 0) + amount
+
+    def values(self) -> Dict[tuple, float]:
+        merged: Dict[tuple, float] = {}
+        for shard in list(self._shards):
+            for labels, value in list(shard.items()):
+                merged[labels] = merged.get(labels, 0) + value
+        return merged
+
+    def value(self, *labels) -> float:
+        return sum(shard.get(labels, 0) for shard in list(self._shards))
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+                for labels, value in sorted(self.values().items())]
+
+
+class Histogram(_Sharded):
+    """Observations counted into fixed buckets; each series is a list of
+    per-bucket counts (the last one +Inf) followed by the sum."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.bounds = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        values = self._shard()
+        counts = values.get(labels)
+        if counts is None:
+            counts = values[labels] = [0] * (len(self.bounds) + 2)
+        counts[bisect.bisect_left(self.bounds, value)] += 1
+        counts[-1] += value
+
+    def values(self) -> Dict[tuple, List[float]]:
+        merged: Dict[tuple, List[float]] = {}
+        for shard in list(self._shards):
+            for labels, counts in list(shard.items()):
+                total = merged.setdefault(labels, [0] * (len(self.bounds) + 2))
+                for i, n in enumerate(list(counts)):
+                    total[i] += n
+        return merged
+
+    def _series(self, labels: tuple) -> List[float]:
+        # one series, or every series added together when ``labels`` is empty
+        merged = [0] * (len(self.bounds) + 2)
+        for key, counts in self.values().items():
+            if not labels or key == labels:
+                for i, n in enumerate(counts):
+                    merged[i] += n
+        return merged
+
+    def count(self, *labels) -> int:
+        return int(sum(self._series(labels)[:-1]))
+
+    def quantile(self, q: float, *labels) -> Optional[float]:
+        """Estimated like Prometheus' histogram_quantile: linear within the
+        bucket the rank falls in. None without observations."""
+        counts = self._series(labels)[:-1]
+        rank = q * sum(counts)
+        if not rank:
+            return None
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lo = self.bounds[i - 1] if i else 0.0
+                return lo + (self.bounds[i] - lo) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, counts in sorted(self.values().items()):
+            cumulative = 0
+            for bound, n in zip(self.bounds + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(counts[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """A value read at scrape time from ``fn()``: a number, or a dict of
+    {label values: number}. ``kind="counter"`` exposes a running total kept
+    elsewhere (e.g. the query cache's hit count)."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], object], labelnames: Sequence[str] = (),
+                 kind: str = "gauge"):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self) -> List[str]:
+        value = self.fn()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(v)}"
+                for labels, v in sorted(value.items())]
+
+
+def render() -> str:
+    return "\n".join(metric.expose() for metric in _registry) + "\n"
+
+
+# === Active users ===
+class ActiveUsers:
+    """Last time each user was seen, counted over ACTIVE_WINDOWS. Touched only
+    from the event loop; users idle for longer than the widest window are
+    dropped every ACTIVE_PRUNE_INTERVAL."""
+
+    def __init__(self, windows: Sequence[Tuple[str, float]] = ACTIVE_WINDOWS):
+        self.windows = tuple(windows)
+        self._horizon = max(seconds for _, seconds in self.windows)
+        self._last_seen: Dict[int, float] = {}
+        self._next_prune = time.monotonic() + ACTIVE_PRUNE_INTERVAL
+
+    def seen(self, user_id: int):
+        now = time.monotonic()
+        self._last_seen[user_id] = now
+        if now >= self._next_prune:
+            self._next_prune = now + ACTIVE_PRUNE_INTERVAL
+            cutoff = now - self._horizon
+            self._last_seen = {u: t for u, t in self._last_seen.items() if t >= cutoff}
+
+    def counts(self) -> Dict[tuple, int]:
+        now = time.monotonic()
+        stamps = list(self._last_seen.values())
+        return {(label,): sum(1 for t in stamps if t >= now - seconds) for label, seconds in self.windows}
+
+
+# === Bot metrics ===
+UPDATES = Counter("bot_updates_total", "Updates received, by type and outcome", ("type", "outcome"))
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Time spent in each handler", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Handlers that raised", ("handler",))
+API_LATENCY = Histogram("bot_api_request_seconds", "Bot API calls, by method", ("method",))
+API_ERRORS = Counter("bot_api_errors_total", "Failed Bot API calls, by method and error", ("method", "error"))
+DB_LATENCY = Histogram("bot_db_query_seconds", "Database calls, by function", ("function",))
+DB_WAIT = Histogram("bot_db_queue_seconds", "Time database calls wait for an executor thread")
+DB_BUSY_RETRIES = Counter("bot_db_busy_retries_total", "Writes run again after finding the database locked",
+                          ("function",))
+FLOWS = Counter("bot_fsm_flows_total", "Upload/search dialogs, by how they went", ("flow", "outcome"))
+ACTIVE_USERS = ActiveUsers()
+Gauge("bot_active_users", "Distinct users seen in the window", ACTIVE_USERS.counts, ("window",))
+
+# outcomes a flow can end with; a started flow without one was abandoned
+FLOW_ENDINGS = ("completed", "cancelled", "rejected")
+
+
+def flow(name: str, outcome: str):
+    FLOWS.inc(name, outcome)
+
+
+def flow_summary(name: str) -> Dict[str, int]:
+    values = FLOWS.values()
+    summary = {outcome: int(values.get((name, outcome), 0)) for outcome in ("started",) + FLOW_ENDINGS}
+    # counts dialogs still in progress too, which is a handful at any time
+    summary["abandoned"] = max(0, summary["started"] - sum(summary[o] for o in FLOW_ENDINGS))
+    return summary
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer update middleware: counts updates and notes who is active."""
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is not None:
+            ACTIVE_USERS.seen(user.id)
+        outcome = "handled"
+        try:
+            result = await handler(event, data)
+            if result is UNHANDLED:
+                outcome = "unhandled"
+            return result
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            UPDATES.inc(event.event_type, outcome)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware timing the handler that matched, by its function name."""
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - t0, name)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Session middleware timing Bot API calls. Registered after the rate
+    limiter, it sees each attempt, so 429s that get retried count as errors."""
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        t0 = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - t0, name)
+
+
+def instrument(dp: Dispatcher):
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    timing = HandlerMetricsMiddleware()
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(timing)
+
+
+# === /metrics endpoint ===
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def serve(host: str, port: int) -> Optional[web.AppRunner]:
+    # None when the port can't be bound; the bot runs on without the endpoint
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        log.warning("metrics endpoint not started on %s:%d: %s", host, port, e)
+        await runner.cleanup()
+        return None
+    return runner
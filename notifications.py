@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram.exceptions import TelegramForbiddenError
+
+import cards
+import database as db
+
+log = logging.getLogger(__name__)
+
+# A seller hears about a buyer's interest NOTIFY_DELAY seconds after the
+# click, so a burst of clicks arrives as one message. After that, further
+# interests wait for a digest sent at most once per DIGEST_INTERVAL. A buyer
+# clicking "Contact Seller" again on the same listing within REPEAT_WINDOW is
+# not passed on.
+NOTIFY_DELAY = 5.0
+DIGEST_INTERVAL = 15 * 60
+REPEAT_WINDOW = 6 * 3600
+# Failed sends are retried after RETRY_DELAY, doubling per attempt, and dropped
+# after MAX_ATTEMPTS; a seller who blocked the bot is dropped at once.
+RETRY_DELAY = 30.0
+MAX_ATTEMPTS = 8
+# how often the outbox looks for work it was not woken for (queued by
+# another worker process, or retries coming due)
+POLL_INTERVAL = 5.0
+# notifications read per pass, and digests in flight at once (the rate
+# limiter paces them further)
+BATCH_LIMIT = 500
+SEND_CONCURRENCY = 8
+PURGE_INTERVAL = 3600.0
+# listings and buyers named in one digest
+MAX_DIGEST_LINES = 20
+
+
+def digest_text(interests: List[Tuple[str, str]]) -> str:
+    # ``interests`` holds (listing name, buyer) pairs, oldest first
+    if len(interests) == 1:
+        name, buyer = interests[0]
+        return (f"🟢 Someone is interested in your listing {cards.bold(name)}.\n"
+                f"Buyer: {cards.escape(buyer)}\n"
+                f"Message from bot: If you want to contact, reply to this message or open chat with the buyer.")
+    buyers: Dict[str, List[str]] = {}
+    for name, buyer in interests:
+        names = buyers.setdefault(name, [])
+        if buyer not in names:
+            names.append(buyer)
+    lines = [f"• {cards.bold(name)} — {', '.join(cards.escape(b) for b in names)}"
+             for name, names in buyers.items()]
+    if len(lines) > MAX_DIGEST_LINES:
+        lines = lines[:MAX_DIGEST_LINES] + [f"…and {len(lines) - MAX_DIGEST_LINES} more listings"]
+    return "\n".join([f"🟢 {len(interests)} buyer requests for your listings:"] + lines +
+                     ["", "Open a chat with the buyers to reply."])
+
+
+class SellerOutbox:
+    """Delivers the seller notifications queued in the database, one message
+    per seller per pass with everything due for them. Delivery state lives in
+    the table, so pending notifications survive restarts; one sent just before
+    a crash may be sent again. Run it in one process only (worker 0 under the
+    supervisor); any process can ``queue``."""
+
+    def __init__(self, send: Callable[[int, str], Awaitable[None]], poll_interval: float = POLL_INTERVAL):
+        self._send = send
+        self.poll_interval = poll_interval
+        self._wake: Optional[asyncio.Event] = None
+        self._next_purge = 0.0
+        self.queued = 0
+        self.repeats = 0
+        self.sent = 0
+        self.retried = 0
+        self.dropped = 0
+
+    @property
+    def wake(self) -> asyncio.Event:
+        # created lazily so the outbox can be built outside a running loop
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        return self._wake
+
+    async def queue(self, seller_id: int, buyer_id: int, buyer_name: str, part_id: int, part_name: str) -> bool:
+        # False for a repeat of the same buyer and listing
+        queued = await db.queue_seller_notification(seller_id, buyer_id, buyer_name, part_id, part_name or "",
+                                                    time.time(), REPEAT_WINDOW, NOTIFY_DELAY, DIGEST_INTERVAL)
+        if queued:
+            self.queued += 1
+            self.wake.set()
+        else:
+            self.repeats += 1
+        return queued
+
+    async def _deliver(self, seller_id: int, rows: List[Tuple]):
+        ids = [row[0] for row in rows]
+        try:
+            await self._send(seller_id, digest_text([(row[2], row[3]) for row in rows]))
+        except TelegramForbiddenError:
+            # the seller blocked the bot
+            self.dropped += len(ids)
+            await db.finish_seller_notifications(ids, "dropped", time.time(), "blocked")
+            return
+        except Exception as e:
+            attempts = max(row[4] for row in rows) + 1
+            if attempts >= MAX_ATTEMPTS:
+                log.warning("dropping %d notifications to %s after %d attempts: %s", len(ids), seller_id, attempts, e)
+                self.dropped += len(ids)
+                await db.finish_seller_notifications(ids, "dropped", time.time(), repr(e))
+            else:
+                self.retried += len(ids)
+                await db.retry_seller_notifications(ids, time.time() + RETRY_DELAY * 2 ** (attempts - 1), repr(e))
+            return
+        self.sent += len(ids)
+        await db.finish_seller_notifications(ids, "sent", time.time())
+
+    async def deliver_due(self) -> int:
+        now = time.time()
+        rows = await db.due_seller_notifications(now, BATCH_LIMIT)
+        by_seller: Dict[int, List[Tuple]] = {}
+        for row in rows:
+            by_seller.setdefault(row[1], []).append(row)
+        slots = asyncio.Semaphore(SEND_CONCURRENCY)
+
+        async def deliver(seller_id: int, rows: List[Tuple]):
+            async with slots:
+                try:
+                    await self._deliver(seller_id, rows)
+                except Exception:
+                    log.exception("seller notification to %s failed", seller_id)
+        await asyncio.gather(*(deliver(s, r) for s, r in by_seller.items()))
+        if now >= self._next_purge:
+            self._next_purge = now + PURGE_INTERVAL
+            await db.purge_seller_notifications(now)
+        return len(rows)
+
+    async def run(self):
+        while True:
+            self.wake.clear()
+            try:
+                await self.deliver_due()
+                # now or earlier if more than BATCH_LIMIT were due
+                due = await db.next_seller_notification_due()
+            except Exception:
+                log.exception("seller notifications failed")
+                due = None
+            timeout = self.poll_interval if due is None else min(self.poll_interval, max(0.0, due - time.time()))
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {"queued": self.queued, "repeats": self.repeats, "sent": self.sent, "retried": self.retried,
+                "dropped": self.dropped}
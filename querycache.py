@@ -0,0 +1,140 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Set
+
+_MISSING = object()
+
+
+def sizeof(value: Any) -> int:
+    # rough deep size of the tuples/lists/strings the read functions return
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        size += sum(sizeof(item) for item in value)
+    return size
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires", "part_ids", "match")
+
+    def __init__(self, value, size, expires, part_ids, match):
+        self.value = value
+        self.size = size
+        self.expires = expires
+        self.part_ids = part_ids
+        self.match = match
+
+
+class QueryCache:
+    """LRU cache of query results, bounded by entry count and by bytes, with a
+    TTL as a backstop for writes made by other processes.
+
+    Entries are dropped precisely when data changes: each one remembers the
+    part ids in its result (``invalidate_part``) and, optionally, a predicate
+    telling whether a part added or removed elsewhere would change it
+    (``invalidate_row``). Results are shared between callers and must be
+    treated as read-only.
+    """
+
+    def __init__(self, max_entries: int = 2048, max_bytes: int = 16 * 1024 * 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._by_part: Dict[int, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        # bumped by every invalidation; a result computed across one is not stored
+        self.version = 0
+        # bumped when the set of parts changes; part of the key of "latest" pages
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, key: Hashable) -> Any:
+        # returns the cached value or _MISSING
+        if not self.enabled:
+            return _MISSING
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return _MISSING
+            if entry.expires <= time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key: Hashable, value: Any, version: int, part_ids: Iterable[int] = (),
+            match: Optional[Callable[[dict], bool]] = None):
+        size = sizeof(key) + sizeof(value)
+        if not self.enabled or size > self.max_bytes:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            if key in self._entries:
+                self._drop(key)
+            entry = _Entry(value, size, time.monotonic() + self.ttl, frozenset(part_ids), match)
+            self._entries[key] = entry
+            self.bytes += size
+            for part_id in entry.part_ids:
+                self._by_part.setdefault(part_id, set()).add(key)
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key: Hashable):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+        for part_id in entry.part_ids:
+            keys = self._by_part.get(part_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_part[part_id]
+
+    def invalidate_part(self, part_id: int):
+        # a part's row changed in place
+        with self._lock:
+            self.version += 1
+            for key in list(self._by_part.get(part_id, ())):
+                self._drop(key)
+                self.invalidations += 1
+
+    def invalidate_row(self, probe: dict):
+        # a part was added or removed; ``probe`` describes it to the predicates
+        with self._lock:
+            self.version += 1
+            self.generation += 1
+            stale = set(self._by_part.get(probe["id"], ()))
+            stale.update(key for key, entry in self._entries.items() if entry.match and entry.match(probe))
+            for key in stale:
+                self._drop(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self.generation += 1
+            self._entries.clear()
+            self._by_part.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"entries": len(self._entries), "bytes": self.bytes, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0, "evictions": self.evictions,
+                "expirations": self.expirations, "invalidations": self.invalidations}
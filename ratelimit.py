@@ -0,0 +1,208 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMediaGroup
+
+# Telegram's documented limits: about one message per second per chat (short
+# bursts are tolerated) and about 30 messages per second overall.
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 1
+MAX_RETRIES = 3
+
+# Lanes for the global queue: lower goes first.
+INTERACTIVE = 0
+NOTIFICATION = 1
+
+_priority: ContextVar[int] = ContextVar("send_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(lane: int):
+    # Bot API calls made inside the block queue in ``lane``
+    token = _priority.set(lane)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.stamp = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        # created lazily so buckets can be built outside a running loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, cost: float = 1) -> float:
+        # seconds until ``cost`` tokens are there; a cost above the capacity
+        # only waits for a full bucket and leaves it in debt
+        self._refill(time.monotonic())
+        need = min(cost, self.capacity) - self.tokens
+        return need / self.rate if need > 0 else 0.0
+
+    def take(self, cost: float = 1):
+        self._refill(time.monotonic())
+        self.tokens -= cost
+
+    def pause(self, seconds: float):
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity and not (self._lock and self._lock.locked())
+
+
+class PriorityGate:
+    """Hands out tokens of one bucket to waiters, most urgent lane first."""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self._waiters: List[tuple] = []
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    def depth(self, lane: int) -> int:
+        return sum(1 for w in self._waiters if w[0] == lane and not w[2].done())
+
+    async def acquire(self, lane: int, cost: float = 1):
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (lane, next(self._seq), fut, cost))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        await fut
+
+    async def _run(self):
+        while self._waiters:
+            lane, _, fut, cost = self._waiters[0]
+            if fut.done():  # cancelled while queued
+                heapq.heappop(self._waiters)
+                continue
+            d = self.bucket.delay(cost)
+            if d > 0:
+                await asyncio.sleep(d)
+                continue
+            heapq.heappop(self._waiters)
+            self.bucket.take(cost)
+            fut.set_result(None)
+
+
+def message_cost(method) -> int:
+    # Telegram counts each item of an album as a message towards the bot-wide
+    # limit; within a chat, an album goes out as one send
+    if isinstance(method, SendMediaGroup):
+        return max(1, len(method.media))
+    return 1
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Session middleware that paces every chat-bound Bot API call through a
+    per-chat token bucket and a shared global one, and retries flood-control
+    (429) answers after the delay Telegram asks for. A 429 doesn't say which
+    limit was hit: it pauses the chat's bucket, and the global one as well
+    once a second chat is told to wait while the first still is, which is
+    what hitting the bot-wide limit looks like. One chat's flood-wait alone
+    doesn't hold up the others.
+    """
+
+    def __init__(self, chat_rate: float = CHAT_RATE, chat_burst: float = CHAT_BURST,
+                 global_rate: float = GLOBAL_RATE, global_burst: float = GLOBAL_BURST,
+                 max_retries: int = MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.gate = PriorityGate(TokenBucket(global_rate, global_burst))
+        self._chats: Dict[int, TokenBucket] = {}
+        # chat -> monotonic time its last flood-wait ends
+        self._flooded: Dict[int, float] = {}
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.wait_seconds = 0.0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10_000:
+                # full buckets carry no state; forget them
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle()}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _flood_wait(self, chat_id, seconds: float) -> bool:
+        # records a 429 for ``chat_id``; True if another chat is waiting too
+        now = time.monotonic()
+        self._flooded = {c: until for c, until in self._flooded.items() if until > now}
+        others = any(c != chat_id for c in self._flooded)
+        self._flooded[chat_id] = max(self._flooded.get(chat_id, 0.0), now + seconds)
+        return others
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        bucket = self._chat_bucket(chat_id)
+        lane = _priority.get()
+        tokens = message_cost(method)
+        for attempt in range(self.max_retries + 1):
+            t0 = time.monotonic()
+            # The chat lock is FIFO and is held until the global gate lets the
+            # call through, so one chat's messages keep their order. The chat
+            # token is taken only then, when the message actually leaves.
+            async with bucket.lock:
+                while (d := bucket.delay()) > 0:
+                    await asyncio.sleep(d)
+                self.max_depth = max(self.max_depth, len(self.gate) + 1)
+                await self.gate.acquire(lane, tokens)
+                bucket.take()
+            self.wait_seconds += time.monotonic() - t0
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.retried += 1
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    raise
+                bucket.pause(e.retry_after)
+                if self._flood_wait(chat_id, e.retry_after):
+                    self.gate.bucket.pause(e.retry_after)
+                continue
+            self.sent += 1
+            return response
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "queue_depth": len(self.gate),
+            "queue_depth_interactive": self.gate.depth(INTERACTIVE),
+            "queue_depth_notification": self.gate.depth(NOTIFICATION),
+            "max_queue_depth": self.max_depth,
+            "avg_wait_ms": 1000 * self.wait_seconds / max(1, self.sent + self.retried),
+        }
@@ -0,0 +1,228 @@
+import asyncio
+import functools
+import logging
+import os
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.types import (FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle,
+                           InlineQueryResultCachedPhoto, InputMediaPhoto, InputTextMessageContent, Message)
+
+import cards
+import database as db
+import images
+
+log = logging.getLogger(__name__)
+
+# Telegram caps an album at 10 photos.
+ALBUM_SIZE = 10
+# Bot API requests a single result render may have in flight at once.
+SEND_CONCURRENCY = 4
+DESCRIPTION_PREVIEW = cards.DESCRIPTION_PREVIEW
+# listing buttons and whole page keyboards kept for reuse
+KEYBOARD_CACHE_SIZE = 4096
+
+
+# --- Listing cards
+# Views use the card stored with the row. One rendered here for an older row
+# is written back with ``save_cards`` once the reply has gone out.
+_unsaved: Dict[int, str] = {}
+
+
+def card(row) -> cards.Card:
+    stored = cards.load(row[12])
+    if stored is None:
+        stored = cards.for_row(row)
+        _unsaved[row[0]] = cards.dump(stored)
+    return stored
+
+
+async def save_cards():
+    if _unsaved:
+        items = [(text, part_id) for part_id, text in _unsaved.items()]
+        _unsaved.clear()
+        await db.set_cards(items)
+
+
+# --- Keyboards
+# Keyboards are built once per listing (or page of listings) and reused; they
+# are shared between sends, so never modify one that came from here.
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def listing_row(n: int, part_id: int) -> List[InlineKeyboardButton]:
+    return [InlineKeyboardButton(text=f"{n}. View Details", callback_data=f"view_{part_id}"),
+            InlineKeyboardButton(text="Contact Seller", callback_data=f"contact_{part_id}")]
+
+
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def page_keyboard(part_ids: Tuple[int, ...], extra: Tuple[Tuple[str, str], ...] = ()) -> InlineKeyboardMarkup:
+    # ``extra``: (text, callback_data) of a last row of buttons
+    keyboard = [listing_row(n, part_id) for n, part_id in enumerate(part_ids, 1)]
+    if extra:
+        keyboard.append([InlineKeyboardButton(text=text, callback_data=data) for text, data in extra])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def detail_keyboard(part_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Contact Seller",
+                                                                       callback_data=f"contact_{part_id}")]])
+
+
+# --- Photos
+# Photos go out by Telegram file_id. The file on disk is uploaded only when a
+# part has no file_id yet (or Telegram rejects it), and the id from that
+# upload is stored for every later view.
+def has_photo(row) -> bool:
+    return bool(row[10]) or bool(row[6] and os.path.exists(row[6]))
+
+
+async def answer_part_photo(message: Message, row, **kwargs) -> bool:
+    # Returns False if the part has no photo at all.
+    part_id, photo_path, photo_file_id = row[0], row[6], row[10]
+    if photo_file_id:
+        try:
+            await message.answer_photo(photo=photo_file_id, **kwargs)
+            return True
+        except TelegramBadRequest:
+            await db.set_photo_file_id(part_id, None)
+    if photo_path and os.path.exists(photo_path):
+        sent = await message.answer_photo(photo=FSInputFile(photo_path), **kwargs)
+        await db.set_photo_file_id(part_id, sent.photo[-1].file_id)
+        return True
+    return False
+
+
+async def _answer_album(message: Message, items: Sequence[Tuple[int, tuple]], use_file_ids: bool,
+                        thumbnails: bool = False):
+    entries = []
+    for n, row in items:
+        if use_file_ids and row[10]:
+            entries.append((n, row, row[10]))
+        elif thumbnails and images.thumb_path(row[6]):
+            entries.append((n, row, FSInputFile(images.thumb_path(row[6]))))
+        elif row[6] and os.path.exists(row[6]):
+            entries.append((n, row, FSInputFile(row[6])))
+    if not entries:
+        return
+    media = [InputMediaPhoto(media=source, caption=f"{n}. {card(row).album}") for n, row, source in entries]
+    if len(media) == 1:
+        # albums need at least two items
+        sent = [await message.answer_photo(photo=media[0].media, caption=media[0].caption)]
+    else:
+        sent = await message.answer_media_group(media=media)
+    for (_, row, source), msg in zip(entries, sent):
+        # a thumbnail's file_id must not stand in for the full photo
+        if isinstance(source, FSInputFile) and source.path == row[6]:
+            await db.set_photo_file_id(row[0], msg.photo[-1].file_id)
+
+
+async def send_album(message: Message, items: Sequence[Tuple[int, tuple]], slots: asyncio.Semaphore,
+                     thumbnails: bool = False):
+    async with slots:
+        try:
+            await _answer_album(message, items, use_file_ids=True, thumbnails=thumbnails)
+        except TelegramBadRequest:
+            # a stored file_id went stale; forget them and upload from disk
+            for _, row in items:
+                if row[10]:
+                    await db.set_photo_file_id(row[0], None)
+            try:
+                await _answer_album(message, items, use_file_ids=False, thumbnails=thumbnails)
+            except TelegramAPIError as e:
+                log.warning("album send failed: %s", e)
+        except TelegramAPIError as e:
+            # the numbered list below still carries every result
+            log.warning("album send failed: %s", e)
+
+
+# --- Result lists
+# A page of results is delivered as photo albums (up to 10 per album, sent
+# concurrently) followed by one message holding a numbered list and a button
+# row per item, instead of one message per result.
+def listing_message(rows: Sequence[tuple], header: str,
+                    extra_buttons: Optional[List[InlineKeyboardButton]] = None) -> Tuple[str, InlineKeyboardMarkup]:
+    # Markdown text and keyboard of a numbered list of listings
+    text = "\n\n".join([header] + [f"*{n}.* {card(row).line}" for n, row in enumerate(rows, 1)])
+    extra = tuple((b.text, b.callback_data) for b in extra_buttons or ())
+    return text, page_keyboard(tuple(row[0] for row in rows), extra)
+
+
+def admin_line(n: int, row) -> str:
+    line = (f"{n}. ID: {row[0]}\n"
+            f"Name: {row[3]}\n"
+            f"VIN: {row[1]}\n"
+            f"Price: {row[4]} AZN\n"
+            f"Uploaded by: @{row[8] if row[8] else row[7]}")
+    if row[11]:
+        line += f"\n⚠️ Possible duplicate of ID {row[11]}"
+    return line
+
+
+def admin_buttons(n: int, row) -> List[InlineKeyboardButton]:
+    return [InlineKeyboardButton(text=f"🗑 Delete {n} (ID {row[0]})", callback_data=f"admin_delete_{row[0]}"),
+            InlineKeyboardButton(text=f"⛔ Ban seller {n}", callback_data=f"admin_banuser_{row[7]}")]
+
+
+async def send_results(message: Message, rows: Sequence[tuple], header: str,
+                       line: Optional[Callable[[int, tuple], str]] = None,
+                       buttons: Optional[Callable[[int, tuple], List[InlineKeyboardButton]]] = None,
+                       extra_buttons: Optional[List[InlineKeyboardButton]] = None,
+                       parse_mode: Optional[str] = "Markdown", thumbnails: bool = False):
+    # Listing cards unless ``line``/``buttons`` render the rows some other way.
+    # ``thumbnails`` sends the small copies of photos that have to be uploaded.
+    numbered = list(enumerate(rows, 1))
+    with_photo = [item for item in numbered if has_photo(item[1])]
+    albums = [with_photo[i:i + ALBUM_SIZE] for i in range(0, len(with_photo), ALBUM_SIZE)]
+    slots = asyncio.Semaphore(SEND_CONCURRENCY)
+    await asyncio.gather(*(send_album(message, album, slots, thumbnails) for album in albums))
+
+    if line is None:
+        text, markup = listing_message(rows, header, extra_buttons)
+    else:
+        text = "\n\n".join([header] + [line(n, row) for n, row in numbered])
+        keyboard = [buttons(n, row) for n, row in numbered]
+        if extra_buttons:
+            keyboard.append(extra_buttons)
+        markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
+    try:
+        await message.answer(text, parse_mode=parse_mode, reply_markup=markup)
+    except TelegramBadRequest as e:
+        if parse_mode is None or "can't parse entities" not in str(e):
+            raise
+        # one badly formatted entry must not cost the whole page its list
+        log.warning("result list sent unformatted: %s", e)
+        await message.answer(text, parse_mode=None, reply_markup=markup)
+    await save_cards()
+
+
+# --- Inline mode
+# Results of "@bot <query>" land in someone else's chat, where callback
+# buttons would reach the bot without a message to answer; the button is a
+# deep link that opens the listing in a private chat with the bot instead.
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def open_in_bot_keyboard(bot_username: str, part_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="🔎 Open in bot", url=f"https://t.me/{bot_username}?start=part_{part_id}")]])
+
+
+def inline_result(row, bot_username: str):
+    part_id, name, price, description, photo_file_id = row[0], row[3], row[4], row[5] or "", row[10]
+    kb = open_in_bot_keyboard(bot_username, part_id)
+    summary = f"💰 {price} AZN · {description[:DESCRIPTION_PREVIEW]}"
+    if photo_file_id:
+        return InlineQueryResultCachedPhoto(id=str(part_id), photo_file_id=photo_file_id, title=name,
+                                            description=summary, caption=card(row).detail, parse_mode="Markdown",
+                                            reply_markup=kb)
+    return InlineQueryResultArticle(id=str(part_id), title=name, description=summary, reply_markup=kb,
+                                    input_message_content=InputTextMessageContent(message_text=card(row).detail,
+                                                                                  parse_mode="Markdown"))
+
+
+# --- Admin trends
+SPARK = "▁▂▃▄▅▆▇█"
+
+
+def sparkline(values: Sequence[int]) -> str:
+    # one character per value, scaled to the largest; zero is a blank
+    top = max(values, default=0)
+    return "".join(SPARK[v * (len(SPARK) - 1) // top] if v else " " for v in values)
@@ -0,0 +1,358 @@
+import asyncio
+import hmac
+import logging
+import os
+import secrets
+import signal
+import sys
+import zlib
+from typing import List, Optional
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+from dotenv import load_dotenv
+
+import database as db
+import webhook
+
+load_dotenv()
+log = logging.getLogger(__name__)
+
+# Runs the bot as WORKERS processes (bot.py with RUN_MODE "worker") behind
+# this one, which takes the updates from Telegram, by polling or webhook like
+# bot.py does, and hands each to the worker picked by a hash of its chat id. A
+# chat always lands on the same worker, so its FSM flow stays in one process
+# and its updates arrive in order. Workers share the SQLite database and keep
+# their caches coherent as described in database.py ("Worker processes").
+# Only SQLite's write lock orders their writes, so one worker's bulk import
+# holds up the others' writes; they wait busy_timeout, then retry as set by
+# WRITE_RETRIES, and fail with "database is locked" past that.
+#
+# SIGHUP restarts the workers one at a time: a worker's updates are held while
+# it drains and its replacement starts, then handed to the new process, so
+# none are lost or reordered. A worker that dies is replaced the same way.
+#
+#   WORKERS=4 python supervisor.py
+
+# === CONFIG ===
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+# how this process gets updates: "polling" (default) or "webhook"
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# random on every start unless set; the webhook is registered with it either way
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", "8080")))
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 1)))
+# worker i listens on 127.0.0.1:WORKER_BASE_PORT + i, and serves metrics on
+# METRICS_PORT + i when METRICS_PORT is set
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8200"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# QUERY_CACHE_TTL for workers unless set: how long one may serve a listing
+# another has deleted or changed
+WORKER_CACHE_TTL = os.getenv("WORKER_CACHE_TTL", "30")
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+# updates handed to a worker per request
+BATCH_SIZE = 100
+# updates held per worker; when that many wait, taking new ones waits too
+QUEUE_SIZE = 1000
+POLL_TIMEOUT = 30
+RETRY_DELAY = 1.0
+MAX_RESTART_DELAY = 60.0
+STARTUP_TIMEOUT = 60.0
+# longer than a worker's own shutdown timeout (see webhook.WebhookServer)
+STOP_TIMEOUT = 45.0
+
+
+def chat_id(update: dict) -> int:
+    # updates without a chat (inline queries, ...) go by the user, so they
+    # follow the user's private chat
+    for kind, body in update.items():
+        if not isinstance(body, dict):
+            continue
+        message = body.get("message") if kind == "callback_query" else body
+        chat = (message or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = body.get("from") or body.get("user")
+        if user:
+            return user["id"]
+    return 0
+
+
+def shard(update: dict, workers: int) -> int:
+    return zlib.crc32(str(chat_id(update)).encode()) % workers
+
+
+class Worker:
+    """One worker process and the updates waiting for it. ``ready`` is set
+    while the process takes updates; updates taken off the queue stay in
+    ``held`` until the worker has accepted them."""
+
+    def __init__(self, index: int, env: dict):
+        self.index = index
+        self.port = WORKER_BASE_PORT + index
+        self.env = env
+        self.queue: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+        self.held: List[dict] = []
+        self.ready = asyncio.Event()
+        # held by whoever is stopping or starting the process
+        self.lock = asyncio.Lock()
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.info: dict = {}
+        self.forwarded = 0
+        self.restarts = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def pending(self) -> int:
+        return self.queue.qsize() + len(self.held)
+
+    async def start(self, http: ClientSession):
+        # own session, so a Ctrl+C in the terminal reaches only the supervisor
+        self.process = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, env=self.env,
+                                                            start_new_session=True)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + STARTUP_TIMEOUT
+        while True:
+            if self.process.returncode is not None:
+                raise RuntimeError(f"worker {self.index} exited with {self.process.returncode} on startup")
+            try:
+                async with http.get(f"{self.url}/healthz") as r:
+                    if r.status == 200:
+                        self.info = await r.json()
+                        break
+            except ClientError:
+                pass
+            if loop.time() > deadline:
+                self.kill_group()
+                await self.process.wait()
+                raise RuntimeError(f"worker {self.index} not up after {STARTUP_TIMEOUT:.0f}s")
+            await asyncio.sleep(0.1)
+        self.ready.set()
+
+    async def stop(self):
+        self.ready.clear()
+        if self.process is None or self.process.returncode is not None:
+            return
+        # the worker finishes the updates it accepted before it exits
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning("worker %d did not stop in %.0fs; killing it", self.index, STOP_TIMEOUT)
+            self.kill_group()
+            await self.process.wait()
+
+    def kill_group(self):
+        # with the worker's own children, such as its image hashing processes
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    async def forward(self, http: ClientSession, secret: str):
+        headers = {webhook.SECRET_HEADER: secret}
+        while True:
+            if not self.held:
+                self.held.append(await self.queue.get())
+                while len(self.held) < BATCH_SIZE and not self.queue.empty():
+                    self.held.append(self.queue.get_nowait())
+            await self.ready.wait()
+            try:
+                async with http.post(f"{self.url}{webhook.WORKER_PATH}", json=self.held, headers=headers) as r:
+                    if r.status == 400:
+                        # the worker could not read the batch; sending it again won't help
+                        log.warning("worker %d rejected a batch of %d updates", self.index, len(self.held))
+                        accepted = len(self.held)
+                    else:
+                        accepted = (await r.json())["accepted"] if r.status in (200, 503) else 0
+            except (ClientError, ValueError, KeyError):
+                accepted = 0
+            self.forwarded += accepted
+            del self.held[:accepted]
+            if self.held:
+                # the worker is closing or gone; the rest goes to its replacement
+                await asyncio.sleep(0.1)
+
+    def status(self) -> dict:
+        return {"worker": self.index, "pid": self.process.pid if self.process else None,
+                "ready": self.ready.is_set(), "pending": self.pending, "forwarded": self.forwarded,
+                "restarts": self.restarts}
+
+
+class Supervisor:
+    def __init__(self, workers: int = WORKERS):
+        self.secret = secrets.token_urlsafe(16)
+        self.workers = [Worker(i, self._worker_env(i, workers)) for i in range(workers)]
+        self.http: Optional[ClientSession] = None
+        self.stopping = False
+        self._restart: Optional[asyncio.Task] = None
+
+    def _worker_env(self, index: int, workers: int) -> dict:
+        env = dict(os.environ, RUN_MODE="worker", WORKERS=str(workers), WORKER_INDEX=str(index),
+                   WORKER_PORT=str(WORKER_BASE_PORT + index), WORKER_SECRET=self.secret,
+                   METRICS_PORT=str(METRICS_PORT + index if METRICS_PORT else 0))
+        env.setdefault("QUERY_CACHE_TTL", WORKER_CACHE_TTL)
+        return env
+
+    async def dispatch(self, update: dict):
+        await self.workers[shard(update, len(self.workers))].queue.put(update)
+
+    async def _start(self, worker: Worker):
+        delay = RETRY_DELAY
+        while True:
+            try:
+                await worker.start(self.http)
+                return
+            except (RuntimeError, OSError) as e:
+                log.error("%s; retrying in %.0fs", e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RESTART_DELAY)
+
+    async def _watch(self, worker: Worker):
+        # replaces a worker that exits on its own
+        while True:
+            process = worker.process
+            code = await process.wait()
+            async with worker.lock:
+                if self.stopping:
+                    return
+                if worker.process is not process:  # restarted meanwhile
+                    continue
+                log.warning("worker %d exited with %s; restarting it", worker.index, code)
+                worker.kill_group()
+                worker.ready.clear()
+                worker.restarts += 1
+                await self._start(worker)
+
+    async def rolling_restart(self):
+        for worker in self.workers:
+            async with worker.lock:
+                if self.stopping:
+                    return
+                await worker.stop()
+                await self._start(worker)
+                worker.restarts += 1
+            log.info("worker %d restarted", worker.index)
+
+    def request_restart(self):
+        if self._restart is None or self._restart.done():
+            self._restart = asyncio.create_task(self.rolling_restart())
+
+    async def api(self, method: str, **params):
+        # raw Bot API call; updates are passed on as JSON without being parsed
+        async with self.http.post(f"{TELEGRAM_API_URL}/bot{BOT_TOKEN}/{method}", json=params,
+                                  timeout=ClientTimeout(total=POLL_TIMEOUT + 10)) as r:
+            body = await r.json()
+        if not body.get("ok"):
+            raise RuntimeError(f"{method} failed: {body.get('description')}")
+        return body["result"]
+
+    async def poll(self, allowed_updates: List[str]):
+        await self.api("deleteWebhook")
+        offset = None
+        while True:
+            try:
+                updates = await self.api("getUpdates", offset=offset, timeout=POLL_TIMEOUT,
+                                         allowed_updates=allowed_updates)
+            except (ClientError, asyncio.TimeoutError, ValueError, RuntimeError) as e:
+                log.warning("%s; retrying in %.0fs", e, RETRY_DELAY)
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+            for update in updates:
+                await self.dispatch(update)
+                offset = update["update_id"] + 1
+
+    async def receive(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(webhook.SECRET_HEADER, ""), WEBHOOK_SECRET):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+            worker = self.workers[shard(update, len(self.workers))]
+        except (ValueError, AttributeError, KeyError, TypeError) as e:
+            # acknowledged and dropped, as by the worker's webhook server
+            log.warning("dropped malformed update: %r", e)
+            return web.Response()
+        # waits while the worker's queue is full, which pushes back on Telegram
+        await worker.queue.put(update)
+        return web.Response()
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "closing" if self.stopping else "ok",
+                                  "workers": [w.status() for w in self.workers]})
+
+    async def _drain(self):
+        # hands out what was already taken from Telegram before the workers stop
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + STOP_TIMEOUT
+        while any(w.pending for w in self.workers) and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        lost = sum(w.pending for w in self.workers)
+        if lost:
+            log.warning("stopped with %d updates not handed to a worker", lost)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        loop.add_signal_handler(signal.SIGHUP, self.request_restart)
+        self.http = ClientSession(timeout=ClientTimeout(total=None, connect=5))
+        tasks = []
+        runner = None
+        try:
+            await asyncio.gather(*(self._start(w) for w in self.workers))
+            for worker in self.workers:
+                tasks.append(asyncio.create_task(worker.forward(self.http, self.secret)))
+                tasks.append(asyncio.create_task(self._watch(worker)))
+            allowed_updates = self.workers[0].info["allowed_updates"]
+            if RUN_MODE == "webhook":
+                app = web.Application()
+                app.router.add_post(WEBHOOK_PATH, self.receive)
+                app.router.add_get("/healthz", self.health)
+                runner = web.AppRunner(app, access_log=None)
+                await runner.setup()
+                await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+                await self.api("setWebhook", url=f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+                               secret_token=WEBHOOK_SECRET, max_connections=100, allowed_updates=allowed_updates)
+            print(f"Supervisor running {len(self.workers)} workers ({RUN_MODE})")
+            waits = [asyncio.create_task(stop.wait())]
+            if RUN_MODE != "webhook":
+                waits.append(asyncio.create_task(self.poll(allowed_updates)))
+            done, pending = await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            for task in done:
+                task.result()
+            if runner is not None:
+                await runner.cleanup()
+                runner = None
+            await self._drain()
+        finally:
+            self.stopping = True
+            if runner is not None:
+                await runner.cleanup()
+            if self._restart is not None:
+                self._restart.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*(w.stop() for w in self.workers))
+            await self.http.close()
+
+
+async def main():
+    logging.basicConfig(level=logging.INFO)
+    # migrations run once here rather than racing in every worker
+    db.init_db()
+    db.close()
+    await Supervisor().run()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
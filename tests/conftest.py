@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # a fresh, fully migrated database in a scratch working directory
+    monkeypatch.chdir(tmp_path)
+    database.configure(str(tmp_path / "test.db"))
+    database.init_db()
+    yield database
+    database.configure()
@@ -0,0 +1,32 @@
+import random
+
+from alerts import IntervalIndex
+
+
+def test_interval_index_matches_a_scan():
+    rnd = random.Random(1)
+    index, intervals = IntervalIndex(), {}
+    # enough changes to go through several rebuilds, with removals and
+    # re-adds both before and after one
+    for step in range(3000):
+        item = rnd.randrange(800)
+        if item in intervals and rnd.random() < 0.3:
+            index.remove(item)
+            del intervals[item]
+        else:
+            lo = rnd.uniform(0, 1000)
+            intervals[item] = (lo, lo + rnd.choice([0, 1, 50, 400]))
+            index.add(item, *intervals[item])
+        if step % 100 == 0:
+            for x in [rnd.uniform(-10, 1500) for _ in range(20)] + [lo]:
+                assert sorted(index.stab(x)) == sorted(i for i, (a, b) in intervals.items() if a <= x <= b)
+    assert len(index) == len(intervals)
+
+
+def test_interval_index_endpoints_are_closed():
+    index = IntervalIndex()
+    index.add(1, 10, 20)
+    index.add(2, 20, 20)
+    assert sorted(index.stab(20)) == [1, 2]
+    assert list(index.stab(10)) == [1]
+    assert list(index.stab(20.5)) == []
@@ -0,0 +1,33 @@
+import pytest
+
+import cards
+import render
+from tg_markdown import parse
+
+NAMES = ["Brake_pad *new*", "[OEM] `1K0`", "a*b_c[d`e", "*", "_", "  spaced  out  ", "Plain pad"]
+
+
+@pytest.mark.parametrize("name", NAMES)
+def test_bold_parses_back_to_the_text(name):
+    plain, entities = parse(cards.bold(name))
+    assert plain == name
+    assert all(kind == "bold" for kind, _ in entities)
+
+
+@pytest.mark.parametrize("name", NAMES)
+def test_card_texts_parse(name):
+    card = cards.render("WVW`ZZZ", "1K0_698*151", name, 50.0, "left_side *used* [ok]", 7, "dealer_one")
+    line, _ = parse(f"*1.* {card.line}")
+    detail, _ = parse(card.detail)
+    assert f"1. {name} — 💰 50.0 AZN" in line
+    assert name in detail
+    assert "left_side *used* [ok]" in detail
+    assert "@dealer_one" in detail
+
+
+def test_listing_message_parses():
+    rows = [(i, "", "", name, 10.0, "", "", 1, None, "", None, None, None) for i, name in enumerate(NAMES, 1)]
+    text, _ = render.listing_message(rows, "🔍 Results for: " + cards.bold("brake_pad"))
+    plain, _ = parse(text)
+    assert "Results for: brake_pad" in plain
+    assert all(f"{n}. {name} —" in plain for n, name in enumerate(NAMES, 1))
@@ -0,0 +1,126 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+import fsm_storage
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+OTHER = StorageKey(bot_id=1, chat_id=11, user_id=11)
+
+
+class Clock:
+    # stands in for the time module in fsm_storage
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(fsm_storage, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def backend(request):
+    # a factory of storages over one shared backend, as separate processes see it
+    if request.param == "sqlite":
+        request.getfixturevalue("db")
+        return lambda **kwargs: fsm_storage.SQLiteStorage(**kwargs)
+    redis = fsm_storage.MemoryRedis()
+    return lambda **kwargs: fsm_storage.RedisStorage(redis, **kwargs)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_writes_to_one_chat_coalesce(backend):
+    async def scenario():
+        storage = backend()
+        await storage.set_state(KEY, "Upload:name")
+        await storage.update_data(KEY, {"vin": "WVW"})
+        await storage.update_data(KEY, {"oem": "1K0"})
+        await storage.set_state(OTHER, "Search:query")
+        assert storage.writes == 0
+        await asyncio.sleep(storage.flush_delay * 3)
+        assert (storage.staged, storage.writes) == (4, 1)
+        fresh = backend()
+        assert await fresh.get_state(KEY) == "Upload:name"
+        assert await fresh.get_data(KEY) == {"vin": "WVW", "oem": "1K0"}
+        assert await fresh.get_state(OTHER) == "Search:query"
+    run(scenario())
+
+
+def test_records_expire_after_the_ttl(backend, clock):
+    async def scenario():
+        storage = backend(ttl=60)
+        await storage.set_state(KEY, "Upload:name")
+        await storage.flush()
+        clock.now += 59
+        assert await backend().get_state(KEY) == "Upload:name"
+        clock.now += 2
+        fresh = backend()
+        assert await fresh.get_state(KEY) is None
+        assert await fresh.get_data(KEY) == {}
+    run(scenario())
+
+
+def test_cleared_records_are_deleted(backend):
+    async def scenario():
+        storage = backend()
+        await storage.set_state(KEY, "Upload:name")
+        await storage.set_data(KEY, {"vin": "WVW"})
+        await storage.flush()
+        await storage.set_state(KEY, None)
+        await storage.flush()
+        assert await backend().get_data(KEY) == {"vin": "WVW"}
+        await storage.set_data(KEY, {})
+        await storage.flush()
+        fresh = backend()
+        assert (await fresh.get_state(KEY), await fresh.get_data(KEY)) == (None, {})
+        return storage
+    storage = run(scenario())
+    if isinstance(storage, fsm_storage.RedisStorage):
+        assert storage.redis._values == {}
+    else:
+        with fsm_storage.db.get_pool().connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM fsm_state").fetchone()[0] == 0
+
+
+def test_failed_flush_is_retried(backend):
+    async def scenario():
+        storage = backend()
+        write_many = storage._write_many
+        calls = []
+
+        async def failing_once(records):
+            calls.append(dict(records))
+            if len(calls) == 1:
+                raise ConnectionError("backend down")
+            await write_many(records)
+        storage._write_many = failing_once
+        await storage.set_state(KEY, "Upload:name")
+        with pytest.raises(ConnectionError):
+            await storage.flush()
+        # still served from memory, and still queued
+        assert await storage.get_state(KEY) == "Upload:name"
+        assert storage.stats()["pending"] == 1
+        assert await backend().get_state(KEY) is None
+        # a newer write replaces the failed one rather than being overwritten by it
+        await storage.update_data(KEY, {"vin": "WVW"})
+        await storage.flush()
+        assert storage.stats()["pending"] == 0
+        fresh = backend()
+        assert await fresh.get_state(KEY) == "Upload:name"
+        assert await fresh.get_data(KEY) == {"vin": "WVW"}
+        await storage.close()
+    run(scenario())
@@ -0,0 +1,37 @@
+import random
+
+from hamming import MultiIndexHash
+
+
+def flip(h, bits, rnd):
+    for b in rnd.sample(range(64), bits):
+        h ^= 1 << b
+    return h
+
+
+def test_multi_index_hash_finds_everything_within_the_radius():
+    rnd = random.Random(2)
+    index, stored = MultiIndexHash(), {}
+    for item in range(2000):
+        stored[item] = rnd.getrandbits(64)
+        index.add(item, stored[item])
+    base = stored[7]
+    for item, bits in enumerate(range(12), 10_000):
+        stored[item] = flip(base, bits, rnd)
+        index.add(item, stored[item])
+    for radius in (0, 3, 6, 10):
+        found = index.search(base, radius)
+        expected = sorted(((h ^ base).bit_count(), i) for i, h in stored.items() if (h ^ base).bit_count() <= radius)
+        assert found == expected
+
+
+def test_multi_index_hash_replace_and_remove():
+    index = MultiIndexHash()
+    index.add(1, 0)
+    index.add(2, 0b111)
+    index.add(1, 0xFF << 56)
+    assert index.search(0, 3) == [(3, 2)]
+    index.remove(2)
+    assert index.search(0, 3) == []
+    assert 1 in index and 2 not in index and len(index) == 1
+    assert index.search(0xFF << 56, 0) == [(0, 1)]
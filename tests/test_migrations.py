@@ -0,0 +1,80 @@
+import sqlite3
+
+import pytest
+
+import database
+
+# the schema and ban file of the bot before it had migrations
+BASELINE_PARTS = """
+CREATE TABLE IF NOT EXISTS parts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    vin TEXT,
+    oem TEXT,
+    name TEXT,
+    price REAL,
+    description TEXT,
+    photo_path TEXT,
+    uploader_id INTEGER,
+    uploader_username TEXT,
+    upload_date TEXT
+)
+"""
+BASELINE_BANS = """
+CREATE TABLE IF NOT EXISTS banned_users (
+    user_id INTEGER PRIMARY KEY,
+    reason TEXT,
+    banned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+ROWS = [
+    ("WVWZZZ1JZXW000001", "1K0-698-151", "Brake pad set", 50.0, "front axle", "images/a.jpg", 1, "anna",
+     "2024-03-01T10:00:00"),
+    ("", "06A 115 561B", "Oil filter", 12.5, "", "images/b.jpg", 2, None, "2024-03-02T11:00:00"),
+    ("", "", "Side mirror", 80.0, "left, heated", "images/c.jpg", 1, "anna", "2024-03-02T12:00:00"),
+]
+
+
+@pytest.fixture
+def baseline(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "carparts.db")
+    conn = sqlite3.connect(path)
+    conn.execute(BASELINE_PARTS)
+    conn.executemany("""INSERT INTO parts (vin, oem, name, price, description, photo_path, uploader_id,
+                        uploader_username, upload_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", ROWS)
+    conn.commit()
+    conn.close()
+    legacy = sqlite3.connect(database.LEGACY_BAN_DB)
+    legacy.execute(BASELINE_BANS)
+    legacy.execute("INSERT INTO banned_users (user_id, reason, banned_at) VALUES (99, 'spam', '2024-02-01 09:00:00')")
+    legacy.commit()
+    legacy.close()
+    database.configure(path)
+    yield path
+    database.configure()
+
+
+def test_baseline_migrates_to_latest(baseline):
+    database.init_db()
+    with database.get_pool().connection() as conn:
+        assert database.schema_version(conn) == len(database.MIGRATIONS)
+        assert database.migrate(conn) == 0
+    assert database.count_parts.sync() == 3
+    stats = database.get_stats.sync()
+    assert (stats["listings"], stats["uploads"], stats["users"]) == (3, 3, 1)
+    assert database.banned_user_ids.sync() == [99]
+
+
+def test_baseline_rows_are_searchable(baseline):
+    database.init_db()
+    assert [row[0] for row in database.search_parts_by_keyword.sync("brake")] == [1]
+    assert [row[0] for row in database.search_parts_by_oem.sync("06a115561b")] == [2]
+    assert [row[0] for row in database.search_parts_by_vin.sync("WVWZZZ1JZXW000001")] == [1]
+    # one typo away, through the code_variants backfill
+    assert [row[0] for row in database.search_parts_by_oem.sync("1K0698152")] == [1]
+    assert [row[0] for row in database.search_parts_by_price_range.sync(40, 90)] == [1, 3]
+
+
+def test_baseline_rows_get_duplicate_keys(baseline):
+    database.init_db()
+    assert [row[0] for row in database.find_duplicates.sync(None, "06A115561B", "oil filter", 12.5)] == [2]
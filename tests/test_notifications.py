@@ -0,0 +1,17 @@
+import notifications
+from tg_markdown import parse
+
+NAMES = ["Brake_pad *new*", "[OEM] `1K0`", "mirror*"]
+
+
+def test_single_interest_parses():
+    plain, _ = parse(notifications.digest_text([("Brake_pad *new*", "@buyer_one")]))
+    assert "your listing Brake_pad *new*." in plain
+    assert "Buyer: @buyer_one" in plain
+
+
+def test_digest_parses():
+    interests = [(name, buyer) for name in NAMES for buyer in ("@a_b", "Jo *J*")]
+    plain, _ = parse(notifications.digest_text(interests))
+    for name in NAMES:
+        assert f"• {name} — @a_b, Jo *J*" in plain
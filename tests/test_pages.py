@@ -0,0 +1,75 @@
+import pytest
+
+
+def add(db, name="Brake pad", price=10.0, oem=""):
+    return db.add_part.sync("", oem, name, price, "", "", 1, None)
+
+
+def walk(fetch):
+    # every page from the first forward, then back again from the last one
+    forward = [fetch(None, False)]
+    while forward[-1].next_cursor is not None:
+        forward.append(fetch(forward[-1].next_cursor, False))
+    backward = [forward[-1]]
+    while backward[-1].prev_cursor is not None:
+        backward.append(fetch(backward[-1].prev_cursor, True))
+    return [page.rows for page in forward], [page.rows for page in reversed(backward)]
+
+
+def ids(pages):
+    return [[row[0] for row in rows] for rows in pages]
+
+
+def test_latest_pages_round_trip(db):
+    added = [add(db) for _ in range(12)]
+    forward, backward = walk(lambda cursor, back: db.get_latest_page.sync(cursor, back, limit=5))
+    assert ids(forward) == [added[:6:-1], added[6:1:-1], added[1::-1]]
+    assert backward == forward
+
+
+def test_price_pages_round_trip_across_ties(db):
+    prices = [30, 10, 20, 10, 20, 10, 40, 20, 10, 500]
+    added = [add(db, price=p) for p in prices]
+    forward, backward = walk(lambda cursor, back: db.search_price_page.sync(5, 100, cursor, back, limit=3))
+    expected = [i for _, i in sorted((p, i) for p, i in zip(prices, added) if p <= 100)]
+    assert [i for page in ids(forward) for i in page] == expected
+    assert [len(page) for page in forward] == [3, 3, 3]
+    assert backward == forward
+
+
+def test_oem_pages_round_trip(db):
+    same = [add(db, oem="1K0-698-151") for _ in range(7)]
+    add(db, oem="06A115561B")
+    forward, backward = walk(lambda cursor, back: db.search_oem_page.sync("1k0698151", cursor, back, limit=3))
+    assert ids(forward) == [same[:3:-1], same[3:0:-1], same[:1]]
+    assert backward == forward
+
+
+def test_ranked_pages_round_trip(db):
+    added = [add(db) for _ in range(8)]
+    order = added[::2] + added[1::2]
+    forward, backward = walk(lambda cursor, back: db.get_ranked_page.sync(order, cursor, back, limit=3))
+    assert ids(forward) == [order[:3], order[3:6], order[6:]]
+    assert backward == forward
+
+
+def test_ranked_pages_keep_positions_when_a_listing_goes(db):
+    order = [add(db) for _ in range(6)]
+    first = db.get_ranked_page.sync(order, limit=3)
+    db.delete_part.sync(order[1])
+    second = db.get_ranked_page.sync(order, first.next_cursor, limit=3)
+    assert [row[0] for row in second.rows] == order[3:]
+    back = db.get_ranked_page.sync(order, second.prev_cursor, True, limit=3)
+    assert [row[0] for row in back.rows] == [order[0], order[2]]
+
+
+@pytest.mark.parametrize("keyword", ["brake", "pad"])
+def test_keyword_ids_page_through_search_results(db, keyword):
+    for i in range(7):
+        add(db, name=f"Brake pad {i}")
+    add(db, name="Oil filter")
+    ranked = db.search_keyword_ids.sync(keyword)
+    assert len(ranked) == 7
+    forward, backward = walk(lambda cursor, back: db.get_ranked_page.sync(ranked, cursor, back, limit=5))
+    assert [i for page in ids(forward) for i in page] == ranked
+    assert backward == forward
@@ -0,0 +1,32 @@
+import pytest
+
+NAMES = ["brake_pad", "Brake-Pad/Set", "O'Neil bumper", "Crème brûlée", "Søren mirror", "ÜBER_kit",
+         "filter(oil)", "Škoda Octavia", "sensor#2", "hub.bearing", "Ærø lamp"]
+QUERIES = ["pad", "brake_pad", "brake pad", "set", "neil", "o'neil", "creme", "brûlée", "søren", "soren",
+           "über", "uber kit", "kit", "oil", "skoda", "2", "bear", "hub.b", "aerø", "ærø", "lamp_"]
+
+
+def add(db, name):
+    return db.add_part.sync("", "", name, 10.0, "", "", 1, None)
+
+
+@pytest.mark.parametrize("keyword", QUERIES)
+def test_keyword_predicate_agrees_with_sql(db, keyword):
+    ids = {add(db, name): name for name in NAMES}
+    found = {row[0] for row in db.search_parts_by_keyword.sync(keyword)}
+    match = db._keyword_match({"keyword": keyword})
+    for part_id, name in ids.items():
+        assert match(db._probe(part_id, "", "", name, 10.0, "")) == (part_id in found), name
+
+
+def test_insert_invalidates_cached_keyword_search(db):
+    assert db.search_parts_by_keyword.sync("pad") == []
+    part_id = add(db, "brake_pad")
+    assert [row[0] for row in db.search_parts_by_keyword.sync("pad")] == [part_id]
+
+
+def test_delete_invalidates_cached_keyword_search(db):
+    part_id = add(db, "Brake-Pad/Set")
+    assert [row[0] for row in db.search_parts_by_keyword.sync("set")] == [part_id]
+    db.delete_part.sync(part_id)
+    assert db.search_parts_by_keyword.sync("set") == []
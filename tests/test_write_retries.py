@@ -0,0 +1,44 @@
+import sqlite3
+import threading
+
+import pytest
+
+import database
+import metrics
+
+
+@pytest.fixture
+def busy_db(request, monkeypatch):
+    # gives up on the lock quickly, so that the retries are what waits
+    monkeypatch.setattr(database, "PRAGMAS", tuple(p for p in database.PRAGMAS if "busy_timeout" not in p)
+                        + ("PRAGMA busy_timeout=10",))
+    monkeypatch.setattr(database, "WRITE_RETRY_DELAY", 0.05)
+    return request.getfixturevalue("db")
+
+
+def hold_write_lock(path, seconds):
+    # another process's long transaction, as in a bulk import
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("BEGIN IMMEDIATE")
+    timer = threading.Timer(seconds, lambda: (conn.commit(), conn.close()))
+    timer.start()
+    return timer
+
+
+def test_locked_write_is_retried(busy_db):
+    before = metrics.DB_BUSY_RETRIES.value("add_part")
+    timer = hold_write_lock(busy_db.DB_PATH, 0.1)
+    part_id = busy_db.add_part.sync("", "", "Brake pad", 10.0, "", "", 1, None)
+    timer.join()
+    assert busy_db.count_parts.sync() == 1
+    assert busy_db.get_part_by_id.sync(part_id) is not None
+    assert metrics.DB_BUSY_RETRIES.value("add_part") > before
+
+
+def test_write_gives_up_after_the_retries(busy_db, monkeypatch):
+    monkeypatch.setattr(busy_db, "WRITE_RETRIES", 1)
+    timer = hold_write_lock(busy_db.DB_PATH, 1.0)
+    with pytest.raises(sqlite3.OperationalError, match="database is locked"):
+        busy_db.add_part.sync("", "", "Brake pad", 10.0, "", "", 1, None)
+    timer.join()
+    assert busy_db.count_parts.sync() == 0
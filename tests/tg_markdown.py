@@ -0,0 +1,48 @@
+# Telegram's legacy Markdown ("parse_mode=Markdown"), parsed the way the Bot
+# API does: a backslash escapes _ * ` [ outside of an entity only, entities
+# don't nest, and one left open is an error.
+from typing import List, Tuple
+
+SPECIAL = "_*`["
+
+
+class ParseError(ValueError):
+    pass
+
+
+def parse(text: str) -> Tuple[str, List[Tuple[str, str]]]:
+    """The plain text and the (kind, text) entities of ``text``."""
+    out, entities = [], []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == "\\" and text[i + 1:i + 2] in tuple(SPECIAL):
+            out.append(text[i + 1])
+            i += 2
+            continue
+        if c not in SPECIAL:
+            out.append(c)
+            i += 1
+            continue
+        if text.startswith("```", i):
+            end, kind, start = text.find("```", i + 3), "pre", i + 3
+            close = 3
+        elif c == "[":
+            end, kind, start = text.find("]", i + 1), "text_link", i + 1
+            close = 1
+        else:
+            end, kind, start = text.find(c, i + 1), {"_": "italic", "*": "bold", "`": "code"}[c], i + 1
+            close = 1
+        if end < 0:
+            raise ParseError(f"Can't find end of the entity starting at byte offset {i}")
+        inner = text[start:end]
+        i = end + close
+        if kind == "text_link" and text.startswith("(", i):
+            url_end = text.find(")", i)
+            if url_end < 0:
+                raise ParseError(f"Can't find end of a URL at byte offset {i}")
+            i = url_end + 1
+        out.append(inner)
+        if inner:
+            entities.append((kind, inner))
+    return "".join(out), entities
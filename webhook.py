@@ -0,0 +1,222 @@
+import asyncio
+import hmac
+import logging
+import secrets
+import signal
+from typing import Dict, Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import Update
+from pydantic import ValidationError
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# where a worker process takes updates from the supervisor
+WORKER_PATH = "/updates"
+
+
+class WebhookServer:
+    """Receives updates from Telegram over HTTPS (behind a proxy) and feeds
+    them to the dispatcher concurrently, with at most ``max_in_flight`` being
+    handled at once. When that many are running, new requests wait for a slot
+    before they are acknowledged, which pushes back on Telegram instead of
+    piling up tasks.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, path: str, secret: str,
+                 max_in_flight: int = 100, shutdown_timeout: float = 30.0):
+        if not secret:
+            raise ValueError("a webhook needs a secret token")
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.shutdown_timeout = shutdown_timeout
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._tasks: Set[asyncio.Task] = set()
+        self._closing = False
+        self.handled = 0
+        self.failed = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.router.add_get("/healthz", self.health)
+        app.on_shutdown.append(self._on_shutdown)
+        return app
+
+    def status(self) -> dict:
+        return {"status": "closing" if self._closing else "ok",
+                "in_flight": self.in_flight,
+                "handled": self.handled,
+                "failed": self.failed}
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response(self.status(), status=503 if self._closing else 200)
+
+    def _authorized(self, request: web.Request) -> bool:
+        return hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret)
+
+    async def _accept(self, data: dict) -> bool:
+        # starts handling the update; False once the server is closing
+        if self._closing:
+            return False
+        update = Update.model_validate(data, context={"bot": self.bot})
+        await self._slots.acquire()
+        if self._closing:
+            # shutdown may already be waiting on the tasks it saw
+            self._slots.release()
+            return False
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            return web.Response(status=401)
+        try:
+            accepted = await self._accept(await request.json())
+        except (ValueError, ValidationError) as e:
+            # acknowledged and dropped: Telegram would redeliver it forever on
+            # an error, holding up the updates behind it
+            self.failed += 1
+            log.warning("dropped malformed update: %s", e)
+            return web.Response()
+        if not accepted:
+            # Telegram redelivers on non-2xx, so nothing is lost
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+            self.handled += 1
+        except Exception:
+            self.failed += 1
+            log.exception("update %s failed", update.update_id)
+        finally:
+            self._slots.release()
+
+    async def _on_shutdown(self, app: web.Application):
+        # stop taking updates, then let the ones already accepted finish
+        self._closing = True
+        if self._tasks:
+            done, pending = await asyncio.wait(set(self._tasks), timeout=self.shutdown_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                log.warning("cancelled %d updates still running at shutdown", len(pending))
+
+
+class WorkerServer(WebhookServer):
+    """The local endpoint of a worker process run by supervisor.py. It takes
+    updates in batches, as a JSON array, and answers with how many of them it
+    accepted, in order, before it started closing; the supervisor hands the
+    rest to the worker that replaces this one.
+
+    Updates from one chat are handled one after another, in the order they
+    came, so a step of an FSM flow never overtakes the one before it, even
+    when a backlog held during a restart arrives in one batch.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str, index: int,
+                 max_in_flight: int = 100, shutdown_timeout: float = 30.0):
+        super().__init__(dp, bot, WORKER_PATH, secret, max_in_flight, shutdown_timeout)
+        self.index = index
+        # the last update task of each chat with one in flight
+        self._chains: Dict[int, asyncio.Task] = {}
+
+    def status(self) -> dict:
+        # the supervisor polls Telegram for the update types the handlers use
+        return dict(super().status(), worker=self.index, allowed_updates=self.dp.resolve_used_update_types())
+
+    async def _process(self, update: Update):
+        chat, user, _ = UserContextMiddleware.resolve_event_context(update)
+        key = chat.id if chat else user.id if user else None
+        if key is None:
+            return await super()._process(update)
+        task = asyncio.current_task()
+        previous = self._chains.get(key)
+        self._chains[key] = task
+        try:
+            if previous is not None:
+                await asyncio.wait((previous,))
+            await super()._process(update)
+        finally:
+            if self._chains.get(key) is task:
+                del self._chains[key]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            return web.Response(status=401)
+        try:
+            batch = await request.json()
+        except ValueError:
+            batch = None
+        if not isinstance(batch, list):
+            # the supervisor drops a batch answered with 400 instead of resending it
+            log.warning("dropped a batch that is not a JSON array of updates")
+            return web.Response(status=400)
+        accepted = 0
+        for data in batch:
+            try:
+                if not await self._accept(data):
+                    break
+            except (ValueError, ValidationError):
+                self.failed += 1
+                log.warning("dropped malformed update %s", data.get("update_id") if isinstance(data, dict) else data)
+            accepted += 1
+        return web.json_response({"accepted": accepted}, status=200 if accepted or not self._closing else 503)
+
+
+async def serve(server: WebhookServer, host: str, port: int, started=None):
+    # runs ``server`` until SIGINT/SIGTERM, then lets it drain; ``started`` is
+    # awaited once it is listening
+    runner = web.AppRunner(server.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    try:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+    except NotImplementedError:  # Windows
+        pass
+    try:
+        if started is not None:
+            await started()
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, base_url: str, path: str, secret: Optional[str],
+                      host: str, port: int, max_in_flight: int):
+    # without one anybody who finds the URL could post updates; a random
+    # secret is registered anew on every start
+    secret = secret or secrets.token_urlsafe(32)
+
+    async def register():
+        await bot.set_webhook(f"{base_url.rstrip('/')}{path}", secret_token=secret,
+                              max_connections=min(max_in_flight, 100),
+                              allowed_updates=dp.resolve_used_update_types())
+        print(f"Webhook listening on {host}:{port}{path}")
+
+    # the webhook stays registered on shutdown so a restarted instance picks
+    # up where this one stopped; Telegram holds updates meanwhile
+    await serve(WebhookServer(dp, bot, path, secret, max_in_flight), host, port, register)
+
+
+async def run_worker(dp: Dispatcher, bot: Bot, secret: str, index: int, port: int, max_in_flight: int):
+    async def started():
+        print(f"Worker {index} listening on 127.0.0.1:{port}{WORKER_PATH}")
+
+    await serve(WorkerServer(dp, bot, secret, index, max_in_flight), "127.0.0.1", port, started)